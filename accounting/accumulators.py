@@ -0,0 +1,133 @@
+import datetime
+import logging
+from collections import Counter
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+from accounting.counters import get_client
+
+logger = logging.getLogger(__name__)
+
+DELTAS_KEY = "accounting:daily-income:deltas"
+PENDING_KEY = "accounting:daily-income:pending"
+FLUSHING_DELTAS_KEY = "accounting:daily-income:deltas:flushing"
+FLUSHING_PENDING_KEY = "accounting:daily-income:pending:flushing"
+# pending deltas are moved to flushing keys atomically, unless a previous flush
+# is not finished, so incomes added during flush are kept for the next flush
+SNAPSHOT_SCRIPT = """
+if redis.call("EXISTS", KEYS[4]) == 0 and redis.call("EXISTS", KEYS[2]) == 1 then
+    redis.call("RENAME", KEYS[1], KEYS[3])
+    redis.call("RENAME", KEYS[2], KEYS[4])
+end
+"""
+
+
+def get_redis():
+    return get_client(settings.ACCOUNTING_DAILY_INCOME_REDIS_URL)
+
+
+def get_delta_field(courier_id, date):
+    return f"{courier_id}:{date.isoformat()}"
+
+
+def parse_delta_field(field):
+    courier_id, date = field.decode().split(":")
+    return int(courier_id), datetime.date.fromisoformat(date)
+
+
+def add_income(income):
+    """Accumulate income amount in redis to be flushed to daily income
+
+    amount is added to delta of courier in that date and income is added
+    to pending incomes in one redis transaction, it must be called after income
+    is committed. if redis is not available income remains active and it's
+    processed by process_failed_income_update.
+
+    Args:
+        income (accounting.models.Income): a saved instance of Income model
+    """
+    try:
+        pipeline = get_redis().pipeline()
+        pipeline.hincrby(
+            DELTAS_KEY,
+            get_delta_field(income.courier_id, income.created_at.date()),
+            income.get_signed_amount(),
+        )
+        pipeline.sadd(PENDING_KEY, income.id)
+        pipeline.execute()
+    except redis.RedisError:
+        logger.exception(f"Income {income.id} is not accumulated, it will be retried")
+
+
+def flush():
+    """Flush accumulated deltas to daily incomes
+
+    pending incomes are taken as a snapshot, locked, and amounts of the active ones
+    are applied to daily incomes with marking them as processed in one transaction.
+    incomes that are already processed, e.g. by a previous flush that is failed
+    before deleting snapshot or by process_failed_income_update, or do not exist
+    are skipped, so an income is never applied twice or without its row.
+    accumulated deltas are only compared with applied amounts to log drifts.
+
+    Returns:
+        int: number of processed incomes
+    """
+    income_model = apps.get_model("accounting", "Income")
+    daily_income_model = apps.get_model("accounting", "DailyIncome")
+    client = get_redis()
+    client.eval(
+        SNAPSHOT_SCRIPT,
+        4,
+        DELTAS_KEY,
+        PENDING_KEY,
+        FLUSHING_DELTAS_KEY,
+        FLUSHING_PENDING_KEY,
+    )
+    pending_ids = sorted(
+        int(income_id) for income_id in client.smembers(FLUSHING_PENDING_KEY)
+    )
+    if not pending_ids:
+        return 0
+    deltas = Counter(
+        {
+            parse_delta_field(field): int(amount)
+            for field, amount in client.hgetall(FLUSHING_DELTAS_KEY).items()
+        }
+    )
+    chunk_size = settings.ACCOUNTING_FAILED_INCOME_CHUNK_SIZE
+    with transaction.atomic():
+        incomes = []
+        for start in range(0, len(pending_ids), chunk_size):
+            end = start + chunk_size
+            incomes += (
+                income_model.objects.select_for_update()
+                .filter(id__in=pending_ids[start:end])
+                .order_by("id")
+            )
+        active_incomes = [income for income in incomes if not income.is_processed()]
+        active_ids = [income.id for income in active_incomes]
+        if len(incomes) != len(pending_ids):
+            logger.critical(
+                f"Accumulated incomes do not exist: "
+                f"{sorted(set(pending_ids) - {income.id for income in incomes})}"
+            )
+        processed_incomes = [income for income in incomes if income.is_processed()]
+        deltas.subtract(daily_income_model.get_incomes_amounts(processed_incomes))
+        amounts = daily_income_model.get_incomes_amounts(active_incomes)
+        deltas.subtract(amounts)
+        drifts = {key: amount for key, amount in deltas.items() if amount}
+        if drifts:
+            logger.warning(f"Accumulated deltas drift from their incomes: {drifts}")
+        amounts = {key: amount for key, amount in amounts.items() if amount}
+        if amounts:
+            daily_income_model.objects.add_amounts(amounts)
+        for start in range(0, len(active_ids), chunk_size):
+            end = start + chunk_size
+            income_model.objects.filter(id__in=active_ids[start:end]).update(
+                status=income_model.Status.PROCESSED
+            )
+    client.delete(FLUSHING_DELTAS_KEY, FLUSHING_PENDING_KEY)
+    return len(active_ids)
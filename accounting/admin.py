@@ -1,18 +1,83 @@
 from django.contrib import admin
+from django.db import transaction
+from django.template.response import TemplateResponse
 
-from accounting.models import DailyIncome, Income, WeeklyIncome
+from accounting.caches import bump_weekly_income_version
+from accounting.models import (
+    Checkpoint,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    IncomeRollup,
+    RunningWeeklyIncome,
+    WeeklyIncome,
+    WeeklyIncomeProgress,
+)
+from config.routers import prefer_replica
+
+
+class ReplicaModelAdmin(admin.ModelAdmin):
+    """Model admin that reads changelist from replica database, if it's configured"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        with prefer_replica():
+            response = super().changelist_view(request, extra_context)
+            # querysets of changelist are evaluated on render
+            if isinstance(response, TemplateResponse):
+                response.render()
+        return response
 
 
 @admin.register(Income)
-class IncomeAdmin(admin.ModelAdmin):
+class IncomeAdmin(ReplicaModelAdmin):
     pass
 
 
 @admin.register(DailyIncome)
-class DailyIncomeAdmin(admin.ModelAdmin):
+class DailyIncomeAdmin(ReplicaModelAdmin):
     pass
 
 
+@admin.register(DailyIncomeStripe)
+class DailyIncomeStripeAdmin(ReplicaModelAdmin):
+    list_display = ["courier", "date", "stripe", "amount"]
+
+
 @admin.register(WeeklyIncome)
-class WeeklyIncomeAdmin(admin.ModelAdmin):
+class WeeklyIncomeAdmin(ReplicaModelAdmin):
+    """cached weekly income responses are invalidated after weekly incomes are changed"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(bump_weekly_income_version)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(bump_weekly_income_version)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(bump_weekly_income_version)
+
+
+@admin.register(RunningWeeklyIncome)
+class RunningWeeklyIncomeAdmin(ReplicaModelAdmin):
     pass
+
+
+@admin.register(IncomeRollup)
+class IncomeRollupAdmin(ReplicaModelAdmin):
+    list_display = ["courier", "period", "date", "amount"]
+    list_filter = ["period"]
+
+
+@admin.register(WeeklyIncomeProgress)
+class WeeklyIncomeProgressAdmin(ReplicaModelAdmin):
+    list_display = ["date", "courier_from", "courier_to", "created_at"]
+
+
+@admin.register(Checkpoint)
+class CheckpointAdmin(ReplicaModelAdmin):
+    list_display = ["name", "position", "updated_at"]
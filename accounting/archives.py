@@ -0,0 +1,389 @@
+"""Columnar archive of processed incomes
+
+processed incomes of months older than ACCOUNTING_INCOME_ARCHIVE_MONTHS are written
+to one Arrow IPC file per month in ACCOUNTING_INCOME_ARCHIVE_DIR, verified against
+daily and weekly incomes and deleted from Income table in batches.
+months are UTC months of created_at, the same as daily incomes and Income partitions.
+archive files are memory-mapped on read and only needed columns are read,
+so historical totals of couriers are answered without Income table.
+"""
+import datetime
+import logging
+import re
+from collections import defaultdict
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+from accounting.exceptions import IncomeArchiveMismatch
+from accounting.partitions import get_month_bound
+from miare.utils import get_month_start, get_next_month_start, get_week_start
+
+logger = logging.getLogger(__name__)
+
+FILE_NAME_PATTERN = re.compile(r"^incomes-(\d{4})-(\d{2})\.arrow$")
+FIELDS = ["id", "courier_id", "type", "amount", "created_at", "updated_at"]
+SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("courier_id", pa.int64()),
+        ("type", pa.int8()),
+        ("amount", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+        ("date", pa.date32()),
+    ]
+)
+
+
+def get_directory():
+    return Path(settings.ACCOUNTING_INCOME_ARCHIVE_DIR)
+
+
+def get_archive_path(month):
+    return get_directory() / f"incomes-{month:%Y-%m}.arrow"
+
+
+def get_archived_months():
+    """Return months that have an archive file, ordered"""
+    directory = get_directory()
+    if not directory.is_dir():
+        return []
+    months = []
+    for path in directory.iterdir():
+        match = FILE_NAME_PATTERN.match(path.name)
+        if match:
+            months.append(datetime.date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def get_month_incomes(month):
+    income_model = apps.get_model("accounting", "Income")
+    return income_model.objects.filter(
+        created_at__gte=get_month_bound(month),
+        created_at__lt=get_month_bound(get_next_month_start(month)),
+    )
+
+
+def write_archive(month, path):
+    """Stream processed incomes of month into an Arrow IPC file, in chunks
+
+    file is written next to path and renamed when it's complete,
+    so a file in path is always a complete archive. if writing fails,
+    e.g. task time limit is exceeded, the incomplete file is removed.
+
+    Returns:
+        int: number of written incomes
+    """
+    income_model = apps.get_model("accounting", "Income")
+    rows = (
+        get_month_incomes(month)
+        .filter(status=income_model.Status.PROCESSED)
+        .order_by("id")
+        .values_list(*FIELDS)
+        .iterator(chunk_size=settings.ACCOUNTING_INCOME_ARCHIVE_CHUNK_SIZE)
+    )
+    options = pa.ipc.IpcWriteOptions(
+        compression=settings.ACCOUNTING_INCOME_ARCHIVE_COMPRESSION or None
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp")
+    written = 0
+    try:
+        with pa.ipc.new_file(temporary_path, SCHEMA, options=options) as writer:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == settings.ACCOUNTING_INCOME_ARCHIVE_CHUNK_SIZE:
+                    writer.write_batch(get_record_batch(chunk))
+                    written += len(chunk)
+                    chunk = []
+            if chunk:
+                writer.write_batch(get_record_batch(chunk))
+                written += len(chunk)
+    except Exception:
+        temporary_path.unlink(missing_ok=True)
+        raise
+    temporary_path.rename(path)
+    return written
+
+
+def get_record_batch(rows):
+    columns = [list(column) for column in zip(*rows)]
+    columns.append([created_at.date() for created_at in columns[4]])
+    return pa.RecordBatch.from_arrays(columns, schema=SCHEMA)
+
+
+def read_archive(path, columns=None):
+    """Read archive file by memory-mapping it
+
+    Args:
+        columns (List[str], optional): names of columns to read, all columns by default
+
+    Returns:
+        pyarrow.Table: archived incomes
+    """
+    options = pa.ipc.IpcReadOptions()
+    if columns:
+        options.included_fields = [SCHEMA.get_field_index(column) for column in columns]
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source, options=options).read_all()
+
+
+def get_signed_amounts(table):
+    income_model = apps.get_model("accounting", "Income")
+    return pc.if_else(
+        pc.equal(table["type"], income_model.Type.PUNISHMENT),
+        pc.negate(table["amount"]),
+        table["amount"],
+    )
+
+
+def get_archive_amounts(table):
+    """Sum signed amount of archived incomes per courier and date
+
+    Returns:
+        Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]: summation of signed amounts
+    """
+    report = (
+        pa.table(
+            {
+                "courier_id": table["courier_id"],
+                "date": table["date"],
+                "amount": get_signed_amounts(table),
+            }
+        )
+        .group_by(["courier_id", "date"])
+        .aggregate([("amount", "sum")])
+    )
+    return {
+        (courier_id, date): amount
+        for courier_id, date, amount in zip(
+            report["courier_id"].to_pylist(),
+            report["date"].to_pylist(),
+            report["amount_sum"].to_pylist(),
+        )
+    }
+
+
+def get_daily_amounts(month):
+    daily_income_model = apps.get_model("accounting", "DailyIncome")
+    stripe_model = apps.get_model("accounting", "DailyIncomeStripe")
+    filters = {"date__gte": month, "date__lt": get_next_month_start(month)}
+    amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+    for courier_id, date, amount in daily_income_model.objects.filter(
+        **filters
+    ).values_list("courier_id", "date", "amount"):
+        amounts[(courier_id, date)] += amount
+    for key, amount in stripe_model.objects.get_amounts(**filters).items():
+        amounts[key] += amount
+    return amounts
+
+
+def get_weekly_mismatches(month, archive_amounts):
+    """Compare weeks of month that weekly incomes are generated for with archive
+
+    only weeks that are completely in month are compared,
+    other weeks include incomes of other months.
+
+    Returns:
+        List[Tuple[courier_id(Int), date(Date)]]: courier weeks that do not match
+    """
+    weekly_income_model = apps.get_model("accounting", "WeeklyIncome")
+    next_month = get_next_month_start(month)
+    weekly_amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+    for (courier_id, date), amount in archive_amounts.items():
+        week_start = get_week_start(date)
+        if (
+            week_start >= month
+            and week_start + datetime.timedelta(days=7) <= next_month
+        ):
+            weekly_amounts[(courier_id, week_start)] += amount
+    weekly_incomes = {
+        (courier_id, date): amount
+        for courier_id, date, amount in weekly_income_model.objects.filter(
+            date__gte=month, date__lte=next_month - datetime.timedelta(days=7)
+        ).values_list("courier_id", "date", "amount")
+    }
+    generated_weeks = {date for _, date in weekly_incomes}
+    keys = {key for key in weekly_amounts if key[1] in generated_weeks}
+    keys |= set(weekly_incomes)
+    return sorted(
+        key for key in keys if weekly_amounts.get(key, 0) != weekly_incomes.get(key, 0)
+    )
+
+
+def verify_archive(month, table, count=None):
+    """Verify archive of month with daily and weekly incomes
+
+    Args:
+        count (int, optional): number of processed incomes of month in database
+
+    Raises:
+        IncomeArchiveMismatch: if archive does not match
+    """
+    if count is not None and table.num_rows != count:
+        raise IncomeArchiveMismatch(
+            f"archive of {month:%Y-%m} has {table.num_rows} incomes instead of {count}"
+        )
+    archive_amounts = get_archive_amounts(table)
+    daily_amounts = get_daily_amounts(month)
+    daily_mismatches = sorted(
+        key
+        for key in set(archive_amounts) | set(daily_amounts)
+        if archive_amounts.get(key, 0) != daily_amounts.get(key, 0)
+    )
+    if daily_mismatches:
+        raise IncomeArchiveMismatch(
+            f"archive of {month:%Y-%m} does not match daily incomes of "
+            f"{len(daily_mismatches)} courier dates, e.g. {daily_mismatches[:10]}"
+        )
+    weekly_mismatches = get_weekly_mismatches(month, archive_amounts)
+    if weekly_mismatches:
+        raise IncomeArchiveMismatch(
+            f"archive of {month:%Y-%m} does not match weekly incomes of "
+            f"{len(weekly_mismatches)} courier weeks, e.g. {weekly_mismatches[:10]}"
+        )
+
+
+def delete_archived_incomes(month, table):
+    """Delete archived incomes from Income table, in batches
+
+    each batch is deleted in its own transaction, so locks are held briefly,
+    only incomes that are in archive are deleted.
+
+    Returns:
+        int: number of deleted incomes
+    """
+    income_model = apps.get_model("accounting", "Income")
+    ids = table["id"].to_pylist()
+    batch_size = settings.ACCOUNTING_INCOME_ARCHIVE_DELETE_BATCH_SIZE
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        with transaction.atomic():
+            count, _ = (
+                get_month_incomes(month)
+                .filter(id__in=ids[start:end], status=income_model.Status.PROCESSED)
+                .delete()
+            )
+        deleted += count
+    return deleted
+
+
+def archive_month(month):
+    """Archive processed incomes of month and delete them from Income table
+
+    a month is not archived while it has unprocessed incomes. if archive file of month
+    exists, e.g. deletion is interrupted, it's verified again and deletion is resumed.
+
+    Returns:
+        int: number of deleted incomes
+
+    Raises:
+        IncomeArchiveMismatch: if archive does not match daily or weekly incomes,
+            nothing is deleted
+    """
+    income_model = apps.get_model("accounting", "Income")
+    month = get_month_start(month)
+    path = get_archive_path(month)
+    count = None
+    if not path.exists():
+        incomes = get_month_incomes(month)
+        if incomes.filter(status=income_model.Status.ACTIVE).exists():
+            logger.warning(f"incomes of {month:%Y-%m} are not archived, not processed")
+            return 0
+        count = incomes.count()
+        if not count:
+            return 0
+        write_archive(month, path)
+    table = read_archive(path)
+    verify_archive(month, table, count)
+    deleted = delete_archived_incomes(month, table)
+    logger.info(f"{deleted} incomes of {month:%Y-%m} are archived to {path}")
+    return deleted
+
+
+def archive_incomes(before):
+    """Archive processed incomes of months before a month
+
+    Args:
+        before (datetime.date): incomes of months before this month are archived
+
+    Returns:
+        int: number of deleted incomes
+    """
+    income_model = apps.get_model("accounting", "Income")
+    before = get_month_start(before)
+    first = (
+        income_model.objects.filter(created_at__lt=get_month_bound(before))
+        .order_by("created_at")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+    deleted = 0
+    month = get_month_start(first.date()) if first else before
+    while month < before:
+        deleted += archive_month(month)
+        month = get_next_month_start(month)
+    return deleted
+
+
+def get_courier_totals(start=None, end=None, courier_ids=None):
+    """Return total archived income of couriers from start to end date, inclusive
+
+    only archive files of months in range are memory-mapped,
+    and only columns that are needed are read from them.
+
+    Args:
+        start (datetime.date, optional): first date of range, from first archive by default
+        end (datetime.date, optional): last date of range, to last archive by default
+        courier_ids (Iterable[int], optional): couriers to limit totals to them
+
+    Returns:
+        Dict[courier_id(Int), amount(Int)]: summation of signed amounts
+    """
+    totals: defaultdict[int, int] = defaultdict(int)
+    for month in get_archived_months():
+        if start and get_next_month_start(month) <= start:
+            continue
+        if end and month > end:
+            break
+        table = read_archive(
+            get_archive_path(month), columns=["courier_id", "type", "amount", "date"]
+        )
+        mask = pc.is_valid(table["courier_id"])
+        if start:
+            mask = pc.and_(mask, pc.greater_equal(table["date"], start))
+        if end:
+            mask = pc.and_(mask, pc.less_equal(table["date"], end))
+        if courier_ids is not None:
+            mask = pc.and_(
+                mask,
+                pc.is_in(
+                    table["courier_id"],
+                    value_set=pa.array(list(courier_ids), pa.int64()),
+                ),
+            )
+        table = table.filter(mask)
+        report = (
+            pa.table(
+                {"courier_id": table["courier_id"], "amount": get_signed_amounts(table)}
+            )
+            .group_by("courier_id")
+            .aggregate([("amount", "sum")])
+        )
+        for courier_id, amount in zip(
+            report["courier_id"].to_pylist(), report["amount_sum"].to_pylist()
+        ):
+            totals[courier_id] += amount
+    return dict(totals)
+
+
+def get_courier_total(courier_id, start=None, end=None):
+    """Return total archived income of courier from start to end date, inclusive"""
+    return get_courier_totals(start, end, courier_ids=[courier_id]).get(courier_id, 0)
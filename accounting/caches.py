@@ -0,0 +1,52 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+WEEKLY_INCOME_VERSION_KEY = "accounting:weekly-income:version"
+
+
+def get_weekly_income_version():
+    """Get version of weekly incomes
+
+    version is the unix timestamp that weekly incomes are changed at last,
+    if it's not in the cache, current time is set as version, so cached
+    responses of previous version are not used anymore.
+
+    Returns:
+        Int: version of weekly incomes
+    """
+    version = cache.get(WEEKLY_INCOME_VERSION_KEY)
+    if version is None:
+        cache.add(WEEKLY_INCOME_VERSION_KEY, int(time.time()), None)
+        version = cache.get(WEEKLY_INCOME_VERSION_KEY, int(time.time()))
+    return version
+
+
+def bump_weekly_income_version():
+    """Invalidate cached weekly income responses by bumping the version
+
+    it must be called after weekly incomes are committed, otherwise
+    a response of old weekly incomes can be cached with the new version
+    """
+    version = max(int(time.time()), get_weekly_income_version() + 1)
+    cache.set(WEEKLY_INCOME_VERSION_KEY, version, None)
+    return version
+
+
+def get_weekly_income_response_key(version, url):
+    url_hash = hashlib.md5(url.encode()).hexdigest()
+    return f"accounting:weekly-income:{version}:{url_hash}"
+
+
+def get_cached_weekly_income_response(version, url):
+    return cache.get(get_weekly_income_response_key(version, url))
+
+
+def set_cached_weekly_income_response(version, url, data):
+    cache.set(
+        get_weekly_income_response_key(version, url),
+        data,
+        settings.ACCOUNTING_WEEKLY_INCOME_CACHE_TIMEOUT,
+    )
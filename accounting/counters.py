@@ -0,0 +1,188 @@
+import datetime
+import functools
+import logging
+from collections import defaultdict
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from config.routers import prefer_primary
+from miare.utils import get_week_start
+
+logger = logging.getLogger(__name__)
+
+SOCKET_TIMEOUT = 0.1
+KEY_TIMEOUT = 8 * 24 * 60 * 60
+WEEK_FIELD = "week"
+# counters are only incremented if courier week is already loaded,
+# otherwise the increment would be the whole week amount
+INCREMENT_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("HINCRBY", KEYS[1], ARGV[1], ARGV[2])
+    redis.call("HINCRBY", KEYS[1], "week", ARGV[2])
+end
+"""
+
+
+@functools.lru_cache
+def get_client(url):
+    return redis.Redis.from_url(
+        url, socket_timeout=SOCKET_TIMEOUT, socket_connect_timeout=SOCKET_TIMEOUT
+    )
+
+
+def get_balance_key(courier_id, week_start):
+    return f"accounting:balance:{courier_id}:{week_start.isoformat()}"
+
+
+def get_today():
+    """Return today in the same way daily incomes are dated, by created_at date"""
+    return timezone.now().date()
+
+
+def add_amounts(amounts):
+    """Increment balance counters of couriers
+
+    it must be called after daily incomes are committed, counters of a courier week
+    that are not loaded are left to be loaded from database on read, and if redis
+    is not available counters are fixed by reconcile_balance_counters task
+
+    Args:
+        amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+            signed amount added to daily income of courier in that date
+    """
+    client = get_client(settings.ACCOUNTING_BALANCE_REDIS_URL)
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for (courier_id, date), amount in amounts.items():
+            pipeline.eval(
+                INCREMENT_SCRIPT,
+                1,
+                get_balance_key(courier_id, get_week_start(date)),
+                date.isoformat(),
+                amount,
+            )
+        pipeline.execute()
+    except redis.RedisError:
+        logger.exception("balance counters are not incremented")
+
+
+def get_week_amounts_from_db(courier_ids, week_start):
+    """Get daily amounts of couriers in a week from daily incomes
+
+    Returns:
+        Dict[courier_id(Int), Dict[field(str), amount(Int)]]: amount of each date
+            of week, by its iso format, and amount of whole week in WEEK_FIELD
+    """
+    daily_income_model = apps.get_model("accounting", "DailyIncome")
+    week_end = week_start + datetime.timedelta(days=7)
+    amounts: defaultdict[int, dict[str, int]] = defaultdict(lambda: {WEEK_FIELD: 0})
+    for courier_id, date, amount in (
+        daily_income_model.objects.filter(
+            courier_id__in=courier_ids, date__gte=week_start, date__lt=week_end
+        )
+        .values_list("courier_id", "date", "amount")
+        .iterator()
+    ):
+        amounts[courier_id][date.isoformat()] = amount
+        amounts[courier_id][WEEK_FIELD] += amount
+    if settings.ACCOUNTING_DAILY_INCOME_STRIPES > 1:
+        stripe_amounts = daily_income_model.objects.get_stripe_manager().get_amounts(
+            courier_id__in=courier_ids, date__gte=week_start, date__lt=week_end
+        )
+        for (courier_id, date), amount in stripe_amounts.items():
+            field = date.isoformat()
+            amounts[courier_id][field] = amounts[courier_id].get(field, 0) + amount
+            amounts[courier_id][WEEK_FIELD] += amount
+    return amounts
+
+
+def set_week_amounts(pipeline, courier_id, week_start, amounts):
+    key = get_balance_key(courier_id, week_start)
+    pipeline.delete(key)
+    pipeline.hset(key, mapping=amounts)
+    pipeline.expire(key, KEY_TIMEOUT)
+
+
+def courier_exists(courier_id, amounts):
+    """Courier with amounts in a week exists, others are checked in database"""
+    if len(amounts) > 1:
+        return True
+    courier_model = apps.get_model("accounting", "Courier")
+    return courier_model.objects.filter(id=courier_id).exists()
+
+
+def get_balance_from_db(courier_id, today):
+    week_start = get_week_start(today)
+    amounts = get_week_amounts_from_db([courier_id], week_start)[courier_id]
+    if not courier_exists(courier_id, amounts):
+        return None
+    return {"today": amounts.get(today.isoformat(), 0), "week": amounts[WEEK_FIELD]}
+
+
+def get_balance(courier_id):
+    """Get today and this week income of courier
+
+    balance is read from redis counters if ACCOUNTING_BALANCE_COUNTERS is enabled,
+    week of courier is loaded from default database on the first read, and
+    if redis is not available balance is read from database.
+
+    Returns:
+        Optional[Dict[str, Int]]: today and week amounts of courier,
+            None if courier does not exist
+    """
+    today = get_today()
+    if not settings.ACCOUNTING_BALANCE_COUNTERS:
+        return get_balance_from_db(courier_id, today)
+    client = get_client(settings.ACCOUNTING_BALANCE_REDIS_URL)
+    week_start = get_week_start(today)
+    try:
+        week, day = client.hmget(
+            get_balance_key(courier_id, week_start), WEEK_FIELD, today.isoformat()
+        )
+        if week is not None:
+            return {"today": int(day or 0), "week": int(week)}
+        # counters are kept until they expire, so they are not loaded from a replica
+        with prefer_primary():
+            amounts = get_week_amounts_from_db([courier_id], week_start)[courier_id]
+            if not courier_exists(courier_id, amounts):
+                return None
+        pipeline = client.pipeline()
+        set_week_amounts(pipeline, courier_id, week_start, amounts)
+        pipeline.execute()
+        return {"today": amounts.get(today.isoformat(), 0), "week": amounts[WEEK_FIELD]}
+    except redis.RedisError:
+        logger.warning("balance counters are not available, read from database")
+        return get_balance_from_db(courier_id, today)
+
+
+def reconcile(batch_size=1_000):
+    """Overwrite this week counters of couriers by their daily incomes
+
+    increments that are committed while a courier is reconciled may be
+    lost or counted twice, they are fixed by the next reconcile
+
+    Returns:
+        int: number of reconciled couriers
+    """
+    week_start = get_week_start(get_today())
+    daily_income_model = apps.get_model("accounting", "DailyIncome")
+    client = get_client(settings.ACCOUNTING_BALANCE_REDIS_URL)
+    courier_ids = (
+        daily_income_model.objects.filter(date__gte=week_start)
+        .order_by("courier_id")
+        .values_list("courier_id", flat=True)
+        .distinct()
+    )
+    courier_ids = list(courier_ids)
+    for start in range(0, len(courier_ids), batch_size):
+        end = start + batch_size
+        batch = courier_ids[start:end]
+        amounts = get_week_amounts_from_db(batch, week_start)
+        pipeline = client.pipeline()
+        for courier_id in batch:
+            set_week_amounts(pipeline, courier_id, week_start, amounts[courier_id])
+        pipeline.execute()
+    return len(courier_ids)
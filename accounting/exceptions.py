@@ -1,2 +1,6 @@
 class IncomeIsGeneratedAsProcessed(Exception):
     pass
+
+
+class IncomeArchiveMismatch(Exception):
+    pass
@@ -0,0 +1,90 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+CSV = "csv"
+NDJSON = "ndjson"
+EXPORT_FORMATS = {CSV: "text/csv", NDJSON: "application/x-ndjson"}
+
+
+class Echo:
+    """file like object that returns written value instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, header):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows, header):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + "\n"
+
+
+def iter_batches(lines, size):
+    """join lines in batches, so each chunk of response is not a single row"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def stream_export(queryset, fields, header, export_format, filename):
+    """Stream rows of queryset as csv or ndjson
+
+    rows are fetched by values_list iterator, chunk_size rows at a time,
+    with a server-side cursor if database supports it, so memory usage is
+    constant and the first chunk is sent before the whole query is read.
+
+    Args:
+        queryset (django.db.models.QuerySet): ordered queryset of rows
+        fields (Iterable[str]): fields passed to values_list
+        header (Iterable[str]): names of fields in export
+        export_format (str): one of EXPORT_FORMATS
+        filename (str): name of attachment without extension
+
+    Returns:
+        django.http.StreamingHttpResponse
+    """
+    chunk_size = settings.ACCOUNTING_EXPORT_CHUNK_SIZE
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    return stream_rows(rows, header, export_format, filename)
+
+
+def stream_rows(rows, header, export_format, filename):
+    """Stream rows as csv or ndjson, see stream_export
+
+    Args:
+        rows (Iterable[Tuple]): rows in the same order as header
+        header (Iterable[str]): names of fields in export
+        export_format (str): one of EXPORT_FORMATS
+        filename (str): name of attachment without extension
+
+    Returns:
+        django.http.StreamingHttpResponse
+    """
+    chunk_size = settings.ACCOUNTING_EXPORT_CHUNK_SIZE
+    if export_format == CSV:
+        lines = iter_csv(rows, header)
+    else:
+        lines = iter_ndjson(rows, header)
+    response = StreamingHttpResponse(
+        iter_batches(lines, chunk_size),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response.headers[
+        "Content-Disposition"
+    ] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -1,6 +1,6 @@
 from django_filters import rest_framework as filters
 
-from accounting.models import WeeklyIncome
+from accounting.models import DailyIncome, WeeklyIncome
 
 
 class WeeklyIncomeFilters(filters.FilterSet):
@@ -10,3 +10,12 @@ class WeeklyIncomeFilters(filters.FilterSet):
     class Meta:
         model = WeeklyIncome
         fields = ["from_date", "to_date"]
+
+
+class DailyIncomeFilters(filters.FilterSet):
+    from_date = filters.DateFilter(field_name="date", lookup_expr="gte")
+    to_date = filters.DateFilter(field_name="date", lookup_expr="lte")
+
+    class Meta:
+        model = DailyIncome
+        fields = ["from_date", "to_date"]
@@ -0,0 +1,51 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.archives import archive_incomes, get_courier_totals
+from accounting.exceptions import IncomeArchiveMismatch
+from miare.utils import get_month_start
+
+
+class Command(BaseCommand):
+    help = """Archive processed incomes of old months or query the archive
+
+    incomes of months older than --months are written to archive files,
+    verified with daily and weekly incomes and deleted from Income table.
+    with --totals, total archived income of couriers is printed instead."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS,
+            help="number of months before current month to keep in Income table",
+        )
+        parser.add_argument(
+            "--totals",
+            action="store_true",
+            help="print total archived income of couriers instead of archiving",
+        )
+        parser.add_argument("--courier", type=int, nargs="*", help="courier ids")
+        parser.add_argument("--start", type=datetime.date.fromisoformat)
+        parser.add_argument("--end", type=datetime.date.fromisoformat)
+
+    def handle(self, *args, **options):
+        if options["totals"]:
+            totals = get_courier_totals(
+                options["start"], options["end"], courier_ids=options["courier"]
+            )
+            for courier_id, amount in sorted(totals.items()):
+                self.stdout.write(f"{courier_id}\t{amount}")
+            return
+        if options["months"] < 1:
+            raise CommandError("--months must be at least 1")
+        before = get_month_start(datetime.date.today())
+        for _ in range(options["months"]):
+            before = get_month_start(before - datetime.timedelta(days=1))
+        try:
+            archived = archive_incomes(before)
+        except IncomeArchiveMismatch as error:
+            raise CommandError(str(error))
+        self.stdout.write(f"{archived} incomes before {before} are archived")
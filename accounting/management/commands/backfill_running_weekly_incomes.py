@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.tasks import backfill_running_weekly_incomes
+
+
+class Command(BaseCommand):
+    help = """Rebuild running weekly incomes from daily incomes
+
+    it must be run after ACCOUNTING_RUNNING_WEEKLY_INCOME is enabled, so current week
+    income of couriers includes days before it's enabled, otherwise it's done
+    before weekly incomes are sealed."""
+
+    def handle(self, *args, **options):
+        if not settings.ACCOUNTING_RUNNING_WEEKLY_INCOME:
+            raise CommandError("ACCOUNTING_RUNNING_WEEKLY_INCOME is not enabled")
+        rebuilt = backfill_running_weekly_incomes()
+        self.stdout.write(f"running weekly incomes of {rebuilt} ranges are rebuilt")
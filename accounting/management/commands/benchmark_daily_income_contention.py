@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from accounting.models import (
+    Courier,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    RunningWeeklyIncome,
+)
+
+
+class Command(BaseCommand):
+    help = """Benchmark daily income contention
+
+    concurrent writers create incomes of one courier, so they all update
+    the same daily income, compare incomes/second of updating daily income
+    with updating daily income stripes.
+    incomes are committed, because writers run in their own connections,
+    and all created records are deleted at the end of each run.
+    row locks are meaningful on PostgreSQL, SQLite locks the whole database."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--writers", type=int, default=50, help="number of concurrent writers"
+        )
+        parser.add_argument(
+            "--incomes", type=int, default=20, help="number of incomes of each writer"
+        )
+        parser.add_argument(
+            "--stripes", type=int, default=8, help="number of daily income stripes"
+        )
+
+    def handle(self, *args, **options):
+        for stripes in [1, options["stripes"]]:
+            with override_settings(
+                ACCOUNTING_DAILY_INCOME_STRIPES=stripes,
+                ACCOUNTING_DAILY_INCOME_UPSERT=False,
+                ACCOUNTING_DAILY_INCOME_WRITE_BEHIND=False,
+            ):
+                rate, errors = self.run(options["writers"], options["incomes"])
+            self.stdout.write(
+                f"stripes {stripes:>3}: {rate:>10.1f} incomes/s, {errors} errors"
+            )
+
+    def run(self, writers, incomes):
+        """Run writers concurrently and return incomes/second and number of errors"""
+        courier = Courier.objects.create(name="benchmark courier")
+        barrier = threading.Barrier(writers + 1)
+        errors = []
+
+        def write():
+            try:
+                barrier.wait()
+                for _ in range(incomes):
+                    Income.objects.create(
+                        courier=courier,
+                        type=Income.Type.TRIP,
+                        amount=random.randint(1, 1_000_000),
+                        status=Income.Status.ACTIVE,
+                    )
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        created = Income.objects.filter(courier=courier).count()
+        self.delete(courier)
+        return created / elapsed, len(errors)
+
+    @staticmethod
+    def delete(courier):
+        DailyIncome.objects.get_queryset().filter(courier=courier).delete()
+        DailyIncomeStripe.objects.filter(courier=courier).delete()
+        RunningWeeklyIncome.objects.filter(courier=courier).delete()
+        Income.objects.filter(courier=courier).delete()
+        courier.delete()
@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounting.models import Courier, Income
+
+
+class Command(BaseCommand):
+    help = """Benchmark income ingestion
+
+    compare rows/second of creating incomes one by one, which updates daily income
+    by post_save signal, with bulk creation of incomes.
+    all created records are rolled back at the end of each run."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[1, 100, 10_000],
+            help="batch sizes to benchmark",
+        )
+        parser.add_argument(
+            "--couriers", type=int, default=100, help="number of couriers"
+        )
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            per_row = self.run(self.create_one_by_one, size, options["couriers"])
+            bulk = self.run(self.create_bulk, size, options["couriers"])
+            self.stdout.write(
+                f"batch size {size:>6}: "
+                f"per row {per_row:>10.1f} rows/s, bulk {bulk:>10.1f} rows/s"
+            )
+
+    def run(self, create, size, couriers_count):
+        """Run create function in a rolled back transaction and return rows/second"""
+        with transaction.atomic():
+            couriers = Courier.objects.bulk_create(
+                [Courier(name=f"courier {i}") for i in range(couriers_count)]
+            )
+            incomes = [
+                Income(
+                    courier=random.choice(couriers),
+                    type=random.choice(Income.Type.values),
+                    amount=random.randint(1, 1_000_000),
+                    status=Income.Status.ACTIVE,
+                )
+                for _ in range(size)
+            ]
+            start = time.perf_counter()
+            create(incomes)
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return size / elapsed
+
+    @staticmethod
+    def create_one_by_one(incomes):
+        for income in incomes:
+            income.save()
+
+    @staticmethod
+    def create_bulk(incomes):
+        Income.objects.bulk_create_processed(incomes)
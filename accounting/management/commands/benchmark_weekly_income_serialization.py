@@ -0,0 +1,80 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounting.models import Courier, WeeklyIncome
+from accounting.serializers import (
+    WEEKLY_INCOME_VALUES,
+    WeeklyIncomeSerializer,
+    serialize_weekly_income_values,
+)
+
+
+class Command(BaseCommand):
+    help = """Benchmark weekly income serialization
+
+    compare rows/second of WeeklyIncomeSerializer with serializing from values(),
+    including the query of rows.
+    all created records are rolled back at the end of each run."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[100, 1_000, 10_000],
+            help="number of weekly incomes to benchmark",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="number of times to serialize"
+        )
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            with transaction.atomic():
+                self.create_weekly_incomes(size)
+                serializer = self.run(self.serialize, size, options["repeat"])
+                values = self.run(self.serialize_values, size, options["repeat"])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"rows {size:>6}: serializer {serializer:>10.1f} rows/s, "
+                f"values {values:>10.1f} rows/s"
+            )
+
+    @staticmethod
+    def create_weekly_incomes(size):
+        couriers = Courier.objects.bulk_create(
+            [Courier(name=f"courier {i}") for i in range(size)]
+        )
+        date = datetime.date.today()
+        WeeklyIncome.objects.bulk_create(
+            [
+                WeeklyIncome(
+                    courier=courier, date=date, amount=random.randint(1, 1_000_000)
+                )
+                for courier in couriers
+            ]
+        )
+
+    @staticmethod
+    def run(serialize, size, repeat):
+        """Run serialize function repeat times and return best rows/second"""
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serialize()
+            elapsed.append(time.perf_counter() - start)
+        return size / min(elapsed)
+
+    @staticmethod
+    def serialize():
+        queryset = WeeklyIncome.objects.select_related("courier")
+        return WeeklyIncomeSerializer(queryset, many=True).data
+
+    @staticmethod
+    def serialize_values():
+        queryset = WeeklyIncome.objects.values(*WEEKLY_INCOME_VALUES)
+        return serialize_weekly_income_values(queryset)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from accounting.tasks import build_income_rollups
+
+
+class Command(BaseCommand):
+    help = """Build monthly and yearly income rollups of past months
+
+    build_income_rollups task only rebuilds last month every day, so rollups of
+    history must be built by this command, e.g. on first deployment."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            required=True,
+            help="number of months before current month to build rollups for",
+        )
+
+    def handle(self, *args, **options):
+        build_income_rollups(months=options["months"])
+        self.stdout.write(f"rollups of {options['months']} months are built")
@@ -0,0 +1,48 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounting.archives import get_archived_months
+from accounting.partitions import is_partitioned, maintain_partitions
+
+
+class Command(BaseCommand):
+    help = """Create next months Income partitions and detach old ones
+
+    it does what maintain_income_partitions task does, so partitions can be created
+    before celery beat is started, e.g. after deployment."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=settings.ACCOUNTING_INCOME_PARTITIONS_AHEAD,
+            help="number of months after current month to create partitions for",
+        )
+        parser.add_argument(
+            "--retention",
+            type=int,
+            default=settings.ACCOUNTING_INCOME_RETENTION_MONTHS,
+            help="number of months to keep attached, 0 to keep all partitions",
+        )
+
+    def handle(self, *args, **options):
+        if not is_partitioned(connection):
+            self.stdout.write("Income table is not partitioned")
+            return
+        created, detached = maintain_partitions(
+            connection,
+            today=datetime.date.today(),
+            ahead=options["ahead"],
+            retention=options["retention"],
+            schema=settings.ACCOUNTING_INCOME_ARCHIVE_SCHEMA,
+            archived_months=(
+                get_archived_months()
+                if settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS
+                else None
+            ),
+        )
+        self.stdout.write(f"created partitions: {', '.join(created) or '-'}")
+        self.stdout.write(f"detached partitions: {', '.join(detached) or '-'}")
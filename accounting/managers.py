@@ -1,9 +1,96 @@
-from django.db import models, transaction
-from django.db.models import Case, DateField, F, Sum, Value, When
+import datetime
+import functools
+from collections import defaultdict
 
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    DateField,
+    F,
+    IntegerField,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Greatest
+
+from accounting import accumulators, counters
 from accounting.exceptions import IncomeIsGeneratedAsProcessed
-from accounting.querysets import DailyIncomeQuerySet, IncomeQuerySet
-from miare.utils import get_this_and_past_saturday
+from accounting.querysets import (
+    DailyIncomeQuerySet,
+    DailyIncomeStripeQuerySet,
+    IncomeQuerySet,
+)
+from miare.utils import (
+    get_month_start,
+    get_next_month_start,
+    get_this_and_past_saturday,
+    get_week_start,
+    split_date_range,
+)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def is_striped():
+    """Check daily incomes are updated in stripes"""
+    return settings.ACCOUNTING_DAILY_INCOME_STRIPES > 1
+
+
+def supports_upsert(connection):
+    """Check database supports INSERT ... ON CONFLICT DO UPDATE
+
+    PostgreSQL supports it from 9.5 and SQLite from 3.24
+    """
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 24)
+    return False
+
+
+def get_write_db(manager):
+    """Return database that manager writes to
+
+    reads of manager may be sent to a replica database by DATABASE_ROUTERS,
+    so transactions and statements that write must use this database
+    """
+    return manager._db or router.db_for_write(manager.model, **manager._hints)
+
+
+def insert_from_select(manager, report, on_conflict=""):
+    """Insert report rows into manager model by one INSERT INTO ... SELECT statement
+
+    report queryset is compiled to its SELECT statement and inserted
+    in database, so report rows are never fetched by python.
+    report fields and annotations must have the same names as model columns
+
+    Args:
+        manager (django.db.models.Manager): manager of model that rows are inserted into
+        report (QuerySet): values queryset
+        on_conflict (str, optional): ON CONFLICT clause of INSERT statement
+
+    Returns:
+        int: number of inserted rows
+    """
+    db = get_write_db(manager)
+    connection = connections[db]
+    query = report.query
+    columns = ", ".join(
+        connection.ops.quote_name(column)
+        for column in [*query.values_select, *query.annotation_select]
+    )
+    select_sql, params = query.get_compiler(using=db).as_sql()
+    table = connection.ops.quote_name(manager.model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) {select_sql} {on_conflict}", params
+        )
+        return cursor.rowcount
 
 
 class IncomeManager(models.Manager):
@@ -33,8 +120,136 @@ class IncomeManager(models.Manager):
         )
         return result if result else 0
 
+    def bulk_create_processed(self, incomes):
+        """Create incomes in bulk and apply them to daily incomes
+
+        incomes are inserted in one statement, so post_save signal is not sent
+        and daily incomes are not updated one by one, instead amount of incomes
+        is summed per courier and date and applied to daily incomes
+        in the same transaction, so incomes are stored as PROCESSED.
+
+        Args:
+            incomes (List[accounting.models.Income]): not saved instances of Income model
+
+        Returns:
+            List[accounting.models.Income]: saved instances of Income model
+        """
+        daily_income_model = apps.get_model("accounting", "DailyIncome")
+        for income in incomes:
+            income.status = self.model.Status.PROCESSED
+        with transaction.atomic():
+            incomes = self.bulk_create(incomes)
+            daily_income_model.objects.add_amounts(
+                daily_income_model.get_incomes_amounts(incomes)
+            )
+        return incomes
+
+
+class CumulativeIncomeManager(models.Manager):
+    """Manager of cumulative incomes
+
+    cumulative incomes have courier, date and amount fields
+    and are unique together by date and courier
+    """
+
+    upsert_batch_size = 1_000
+
+    def get_initial_fields(self):
+        """return fields of a new cumulative income, other than courier, date and amount"""
+        return {}
+
+    def apply_amounts(self, amounts) -> None:
+        """Apply amounts to cumulative incomes
+
+        missing cumulative incomes are created with amount=0 and conflicts with
+        concurrent creations are ignored, then all cumulative incomes are locked
+        and updated in one query, so it must be called inside a transaction.
+        rows are created and locked ordered by courier and date, so two transactions
+        updating the same couriers wait for each other instead of deadlocking.
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount to be added to cumulative income of courier in that date
+        """
+        if not amounts:
+            return
+        keys = sorted(amounts)
+        self.bulk_create(
+            [
+                self.model(
+                    courier_id=courier_id,
+                    date=date,
+                    amount=0,
+                    **self.get_initial_fields(),
+                )
+                for courier_id, date in keys
+            ],
+            ignore_conflicts=True,
+        )
+        courier_ids = {courier_id for courier_id, _ in keys}
+        dates = {date for _, date in keys}
+        cumulative_incomes = []
+        for cumulative_income in (
+            self.get_queryset()
+            .select_for_update()
+            .filter(courier_id__in=courier_ids, date__in=dates)
+            .order_by("courier_id", "date")
+        ):
+            amount = amounts.get((cumulative_income.courier_id, cumulative_income.date))
+            if amount is None:
+                continue
+            cumulative_income.amount += amount
+            cumulative_incomes.append(cumulative_income)
+        self.bulk_update(cumulative_incomes, ["amount"])
+
+    def upsert_amounts(self, amounts) -> None:
+        """Apply amounts to cumulative incomes by INSERT ... ON CONFLICT DO UPDATE
 
-class DailyIncomeManager(models.Manager):
+        amounts are added to cumulative incomes, or inserted if they don't exist,
+        in batches of upsert_batch_size rows per statement, ordered by courier and date,
+        so rows are locked only during the statement.
+        if database does not support it, amounts are applied by apply_amounts
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount to be added to cumulative income of courier in that date
+        """
+        if not amounts:
+            return
+        connection = connections[get_write_db(self)]
+        if not supports_upsert(connection):
+            self.apply_amounts(amounts)
+            return
+        initial_fields = self.get_initial_fields()
+        columns = ", ".join(
+            connection.ops.quote_name(column)
+            for column in ["courier_id", "date", "amount", *initial_fields]
+        )
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        rows = [
+            [
+                courier_id,
+                connection.ops.adapt_datefield_value(date),
+                amount,
+                *initial_fields.values(),
+            ]
+            for (courier_id, date), amount in sorted(amounts.items())
+        ]
+        placeholder = f"({', '.join(['%s'] * len(rows[0]))})"
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.upsert_batch_size):
+                end = start + self.upsert_batch_size
+                batch = rows[start:end]
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) "
+                    f"VALUES {', '.join([placeholder] * len(batch))} "
+                    "ON CONFLICT (date, courier_id) "
+                    f"DO UPDATE SET amount = {table}.amount + EXCLUDED.amount",
+                    [value for row in batch for value in row],
+                )
+
+
+class DailyIncomeManager(CumulativeIncomeManager):
     def get_queryset(self):
         return DailyIncomeQuerySet(self.model, using=self._db)
 
@@ -45,19 +260,23 @@ class DailyIncomeManager(models.Manager):
             int: 0 or positive integer
         """
         result = self.get_queryset().yesterday().aggregate(Sum("amount"))["amount__sum"]
-        return result if result else 0
+        result = result if result else 0
+        if is_striped():
+            result += self.get_stripe_manager().get_yesterday_amount()
+        return result
 
-    def get_weekly_report(self):
+    def get_weekly_report(self, courier_id_range=None):
         """return weekly report to be used in creating weekly income objects
-        return objects is a"""
+        return objects is a
+
+        Args:
+            courier_id_range (Tuple[Int, Int], optional): half-open range of courier ids
+                to limit report to them
+        """
         this_saturday, past_saturday = get_this_and_past_saturday()
         return (
-            self.get_queryset()
-            .filter(
-                date__gte=past_saturday,
-                date__lt=this_saturday,
-                status=self.model.Status.ACTIVE,
-            )
+            self.get_last_week_daily_incomes(courier_id_range)
+            .filter(status=self.model.Status.ACTIVE)
             .values("courier_id")
             .annotate(
                 amount=Sum("amount"),
@@ -66,15 +285,200 @@ class DailyIncomeManager(models.Manager):
             .values_list("courier_id", "date", "amount")
         )
 
-    def update_last_week_daily_income_status(self):
+    def update_last_week_daily_income_status(self, courier_id_range=None):
         """Process last week daily income objects
 
         When weekly income is created, their related daily income status must be set to PROCESSED
+
+        Args:
+            courier_id_range (Tuple[Int, Int], optional): half-open range of courier ids
+                to limit update to them
         """
+        self.get_last_week_daily_incomes(courier_id_range).update(
+            status=self.model.Status.PROCESSED
+        )
+
+    def get_last_week_daily_incomes(self, courier_id_range=None):
+        """return last week daily incomes, limited to a range of courier ids if it's given"""
         this_saturday, past_saturday = get_this_and_past_saturday()
-        self.get_queryset().filter(
+        queryset = self.get_queryset().filter(
             date__gte=past_saturday, date__lt=this_saturday
-        ).update(status=self.model.Status.PROCESSED)
+        )
+        if courier_id_range is not None:
+            courier_from, courier_to = courier_id_range
+            queryset = queryset.filter(
+                courier_id__gte=courier_from, courier_id__lt=courier_to
+            )
+        return queryset
+
+    def get_discrepancies(self, date, courier_ids=None):
+        """Get couriers that their daily income is not equal to their processed incomes
+
+        processed incomes of date, summed by courier, and daily incomes and stripes
+        of date are combined by UNION ALL and grouped by courier in one query,
+        it's a full outer join of them, so couriers without daily income
+        or without income are included too.
+        incomes are taken by UTC date of created_at, the same as daily incomes.
+
+        Args:
+            date (Date): date of incomes and daily incomes
+            courier_ids (Iterable[Int] | QuerySet, optional): limit check to these couriers,
+                e.g. a subquery of couriers that have new incomes
+
+        Returns:
+            List[Tuple[courier_id(Int), income_amount(Int), daily_amount(Int)]]:
+                mismatched couriers, ordered by courier id
+        """
+        income_model = apps.get_model("accounting", "Income")
+        start = datetime.datetime.combine(
+            date, datetime.time.min, datetime.timezone.utc
+        )
+        zero = Value(0, output_field=BigIntegerField())
+        incomes = (
+            income_model.objects.using(self.db)
+            .filter(
+                created_at__gte=start,
+                created_at__lt=start + datetime.timedelta(days=1),
+                status=income_model.Status.PROCESSED,
+            )
+            .values("courier_id")
+            .annotate(
+                income_amount=Sum(
+                    Case(
+                        When(type=income_model.Type.PUNISHMENT, then=F("amount") * -1),
+                        default=F("amount"),
+                    )
+                ),
+                daily_amount=zero,
+            )
+            .values_list("courier_id", "income_amount", "daily_amount")
+        )
+        daily_incomes, stripes = [
+            manager.using(self.db)
+            .filter(date=date)
+            .values("courier_id")
+            .annotate(income_amount=zero, daily_amount=Sum("amount"))
+            .values_list("courier_id", "income_amount", "daily_amount")
+            for manager in [self, self.get_stripe_manager()]
+        ]
+        if courier_ids is not None:
+            incomes, daily_incomes, stripes = [
+                queryset.filter(courier_id__in=courier_ids)
+                for queryset in [incomes, daily_incomes, stripes]
+            ]
+        amounts_sql, params = incomes.union(
+            daily_incomes, stripes, all=True
+        ).query.sql_with_params()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT courier_id, SUM(income_amount), SUM(daily_amount)
+                FROM ({amounts_sql}) amounts
+                GROUP BY courier_id
+                HAVING SUM(income_amount) <> SUM(daily_amount)
+                ORDER BY courier_id
+                """,
+                params,
+            )
+            return cursor.fetchall()
+
+    def repair_discrepancies(self, date, discrepancies):
+        """Add difference of incomes and daily incomes to daily incomes
+
+        daily incomes of discrepant couriers are created if missing, then they and
+        their stripes are locked ordered by courier, and differences are recomputed
+        in the same transaction, so discrepancies read earlier or from a lagging
+        replica, or repaired by an overlapping run, are not applied twice.
+        difference is added instead of setting daily income to income amount,
+        so incomes that are processed concurrently are kept.
+        running weekly incomes and balance counters are repaired too,
+        but weekly incomes that are already generated must be reviewed.
+
+        Args:
+            date (Date): date of discrepancies
+            discrepancies (List[Tuple[courier_id(Int), income_amount(Int), daily_amount(Int)]]):
+                result of get_discrepancies, only their couriers are used
+
+        Returns:
+            List[Tuple[courier_id(Int), income_amount(Int), daily_amount(Int)]]:
+                repaired discrepancies, as recomputed after locking
+        """
+        courier_ids = sorted({courier_id for courier_id, *_ in discrepancies})
+        if not courier_ids:
+            return []
+        db = get_write_db(self)
+        manager = self.db_manager(db)
+        with transaction.atomic(using=db):
+            manager.bulk_create(
+                [
+                    self.model(
+                        courier_id=courier_id,
+                        date=date,
+                        amount=0,
+                        **self.get_initial_fields(),
+                    )
+                    for courier_id in courier_ids
+                ],
+                ignore_conflicts=True,
+            )
+            for locked_manager in (manager, manager.get_stripe_manager()):
+                list(
+                    locked_manager.get_queryset()
+                    .select_for_update()
+                    .filter(courier_id__in=courier_ids, date=date)
+                    .order_by("courier_id")
+                    .values_list("id", flat=True)
+                )
+            discrepancies = manager.get_discrepancies(date, courier_ids)
+            manager.add_amounts(
+                {
+                    (courier_id, date): income_amount - daily_amount
+                    for courier_id, income_amount, daily_amount in discrepancies
+                }
+            )
+        return discrepancies
+
+    def get_stripe_manager(self):
+        return apps.get_model("accounting", "DailyIncomeStripe").objects.db_manager(
+            self._db
+        )
+
+    def get_courier_timeline(self, courier_id, from_date, to_date):
+        """Get daily incomes of courier for every date in a range
+
+        rows are read from the covering (courier, date) index, and dates that courier
+        has no daily income are filled with amount=0 and status=None
+
+        Args:
+            courier_id (Int): id of courier
+            from_date (Date): first date of timeline
+            to_date (Date): last date of timeline, inclusive
+
+        Returns:
+            List[Dict]: date, amount and status of each date, ordered by date
+        """
+        daily_incomes = {
+            date: (amount, status)
+            for date, amount, status in self.get_queryset()
+            .filter(courier_id=courier_id, date__gte=from_date, date__lte=to_date)
+            .values_list("date", "amount", "status")
+        }
+        if is_striped():
+            stripe_amounts = self.get_stripe_manager().get_amounts(
+                courier_id=courier_id, date__gte=from_date, date__lte=to_date
+            )
+            for (_, date), amount in stripe_amounts.items():
+                daily_amount, status = daily_incomes.get(
+                    date, (0, self.model.Status.ACTIVE)
+                )
+                daily_incomes[date] = (daily_amount + amount, status)
+        timeline = []
+        date = from_date
+        while date <= to_date:
+            amount, status = daily_incomes.get(date, (0, None))
+            timeline.append({"date": date, "amount": amount, "status": status})
+            date += datetime.timedelta(days=1)
+        return timeline
 
     def get_daily_income(self, income):
         """Get daily income
@@ -99,6 +503,85 @@ class DailyIncomeManager(models.Manager):
         )
         return daily_income
 
+    def get_initial_fields(self):
+        return {"status": self.model.Status.ACTIVE}
+
+    def add_amounts(self, amounts, upsert=False) -> None:
+        """Add amounts to daily incomes
+
+        amounts are applied by apply_amounts, or by upsert_amounts if upsert is True,
+        and if ACCOUNTING_RUNNING_WEEKLY_INCOME setting is enabled,
+        they are added to running weekly incomes too, so it must be called inside a transaction
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount to be added to daily income of courier in that date
+            upsert (bool): apply amounts by INSERT ... ON CONFLICT DO UPDATE
+        """
+        if upsert:
+            self.upsert_amounts(amounts)
+        else:
+            self.apply_amounts(amounts)
+        self.add_running_weekly_amounts(amounts)
+        self.add_balance_counter_amounts(amounts)
+
+    def add_balance_counter_amounts(self, amounts) -> None:
+        """Add amounts to courier balance counters after transaction is committed
+
+        it does nothing unless ACCOUNTING_BALANCE_COUNTERS setting is enabled
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount of courier in that date
+        """
+        if not settings.ACCOUNTING_BALANCE_COUNTERS:
+            return
+        transaction.on_commit(
+            functools.partial(counters.add_amounts, amounts), using=get_write_db(self)
+        )
+
+    def add_running_weekly_amounts(self, amounts) -> None:
+        """Add amounts to running weekly incomes if ACCOUNTING_RUNNING_WEEKLY_INCOME is enabled
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount of courier in that date
+        """
+        if not settings.ACCOUNTING_RUNNING_WEEKLY_INCOME:
+            return
+        running_weekly_income_model = apps.get_model(
+            "accounting", "RunningWeeklyIncome"
+        )
+        running_weekly_income_model.objects.add_daily_amounts(amounts)
+
+    def update_incomes(self, incomes) -> int:
+        """Update couriers daily incomes, based on many incomes
+
+        incomes are grouped by courier and date and their summed amounts
+        are applied to daily incomes by add_amounts, then all of them are
+        marked as processed with one query, all in the same transaction.
+        processed incomes are ignored, so caller must lock incomes
+        (e.g. by select_for_update) to not process an income twice concurrently.
+
+        Args:
+            incomes (Iterable[accounting.models.Income]): saved instances of Income model
+
+        Returns:
+            int: number of processed incomes
+        """
+        income_model = apps.get_model("accounting", "Income")
+        incomes = [income for income in incomes if not income.is_processed()]
+        if not incomes:
+            return 0
+        with transaction.atomic(using=get_write_db(self)):
+            self.add_amounts(self.model.get_incomes_amounts(incomes))
+            income_model.objects.using(get_write_db(self)).filter(
+                id__in=[income.id for income in incomes]
+            ).update(status=income_model.Status.PROCESSED)
+        for income in incomes:
+            income.status = income_model.Status.PROCESSED
+        return len(incomes)
+
     def update_income(self, income) -> None:
         """Update courier daily income, based on the new income
 
@@ -106,6 +589,12 @@ class DailyIncomeManager(models.Manager):
         so handle race condition we use select_for_update to lock database row
         and we use atomic transaction to ensure that the
         income and daily income either both updated or none of them effected
+        if ACCOUNTING_DAILY_INCOME_UPSERT setting is enabled and database supports it,
+        daily income is updated by upsert_income instead.
+        if ACCOUNTING_DAILY_INCOME_WRITE_BEHIND setting is enabled, income is accumulated
+        in redis after commit, and flushed to daily income by flush_daily_income_deltas task.
+        if ACCOUNTING_DAILY_INCOME_STRIPES is more than one, income is added to
+        one of daily income stripes, so only incomes of that stripe wait for each other.
 
         Args:
             income (accounting.models.Income): a saved instance of Income instance send here by post_save signal
@@ -115,11 +604,59 @@ class DailyIncomeManager(models.Manager):
         """
         if income.is_processed():
             raise IncomeIsGeneratedAsProcessed()
-        daily_income = self.get_daily_income(income)
-        daily_income._update_daily_amount(income)
+        if settings.ACCOUNTING_DAILY_INCOME_WRITE_BEHIND:
+            transaction.on_commit(
+                functools.partial(accumulators.add_income, income),
+                using=get_write_db(self),
+            )
+            return
+        if settings.ACCOUNTING_DAILY_INCOME_UPSERT and supports_upsert(
+            connections[get_write_db(self)]
+        ):
+            self.upsert_income(income)
+            return
         with transaction.atomic():
-            daily_income.save()
+            if is_striped():
+                stripe = self.get_stripe_manager().get_stripe(income)
+                stripe.amount += income.get_signed_amount()
+                stripe.save()
+            else:
+                daily_income = self.get_daily_income(income)
+                daily_income._update_daily_amount(income)
+                daily_income.save()
             income.update_income_status()
+            amounts = self.model.get_incomes_amounts([income])
+            self.add_running_weekly_amounts(amounts)
+            self.add_balance_counter_amounts(amounts)
+
+    def upsert_income(self, income) -> None:
+        """Update courier daily income, based on the new income, in one statement
+
+        signed amount of income is added to daily income by
+        INSERT ... ON CONFLICT (date, courier_id) DO UPDATE, so daily income row
+        is locked only during this statement, instead of select_for_update, update
+        in python and save. income status is changed conditionally first, in the
+        same transaction, so an income is never added twice to daily income.
+
+        Args:
+            income (accounting.models.Income): a saved instance of Income model
+
+        Raises:
+            IncomeIsGeneratedAsProcessed: if income instance is processed, can't be processed another time
+        """
+        if income.is_processed():
+            raise IncomeIsGeneratedAsProcessed()
+        income_model = apps.get_model("accounting", "Income")
+        with transaction.atomic(using=get_write_db(self)):
+            processed = (
+                income_model.objects.using(get_write_db(self))
+                .filter(pk=income.pk, status=income.Status.ACTIVE)
+                .update(status=income.Status.PROCESSED)
+            )
+            if not processed:
+                raise IncomeIsGeneratedAsProcessed()
+            self.add_amounts(self.model.get_incomes_amounts([income]), upsert=True)
+        income.status = income.Status.PROCESSED
 
     def create(self, **kwargs):
         raise NotImplementedError
@@ -131,7 +668,94 @@ class DailyIncomeManager(models.Manager):
         raise NotImplementedError
 
 
-class WeeklyIncomeManager(models.Manager):
+class DailyIncomeStripeManager(models.Manager):
+    fold_batch_size = 1_000
+
+    def get_queryset(self):
+        return DailyIncomeStripeQuerySet(self.model, using=self._db)
+
+    def get_stripe(self, income):
+        """Get stripe of daily income that income is added to
+
+        stripe is selected by income id modulo ACCOUNTING_DAILY_INCOME_STRIPES,
+        and it's locked or created with amount=0
+
+        Args:
+            income (accounting.models.Income): a saved instance of Income model
+
+        Returns:
+            accounting.models.DailyIncomeStripe: locked stripe of daily income
+        """
+        stripe, _ = (
+            self.get_queryset()
+            .select_for_update()
+            .get_or_create(
+                courier_id=income.courier_id,
+                date=income.created_at.date(),
+                stripe=income.id % settings.ACCOUNTING_DAILY_INCOME_STRIPES,
+                defaults={"amount": 0},
+            )
+        )
+        return stripe
+
+    def get_yesterday_amount(self):
+        result = self.get_queryset().yesterday().aggregate(Sum("amount"))["amount__sum"]
+        return result if result else 0
+
+    def get_amounts(self, **filters):
+        """Sum stripes of each courier and date
+
+        Returns:
+            Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]: summation of stripes
+        """
+        return {
+            (courier_id, date): amount
+            for courier_id, date, amount in self.get_queryset()
+            .filter(**filters)
+            .values("courier_id", "date")
+            .annotate(amount=Sum("amount"))
+            .values_list("courier_id", "date", "amount")
+        }
+
+    def fold(self, before=None, **filters) -> int:
+        """Fold stripes into daily incomes
+
+        stripes are locked, their amounts are added to daily incomes and they are deleted
+        in one transaction, running weekly incomes and balance counters are not changed,
+        because stripe amounts are added to them when stripes are updated.
+
+        Args:
+            before (Date, optional): only stripes before this date are folded,
+                so stripes of today, that are being updated, are not locked
+            filters: other filters of stripes, e.g. a courier range
+
+        Returns:
+            int: number of folded stripes
+        """
+        queryset = self.get_queryset().filter(**filters)
+        if before is not None:
+            queryset = queryset.filter(date__lt=before)
+        daily_income_model = apps.get_model("accounting", "DailyIncome")
+        with transaction.atomic(using=get_write_db(self), savepoint=False):
+            stripes = list(
+                queryset.select_for_update()
+                .order_by("courier_id", "date", "stripe")
+                .values_list("id", "courier_id", "date", "amount")
+            )
+            if not stripes:
+                return 0
+            amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+            for _, courier_id, date, amount in stripes:
+                amounts[(courier_id, date)] += amount
+            daily_income_model.objects.apply_amounts(amounts)
+            ids = [stripe_id for stripe_id, *_ in stripes]
+            for start in range(0, len(ids), self.fold_batch_size):
+                end = start + self.fold_batch_size
+                self.get_queryset().filter(id__in=ids[start:end]).delete()
+        return len(stripes)
+
+
+class WeeklyIncomeManager(CumulativeIncomeManager):
     def get_queryset(self):
         return super().get_queryset()
 
@@ -152,3 +776,379 @@ class WeeklyIncomeManager(models.Manager):
                 self.model(courier_id=courier_id, date=date, amount=amount)
             )
         self.bulk_create(weekly_incomes)
+
+    def insert_weekly_income(self, report):
+        """Insert all weekly incomes by one INSERT INTO ... SELECT statement
+
+        report queryset is compiled to its SELECT statement and inserted
+        in database, so report rows are never fetched by python.
+        if database supports it, existing weekly incomes of the same courier and date
+        are overwritten by ON CONFLICT DO UPDATE, so inserting a report twice is harmless
+
+        Args:
+            report (QuerySet): values queryset of courier_id, date and amount,
+                e.g. DailyIncomeManager.get_weekly_report
+
+        Returns:
+            int: number of created or updated weekly incomes
+        """
+        on_conflict = ""
+        if supports_upsert(connections[get_write_db(self)]):
+            on_conflict = (
+                "ON CONFLICT (date, courier_id) DO UPDATE SET amount = EXCLUDED.amount"
+            )
+        return insert_from_select(self, report, on_conflict)
+
+    def add_weekly_report(self, report):
+        """Add report amounts to weekly incomes by one INSERT INTO ... SELECT statement
+
+        amounts are added to existing weekly incomes of the same courier and date
+        by ON CONFLICT DO UPDATE, so weekly incomes that are generated before,
+        e.g. by a late income of a sealed week, are not overwritten.
+        if database does not support it, amounts are applied by apply_amounts
+
+        Args:
+            report (QuerySet): values queryset of courier_id, date and amount,
+                e.g. RunningWeeklyIncomeManager.get_weekly_report
+
+        Returns:
+            int: number of created or updated weekly incomes
+        """
+        connection = connections[get_write_db(self)]
+        if not supports_upsert(connection):
+            amounts = {
+                (courier_id, date): amount
+                for courier_id, date, amount in report.values_list(
+                    "courier_id", "date", "amount"
+                )
+            }
+            self.apply_amounts(amounts)
+            return len(amounts)
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        return insert_from_select(
+            self,
+            report,
+            "ON CONFLICT (date, courier_id) "
+            f"DO UPDATE SET amount = {table}.amount + EXCLUDED.amount",
+        )
+
+
+class RunningWeeklyIncomeManager(CumulativeIncomeManager):
+    def add_daily_amounts(self, amounts) -> None:
+        """Add daily amounts to running weekly income of their week
+
+        Args:
+            amounts (Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]):
+                signed amount of courier in that date
+        """
+        weekly_amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+        for (courier_id, date), amount in amounts.items():
+            weekly_amounts[(courier_id, get_week_start(date))] += amount
+        self.upsert_amounts(dict(weekly_amounts))
+
+    def get_weekly_report(self, before, courier_id_range=None):
+        """return weekly report of running weekly incomes of weeks started before a date
+
+        Args:
+            before (Date): weeks started before this date are reported
+            courier_id_range (Tuple[Int, Int], optional): half-open range of courier ids
+                to limit report to them
+        """
+        return (
+            self.get_range(courier_id_range)
+            .filter(date__lt=before)
+            .values("courier_id", "date", "amount")
+        )
+
+    def get_range(self, courier_id_range=None):
+        """return running weekly incomes, limited to a range of courier ids if it's given"""
+        queryset = self.get_queryset()
+        if courier_id_range is not None:
+            courier_from, courier_to = courier_id_range
+            queryset = queryset.filter(
+                courier_id__gte=courier_from, courier_id__lt=courier_to
+            )
+        return queryset
+
+    def rebuild(self, courier_id_range) -> None:
+        """Rebuild running weekly incomes of a range of couriers from daily incomes
+
+        active daily incomes and stripes of couriers are summed by week and replace
+        their running weekly incomes, e.g. days before ACCOUNTING_RUNNING_WEEKLY_INCOME
+        is enabled. on PostgreSQL running weekly income table is locked against writes
+        until it's committed, so amounts that are written concurrently are added
+        after rebuild and not lost or counted twice.
+
+        Args:
+            courier_id_range (Tuple[Int, Int]): half-open range of courier ids
+        """
+        daily_income_model = apps.get_model("accounting", "DailyIncome")
+        courier_from, courier_to = courier_id_range
+        filters = {"courier_id__gte": courier_from, "courier_id__lt": courier_to}
+        db = get_write_db(self)
+        connection = connections[db]
+        with transaction.atomic(using=db):
+            if connection.vendor == "postgresql":
+                table = connection.ops.quote_name(self.model._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            self.get_range(courier_id_range).delete()
+            amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+            for courier_id, date, amount in (
+                daily_income_model.objects.get_queryset()
+                .filter(status=daily_income_model.Status.ACTIVE, **filters)
+                .values_list("courier_id", "date", "amount")
+                .iterator()
+            ):
+                amounts[(courier_id, date)] += amount
+            stripe_manager = daily_income_model.objects.get_stripe_manager()
+            for key, amount in stripe_manager.get_amounts(**filters).items():
+                amounts[key] += amount
+            self.add_daily_amounts(dict(amounts))
+
+    def get_current_week_amount(self, courier_id):
+        """return courier income in current week, 0 if there is nothing"""
+        amount = (
+            self.get_queryset()
+            .filter(courier_id=courier_id, date=get_week_start(datetime.date.today()))
+            .values_list("amount", flat=True)
+            .first()
+        )
+        return amount if amount else 0
+
+
+class IncomeRollupManager(models.Manager):
+    def get_checkpoint_name(self, period, date):
+        """return name of checkpoint that records rollups of period and date are built"""
+        return f"income_rollup:{self.model.Period(period).name.lower()}:{date:%Y-%m-%d}"
+
+    def get_checkpoint_manager(self):
+        return apps.get_model("accounting", "Checkpoint").objects.db_manager(
+            get_write_db(self)
+        )
+
+    def get_built_buckets(self, buckets):
+        """return buckets that their rollups are built
+
+        rollups are built for couriers with daily incomes in the bucket, so built
+        buckets are recorded by checkpoints, and a courier without rollup in a built
+        bucket has no income in it
+
+        Args:
+            buckets (Iterable[Tuple[period(Int), date(Date)]]): period and start of buckets
+        """
+        names = {self.get_checkpoint_name(*bucket): bucket for bucket in buckets}
+        checkpoint_model = apps.get_model("accounting", "Checkpoint")
+        return {
+            names[name]
+            for name in checkpoint_model.objects.filter(name__in=names).values_list(
+                "name", flat=True
+            )
+        }
+
+    def rebuild(self, period, date, report):
+        """Replace rollups of period and date by report and record they are built"""
+        checkpoint_manager = self.get_checkpoint_manager()
+        name = self.get_checkpoint_name(period, date)
+        with transaction.atomic(using=get_write_db(self)):
+            self.get_queryset().filter(period=period, date=date).delete()
+            checkpoint_manager.filter(name=name).delete()
+            if report is None:
+                return 0
+            created = insert_from_select(self, report)
+            checkpoint_manager.create(name=name)
+            return created
+
+    def rebuild_month(self, month):
+        """Rebuild monthly income rollups of month from daily incomes
+
+        Args:
+            month (datetime.date): a date in the month
+
+        Returns:
+            int: number of created rollups
+        """
+        daily_income_model = apps.get_model("accounting", "DailyIncome")
+        month_start = get_month_start(month)
+        report = (
+            daily_income_model.objects.get_queryset()
+            .filter(date__gte=month_start, date__lt=get_next_month_start(month))
+            .values("courier_id")
+            .annotate(
+                amount=Sum("amount"),
+                date=Value(month_start, output_field=DateField()),
+                period=Value(self.model.Period.MONTH, output_field=IntegerField()),
+            )
+        )
+        return self.rebuild(self.model.Period.MONTH, month_start, report)
+
+    def rebuild_year(self, year):
+        """Rebuild yearly income rollups of year from its monthly income rollups
+
+        yearly rollups are built only if monthly rollups of all months of year
+        are built, otherwise they are removed, so total reads the year by its months
+
+        Args:
+            year (int): year
+
+        Returns:
+            int: number of created rollups
+        """
+        year_start = datetime.date(year, 1, 1)
+        months = [
+            (self.model.Period.MONTH, datetime.date(year, m, 1)) for m in range(1, 13)
+        ]
+        report = None
+        if len(self.get_built_buckets(months)) == len(months):
+            report = (
+                self.get_queryset()
+                .filter(
+                    period=self.model.Period.MONTH,
+                    date__gte=year_start,
+                    date__lt=datetime.date(year + 1, 1, 1),
+                )
+                .values("courier_id")
+                .annotate(
+                    amount=Sum("amount"),
+                    date=Value(year_start, output_field=DateField()),
+                    period=Value(self.model.Period.YEAR, output_field=IntegerField()),
+                )
+            )
+        return self.rebuild(self.model.Period.YEAR, year_start, report)
+
+    def total(self, courier, start, end):
+        """Return courier total income from start to end date, inclusive
+
+        range is split into the fewest buckets, whole years and months before
+        current month are read from rollups of courier and remaining days from
+        daily incomes, so total of a year reads tens of rows instead of hundreds
+        of daily incomes. years and months that their rollups are not built yet,
+        e.g. last month before build_income_rollups runs, are read from daily incomes.
+
+        Args:
+            courier (accounting.models.Courier): courier instance or id
+            start (datetime.date): first date of range
+            end (datetime.date): last date of range
+
+        Returns:
+            int: summation of amount, 0 if there is nothing
+        """
+        daily_income_model = apps.get_model("accounting", "DailyIncome")
+        days, months, years = split_date_range(
+            start,
+            end + datetime.timedelta(days=1),
+            closed_before=get_month_start(datetime.date.today()),
+        )
+        total = 0
+        buckets = [(self.model.Period.YEAR, year) for year in years]
+        buckets += [(self.model.Period.MONTH, month) for month in months]
+        built_buckets = self.get_built_buckets(buckets) if buckets else set()
+        rollups_filter = Q()
+        for period, bucket_start in buckets:
+            if (period, bucket_start) in built_buckets:
+                rollups_filter |= Q(period=period, date=bucket_start)
+            elif period == self.model.Period.YEAR:
+                days.append((bucket_start, datetime.date(bucket_start.year + 1, 1, 1)))
+            else:
+                days.append((bucket_start, get_next_month_start(bucket_start)))
+        if built_buckets:
+            total += (
+                self.get_queryset()
+                .filter(rollups_filter, courier=courier)
+                .aggregate(Sum("amount"))["amount__sum"]
+                or 0
+            )
+        if days:
+            days_filter = Q()
+            for days_start, days_stop in days:
+                days_filter |= Q(date__gte=days_start, date__lt=days_stop)
+            total += (
+                daily_income_model.objects.get_queryset()
+                .filter(days_filter, courier=courier)
+                .aggregate(Sum("amount"))["amount__sum"]
+                or 0
+            )
+        return total
+
+
+class WeeklyIncomeProgressManager(models.Manager):
+    def get_completed_ranges(self, date):
+        """return start of courier id ranges that weekly income of date is generated for"""
+        return set(
+            self.get_queryset().filter(date=date).values_list("courier_from", flat=True)
+        )
+
+    def complete(self, date, courier_id_range):
+        """record generation of weekly income of date for a range of courier ids"""
+        courier_from, courier_to = courier_id_range
+        self.bulk_create(
+            [self.model(date=date, courier_from=courier_from, courier_to=courier_to)],
+            ignore_conflicts=True,
+        )
+
+
+class CheckpointManager(models.Manager):
+    def get_position(self, name):
+        """Return last stored position of checkpoint, 0 if there is nothing"""
+        position = (
+            self.get_queryset().filter(name=name).values_list("position", flat=True)
+        ).first()
+        return position if position else 0
+
+    def advance(self, name, position):
+        """Move checkpoint forward to position
+
+        checkpoint never moves backward, so concurrent workers
+        can advance the same checkpoint in any order
+        """
+        _, created = self.get_or_create(name=name, defaults={"position": position})
+        if not created:
+            self.get_queryset().filter(name=name).update(
+                position=Greatest(F("position"), Value(position))
+            )
+
+    def reset(self, name):
+        """Move checkpoint to the beginning"""
+        self.get_queryset().filter(name=name).update(position=0)
+
+    def set_position(self, name, position):
+        """Store position of checkpoint, to be used as a gauge"""
+        self.update_or_create(name=name, defaults={"position": position})
+
+    def lock(self, name):
+        """Lock checkpoint until the end of transaction, if it is not locked already
+
+        checkpoint is created if it does not exist, then it's locked with
+        SKIP LOCKED, so it must be called inside a transaction and
+        a worker that finds it locked by another one can skip its run.
+
+        Returns:
+            bool: whether checkpoint is locked by this transaction
+        """
+        self.get_or_create(name=name)
+        return (
+            self.get_queryset()
+            .select_for_update(skip_locked=True)
+            .filter(name=name)
+            .exists()
+        )
+
+    def increment(self, name, value):
+        """Add value to checkpoint position, to be used as a counter"""
+        _, created = self.get_or_create(name=name, defaults={"position": value})
+        if not created:
+            self.get_queryset().filter(name=name).update(position=F("position") + value)
+
+    def get_watermark(self, name):
+        """Return datetime stored in checkpoint, None if there is nothing
+
+        datetime is stored as microseconds since epoch in position
+        """
+        position = self.get_position(name)
+        if not position:
+            return None
+        return EPOCH + datetime.timedelta(microseconds=position)
+
+    def advance_watermark(self, name, watermark):
+        """Move datetime stored in checkpoint forward to watermark"""
+        self.advance(name, (watermark - EPOCH) // datetime.timedelta(microseconds=1))
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.8 on 2026-10-18 07:59
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounting", "0006_alter_dailyincome_date_alter_weeklyincome_date_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dailyincome",
+            name="date",
+            field=models.DateField(default=datetime.date.today, verbose_name="date"),
+        ),
+        migrations.AlterField(
+            model_name="weeklyincome",
+            name="date",
+            field=models.DateField(default=datetime.date.today, verbose_name="date"),
+        ),
+    ]
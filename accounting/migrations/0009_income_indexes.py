@@ -0,0 +1,21 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0008_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['created_at'], name='income_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(condition=models.Q(('status', 0)), fields=['created_at'], name='income_active_created_at_idx'),
+        ),
+    ]
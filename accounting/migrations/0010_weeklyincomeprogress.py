@@ -0,0 +1,32 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0009_income_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyIncomeProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField(verbose_name='date')),
+                ('courier_from', models.BigIntegerField(verbose_name='courier from')),
+                ('courier_to', models.BigIntegerField(verbose_name='courier to')),
+            ],
+            options={
+                'verbose_name': 'weekly income progress',
+                'verbose_name_plural': 'weekly income progresses',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='weeklyincomeprogress',
+            constraint=models.UniqueConstraint(fields=('date', 'courier_from'), name='date_courier_from_unique_together_weekly_income_progress'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:07
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0010_weeklyincomeprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunningWeeklyIncome',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(default=datetime.date.today, verbose_name='date')),
+                ('amount', models.IntegerField(verbose_name='amount')),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='accounting.courier', verbose_name='courier')),
+            ],
+            options={
+                'verbose_name': 'running weekly income',
+                'verbose_name_plural': 'running weekly incomes',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='runningweeklyincome',
+            constraint=models.UniqueConstraint(fields=('date', 'courier'), name='courier_date_unique_together_running_weekly_income'),
+        ),
+    ]
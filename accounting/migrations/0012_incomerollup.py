@@ -0,0 +1,32 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0011_runningweeklyincome'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncomeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.IntegerField(choices=[(0, 'Month'), (1, 'Year')], verbose_name='period')),
+                ('date', models.DateField(verbose_name='date')),
+                ('amount', models.BigIntegerField(verbose_name='amount')),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='accounting.courier', verbose_name='courier')),
+            ],
+            options={
+                'verbose_name': 'income rollup',
+                'verbose_name_plural': 'income rollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='incomerollup',
+            constraint=models.UniqueConstraint(fields=('courier', 'period', 'date'), name='courier_period_date_unique_together_income_rollup'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0012_incomerollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='weeklyincome',
+            index=models.Index(fields=['date', 'id'], name='weekly_income_date_id_idx'),
+        ),
+    ]
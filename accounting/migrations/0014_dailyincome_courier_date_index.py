@@ -0,0 +1,17 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0013_weeklyincome_date_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailyincome',
+            index=models.Index(fields=['courier', 'date'], include=('amount', 'status'), name='daily_income_courier_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.8 on 2026-10-18 08:20
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0014_dailyincome_courier_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyIncomeStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(default=datetime.date.today, verbose_name='date')),
+                ('amount', models.IntegerField(verbose_name='amount')),
+                ('stripe', models.PositiveSmallIntegerField(verbose_name='stripe')),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='accounting.courier', verbose_name='courier')),
+            ],
+            options={
+                'verbose_name': 'daily income stripe',
+                'verbose_name_plural': 'daily income stripes',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyincomestripe',
+            constraint=models.UniqueConstraint(fields=('date', 'courier', 'stripe'), name='courier_date_stripe_unique_together_daily_income_stripe'),
+        ),
+    ]
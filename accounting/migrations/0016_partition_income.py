@@ -0,0 +1,167 @@
+import datetime
+
+from django.db import migrations
+
+TABLE = "accounting_income"
+LEGACY_TABLE = f"{TABLE}_legacy"
+# partitions of months after current month that are created by the migration,
+# the rest are created by maintain_income_partitions task.
+# it's fixed, so the migration does not change with settings
+PARTITIONS_AHEAD = 3
+
+
+def get_month_start(date):
+    return date.replace(day=1)
+
+
+def get_next_month_start(date):
+    return (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def is_partitioned(connection):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def name_partition_indexes(connection, partition):
+    """Rename indexes of partition after their parent indexes, with partition suffix"""
+    suffix = partition.removeprefix(f"{TABLE}_")
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, parent.relname FROM pg_index
+            JOIN pg_class child ON child.oid = pg_index.indexrelid
+            JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            WHERE pg_index.indrelid = %s::regclass
+            """,
+            [partition],
+        )
+        for child, parent in cursor.fetchall():
+            name = f"{parent[:62 - len(suffix)]}_{suffix}"
+            if child != name:
+                cursor.execute(
+                    f"ALTER INDEX {quote_name(child)} RENAME TO {quote_name(name)}"
+                )
+
+
+def create_partitions(connection, start, stop):
+    """Create monthly partitions from start month to stop month, inclusive
+
+    partitions are named accounting_income_pYYYYMM and cover
+    [month start, next month start) in UTC
+
+    Returns:
+        List[str]: names of created partitions
+    """
+    quote_name = connection.ops.quote_name
+    partitions = []
+    month = get_month_start(start)
+    with connection.cursor() as cursor:
+        while month <= stop:
+            next_month = get_next_month_start(month)
+            partition = f"{TABLE}_p{month:%Y%m}"
+            cursor.execute(
+                f"CREATE TABLE {quote_name(partition)} PARTITION OF {quote_name(TABLE)} "
+                "FOR VALUES FROM (%s) TO (%s)",
+                [
+                    datetime.datetime.combine(
+                        month, datetime.time.min, datetime.timezone.utc
+                    ),
+                    datetime.datetime.combine(
+                        next_month, datetime.time.min, datetime.timezone.utc
+                    ),
+                ],
+            )
+            partitions.append(partition)
+            month = next_month
+    return partitions
+
+
+def rebuild_income_table(apps, schema_editor, partitioned):
+    """Copy Income table into a new table, partitioned by created_at month or not
+
+    primary key of a partitioned table must include partition key,
+    so it is (id, created_at) on partitioned table and id on normal table.
+    """
+    Income = apps.get_model("accounting", "Income")
+    connection = schema_editor.connection
+    quote_name = connection.ops.quote_name
+    table, legacy = quote_name(TABLE), quote_name(LEGACY_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        (sequence,) = cursor.fetchone()
+        cursor.execute(f"SELECT min(created_at) FROM {table}")
+        (first,) = cursor.fetchone()
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cursor.execute(
+            f"CREATE TABLE {table} "
+            f"(LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            + (" PARTITION BY RANGE (created_at)" if partitioned else "")
+        )
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    if partitioned:
+        today = datetime.date.today()
+        start = first.date() if first else today
+        start = min(start, get_month_start(today) - datetime.timedelta(days=1))
+        stop = get_month_start(today)
+        for _ in range(PARTITIONS_AHEAD):
+            stop = get_next_month_start(stop)
+        partitions = create_partitions(connection, start, stop)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+        cursor.execute(f"DROP TABLE {legacy} CASCADE")
+        primary_key = "id, created_at" if partitioned else "id"
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({primary_key})")
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT "
+            f"{quote_name(f'{TABLE}_courier_id_fk_accounting_courier_id')} "
+            f"FOREIGN KEY (courier_id) REFERENCES {quote_name('accounting_courier')} (id) "
+            "DEFERRABLE INITIALLY DEFERRED"
+        )
+        cursor.execute(
+            f"CREATE INDEX {quote_name(f'{TABLE}_courier_id_idx')} "
+            f"ON {table} (courier_id)"
+        )
+    for index in Income._meta.indexes:
+        schema_editor.add_index(Income, index)
+    if partitioned:
+        for partition in partitions:
+            name_partition_indexes(connection, partition)
+
+
+def partition_income(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    if is_partitioned(schema_editor.connection):
+        return
+    rebuild_income_table(apps, schema_editor, partitioned=True)
+
+
+def unpartition_income(apps, schema_editor):
+    if not is_partitioned(schema_editor.connection):
+        return
+    rebuild_income_table(apps, schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    """Partition Income table by created_at month on PostgreSQL
+
+    rows are copied to the partitioned table in the migration transaction,
+    so on big tables it must be run in a maintenance window.
+    """
+
+    dependencies = [
+        ("accounting", "0015_dailyincomestripe"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_income, unpartition_income),
+    ]
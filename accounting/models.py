@@ -1,8 +1,21 @@
+import datetime
+from collections import defaultdict
+
 from django.db import models
+from django.db.models import Q
 from django.db.models.constraints import UniqueConstraint
 from django.utils.translation import gettext as _
 
-from accounting.managers import DailyIncomeManager, IncomeManager, WeeklyIncomeManager
+from accounting.managers import (
+    CheckpointManager,
+    DailyIncomeManager,
+    DailyIncomeStripeManager,
+    IncomeManager,
+    IncomeRollupManager,
+    RunningWeeklyIncomeManager,
+    WeeklyIncomeManager,
+    WeeklyIncomeProgressManager,
+)
 from accounting.mixins import Processable, TimeStampable
 
 
@@ -42,6 +55,14 @@ class Income(TimeStampable, Processable, models.Model):
     class Meta:
         verbose_name = _("Trip")
         verbose_name_plural = _("Trips")
+        indexes = [
+            models.Index(fields=["created_at"], name="income_created_at_idx"),
+            models.Index(
+                fields=["created_at"],
+                condition=Q(status=Processable.Status.ACTIVE),
+                name="income_active_created_at_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.courier}: {self.amount}"
@@ -68,7 +89,7 @@ class CumulativeIncome(models.Model):
     courier = models.ForeignKey(
         "accounting.Courier", verbose_name=_("courier"), on_delete=models.PROTECT
     )
-    date = models.DateField(_("date"), auto_now=False, auto_now_add=True)
+    date = models.DateField(_("date"), default=datetime.date.today)
     amount = models.IntegerField(_("amount"))
 
     class Meta:
@@ -91,10 +112,59 @@ class DailyIncome(Processable, CumulativeIncome):
                 name="courier_date_unique_together_daily_income",
             )
         ]
+        indexes = [
+            # covering index of courier timeline, answered by index-only scan
+            models.Index(
+                fields=["courier", "date"],
+                include=["amount", "status"],
+                name="daily_income_courier_date_idx",
+            )
+        ]
 
     def _update_daily_amount(self, income: Income):
         self.amount += income.get_signed_amount()
 
+    @staticmethod
+    def get_incomes_amounts(incomes):
+        """Sum signed amount of incomes per courier and date
+
+        Args:
+            incomes (Iterable[accounting.models.Income]): saved instances of Income model
+
+        Returns:
+            Dict[Tuple[courier_id(Int), date(Date)], amount(Int)]: summation of signed amounts
+        """
+        amounts: defaultdict[tuple[int, datetime.date], int] = defaultdict(int)
+        for income in incomes:
+            amounts[
+                (income.courier_id, income.created_at.date())
+            ] += income.get_signed_amount()
+        return dict(amounts)
+
+
+class DailyIncomeStripe(CumulativeIncome):
+    """Stripe of a courier daily income
+
+    if ACCOUNTING_DAILY_INCOME_STRIPES is more than one, incomes of a courier in a date
+    are added to one of its stripes by income id, so concurrent incomes of a courier
+    lock different rows, stripes are summed with daily income on read and
+    folded into daily income when their date is passed.
+    """
+
+    stripe = models.PositiveSmallIntegerField(_("stripe"))
+
+    objects = DailyIncomeStripeManager()
+
+    class Meta:
+        verbose_name = _("daily income stripe")
+        verbose_name_plural = _("daily income stripes")
+        constraints = [
+            UniqueConstraint(
+                fields=["date", "courier", "stripe"],
+                name="courier_date_stripe_unique_together_daily_income_stripe",
+            )
+        ]
+
 
 class WeeklyIncome(CumulativeIncome):
 
@@ -109,3 +179,107 @@ class WeeklyIncome(CumulativeIncome):
                 name="courier_date_unique_together_weekly_income",
             )
         ]
+        indexes = [
+            models.Index(fields=["date", "id"], name="weekly_income_date_id_idx")
+        ]
+
+
+class RunningWeeklyIncome(CumulativeIncome):
+    """Running weekly income accumulates courier incomes of a week
+
+    date is the saturday that week is started on, it's updated in the same transaction
+    as daily income, so current week income of a courier is always available
+    and weekly income is generated from it without scanning daily incomes.
+    """
+
+    objects = RunningWeeklyIncomeManager()
+
+    class Meta:
+        verbose_name = _("running weekly income")
+        verbose_name_plural = _("running weekly incomes")
+        constraints = [
+            UniqueConstraint(
+                fields=["date", "courier"],
+                name="courier_date_unique_together_running_weekly_income",
+            )
+        ]
+
+
+class IncomeRollup(models.Model):
+    """Income rollup stores courier income of a whole month or year
+
+    monthly rollups are built from daily incomes and yearly rollups from monthly rollups,
+    date is the first day of the period. they are used to calculate courier total income
+    in long date ranges without summing all of daily incomes.
+    periods that their rollups are built are recorded by checkpoints.
+    """
+
+    class Period(models.IntegerChoices):
+        MONTH = 0
+        YEAR = 1
+
+    objects = IncomeRollupManager()
+    courier = models.ForeignKey(
+        "accounting.Courier", verbose_name=_("courier"), on_delete=models.PROTECT
+    )
+    period = models.IntegerField(_("period"), choices=Period.choices)
+    date = models.DateField(_("date"))
+    amount = models.BigIntegerField(_("amount"))
+
+    class Meta:
+        verbose_name = _("income rollup")
+        verbose_name_plural = _("income rollups")
+        constraints = [
+            UniqueConstraint(
+                fields=["courier", "period", "date"],
+                name="courier_period_date_unique_together_income_rollup",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.courier}: {self.amount}-{self.get_period_display()} {self.date}"
+
+
+class WeeklyIncomeProgress(TimeStampable, models.Model):
+    """Weekly income progress stores ranges of couriers that their weekly income is generated
+
+    weekly incomes are generated in ranges of courier ids, each in its own transaction,
+    so if generation fails halfway, the next run generates only the remaining ranges.
+    """
+
+    objects = WeeklyIncomeProgressManager()
+    date = models.DateField(_("date"))
+    courier_from = models.BigIntegerField(_("courier from"))
+    courier_to = models.BigIntegerField(_("courier to"))
+
+    class Meta:
+        verbose_name = _("weekly income progress")
+        verbose_name_plural = _("weekly income progresses")
+        constraints = [
+            UniqueConstraint(
+                fields=["date", "courier_from"],
+                name="date_courier_from_unique_together_weekly_income_progress",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.courier_from}-{self.courier_to}"
+
+
+class Checkpoint(TimeStampable, models.Model):
+    """Checkpoint stores progress of long-running tasks
+
+    tasks that walk a table in chunks store the last processed position,
+    so if they are killed, e.g. by time limit, the next run resumes from there.
+    """
+
+    objects = CheckpointManager()
+    name = models.CharField(_("name"), max_length=100, unique=True)
+    position = models.BigIntegerField(_("position"), default=0)
+
+    class Meta:
+        verbose_name = _("checkpoint")
+        verbose_name_plural = _("checkpoints")
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
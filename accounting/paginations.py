@@ -0,0 +1,195 @@
+import base64
+import binascii
+import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import BooleanField, ExpressionWrapper
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class OptionalCountPageNumberPagination(PageNumberPagination):
+    """Page number pagination that total count can be skipped
+
+    with count=false query parameter, COUNT(*) query is not run, one more row than
+    page size is fetched to find out there is a next page and count is not returned
+    """
+
+    count_query_param = "count"
+    invalid_page_message = "Invalid page."
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, "").lower() not in [
+            "false",
+            "0",
+        ]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.with_count = self.include_count(request)
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.url = request.build_absolute_uri()
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+            if self.page_number < 1:
+                raise InvalidPage
+        except (TypeError, ValueError, InvalidPage):
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * page_size
+        end = offset + page_size + 1
+        results = list(queryset[offset:end])
+        self.has_next = len(results) > page_size
+        return results[:page_size]
+
+    def get_next_link(self):
+        if self.with_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.url, self.page_query_param, self.page_number + 1
+        )
+
+    def get_previous_link(self):
+        if self.with_count:
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        if self.page_number == 2:
+            return remove_query_param(self.url, self.page_query_param)
+        return replace_query_param(
+            self.url, self.page_query_param, self.page_number - 1
+        )
+
+    def get_paginated_response(self, data):
+        if self.with_count:
+            return super().get_paginated_response(data)
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to false to skip total count of results.",
+                "schema": {"type": "boolean"},
+            }
+        ]
+
+
+class DateKeysetPagination(BasePagination):
+    """Keyset pagination ordered by date and id
+
+    cursor is the (date, id) of the last row of the page and the next page is
+    filtered by (date, id) > cursor, so with an index on (date, id) every page
+    is an index range scan of page size rows and its latency does not depend on depth.
+    it only moves forward and direction of ordering is taken from ordering query parameter.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.page_size
+        if not page_size:
+            return None
+        self.request = request
+        self.descending = self.is_descending(request, queryset, view)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(queryset, position))
+        if self.descending:
+            queryset = queryset.order_by("-date", "-id")
+        else:
+            queryset = queryset.order_by("date", "id")
+        results = list(queryset[: page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = self.get_position(results[-1])
+        return results
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return row["date"], row["id"]
+        return row.date, row.id
+
+    def is_descending(self, request, queryset, view):
+        ordering = OrderingFilter().get_ordering(request, queryset, view)
+        return bool(ordering) and ordering[0].startswith("-")
+
+    def get_position_filter(self, queryset, position):
+        """return (date, id) > position, or < if ordering is descending, as a row comparison"""
+        quote_name = queryset.query.get_compiler(queryset.db).quote_name_unless_alias
+        table = quote_name(queryset.model._meta.db_table)
+        operator = "<" if self.descending else ">"
+        return ExpressionWrapper(
+            RawSQL(
+                f"({table}.{quote_name('date')}, {table}.{quote_name('id')}) "
+                f"{operator} (%s, %s)",
+                position,
+            ),
+            output_field=BooleanField(),
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            date, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split("|")
+            return datetime.date.fromisoformat(date), int(pk)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        date, pk = position
+        return base64.urlsafe_b64encode(f"{date.isoformat()}|{pk}".encode()).decode()
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            }
+        ]
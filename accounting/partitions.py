@@ -0,0 +1,212 @@
+"""Monthly range partitions of Income table by created_at on PostgreSQL
+
+partitions are named accounting_income_pYYYYMM and cover [month start, next month start)
+in UTC, indexes of a partition are named after indexes of Income table, so query plans
+show which index is used. on other databases Income is a normal table and
+functions of this module do nothing.
+"""
+import datetime
+import logging
+import re
+
+from django.apps import apps
+
+from miare.utils import get_month_start, get_next_month_start
+
+logger = logging.getLogger(__name__)
+
+TABLE = "accounting_income"
+PARTITION_NAME_PATTERN = re.compile(rf"^{TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def get_partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def get_month_bound(month):
+    return datetime.datetime.combine(month, datetime.time.min, datetime.timezone.utc)
+
+
+def is_partitioned(connection):
+    """Check Income table is partitioned"""
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partition_months(connection):
+    """Return months of attached partitions, ordered"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [TABLE],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = PARTITION_NAME_PATTERN.match(name)
+        if match:
+            months.append(datetime.date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def name_partition_indexes(connection, partition):
+    """Rename indexes of partition after their parent indexes, with partition suffix"""
+    suffix = partition.removeprefix(f"{TABLE}_")
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, parent.relname FROM pg_index
+            JOIN pg_class child ON child.oid = pg_index.indexrelid
+            JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            WHERE pg_index.indrelid = %s::regclass
+            """,
+            [partition],
+        )
+        for child, parent in cursor.fetchall():
+            name = f"{parent[:62 - len(suffix)]}_{suffix}"
+            if child != name:
+                cursor.execute(
+                    f"ALTER INDEX {quote_name(child)} RENAME TO {quote_name(name)}"
+                )
+
+
+def create_partition(connection, month):
+    """Create partition of month if it does not exist
+
+    Returns:
+        bool: partition is created
+    """
+    month = get_month_start(month)
+    partition = get_partition_name(month)
+    if month in get_partition_months(connection):
+        return False
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {quote_name(partition)} PARTITION OF {quote_name(TABLE)} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            [get_month_bound(month), get_month_bound(get_next_month_start(month))],
+        )
+    name_partition_indexes(connection, partition)
+    logger.info(f"Income partition {partition} is created")
+    return True
+
+
+def create_partitions(connection, start, stop):
+    """Create partitions of months from start month to stop month, inclusive
+
+    Returns:
+        List[str]: names of created partitions
+    """
+    created = []
+    month = get_month_start(start)
+    while month <= stop:
+        if create_partition(connection, month):
+            created.append(get_partition_name(month))
+        month = get_next_month_start(month)
+    return created
+
+
+def has_active_incomes(connection, month):
+    """Check partition of month has incomes that are not processed yet"""
+    income_model = apps.get_model("accounting", "Income")
+    return (
+        income_model.objects.get_queryset()
+        .using(connection.alias)
+        .filter(
+            status=income_model.Status.ACTIVE,
+            created_at__gte=get_month_bound(month),
+            created_at__lt=get_month_bound(get_next_month_start(month)),
+        )
+        .exists()
+    )
+
+
+def detach_partitions(connection, before, schema, archived_months=None):
+    """Detach partitions of months before a month and move them to archive schema
+
+    detached partitions keep their data, they are not queried by Income model anymore
+    and can be dumped and dropped by database administrators.
+    partitions that have active incomes, or are not archived if archived_months is
+    given, are kept attached and logged, so their incomes are still processed
+    and archived before they are detached.
+
+    Args:
+        before (Date): partitions of months before this month are detached
+        schema (str): schema that detached partitions are moved to
+        archived_months (Iterable[Date], optional): months that are archived,
+            if incomes are archived before detaching their partitions
+
+    Returns:
+        List[str]: names of detached partitions
+    """
+    quote_name = connection.ops.quote_name
+    if archived_months is not None:
+        archived_months = set(archived_months)
+    detached = []
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_name(schema)}")
+        for month in get_partition_months(connection):
+            if month >= get_month_start(before):
+                break
+            partition = get_partition_name(month)
+            if has_active_incomes(connection, month):
+                logger.warning(f"Income partition {partition} has active incomes")
+                continue
+            if archived_months is not None and month not in archived_months:
+                logger.warning(f"Income partition {partition} is not archived")
+                continue
+            cursor.execute(
+                f"ALTER TABLE {quote_name(TABLE)} DETACH PARTITION {quote_name(partition)}"
+            )
+            cursor.execute(
+                f"ALTER TABLE {quote_name(partition)} SET SCHEMA {quote_name(schema)}"
+            )
+            logger.info(f"Income partition {partition} is detached to {schema}")
+            detached.append(partition)
+    return detached
+
+
+def maintain_partitions(
+    connection, today, ahead, retention, schema, archived_months=None
+):
+    """Create partitions of next months and detach partitions older than retention
+
+    Args:
+        today (Date): current date
+        ahead (int): number of months after current month to create partitions for
+        retention (int): number of months before current month to keep attached,
+            0 to keep all partitions
+        schema (str): schema that detached partitions are moved to
+        archived_months (Iterable[Date], optional): months that are archived,
+            partitions of other months are not detached, see detach_partitions
+
+    Returns:
+        Tuple[List[str], List[str]]: created and detached partitions
+    """
+    if not is_partitioned(connection):
+        return [], []
+    month = get_month_start(today)
+    stop = month
+    for _ in range(ahead):
+        stop = get_next_month_start(stop)
+    created = create_partitions(connection, month, stop)
+    detached = []
+    if retention:
+        before = month
+        for _ in range(retention):
+            before = get_month_start(before - datetime.timedelta(days=1))
+        detached = detach_partitions(connection, before, schema, archived_months)
+    return created, detached
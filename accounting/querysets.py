@@ -2,6 +2,8 @@ import datetime
 
 from django.db.models import QuerySet
 
+from miare.utils import get_datetime_range, get_yesterday_date
+
 
 class ProcessableQuerySet:
     """Processable QuerySet to defined logic for models that are processable"""
@@ -17,15 +19,44 @@ class DateTimeQuerySet:
 
     date_field = "date"
 
+    def get_range(self, date):
+        """return half-open range [start, end) of date_field values in date"""
+        return date, date + datetime.timedelta(days=1)
+
     def yesterday(self):
-        """filter queryset with date_field=yesterday"""
-        yesterday = datetime.date.today() - datetime.timedelta(days=1)
-        return self.filter(**{self.date_field: yesterday})
+        """filter queryset with date_field in yesterday
+
+        it's filtered by a half-open range instead of casting date_field to date,
+        so an index on date_field can be used
+        """
+        start, end = self.get_range(get_yesterday_date())
+        return self.filter(
+            **{f"{self.date_field}__gte": start, f"{self.date_field}__lt": end}
+        )
 
 
 class IncomeQuerySet(ProcessableQuerySet, DateTimeQuerySet, QuerySet):
-    date_field = "created_at__date"
+    date_field = "created_at"
+
+    def get_range(self, date):
+        return get_datetime_range(date)
+
+    def claim_chunk(self, after_id, size):
+        """Lock next chunk of queryset ordered by id, after after_id
+
+        rows locked by other transactions are skipped, so several workers
+        can walk the same queryset concurrently, it must be evaluated inside a transaction
+        """
+        return (
+            self.select_for_update(skip_locked=True)
+            .filter(id__gt=after_id)
+            .order_by("id")[:size]
+        )
 
 
 class DailyIncomeQuerySet(DateTimeQuerySet, QuerySet):
     pass
+
+
+class DailyIncomeStripeQuerySet(DateTimeQuerySet, QuerySet):
+    pass
@@ -1,7 +1,12 @@
+import functools
 import logging
 
+from django.conf import settings
+from django.db import transaction
+
 from accounting.exceptions import IncomeIsGeneratedAsProcessed
 from accounting.models import DailyIncome
+from accounting.tasks import dispatch_daily_income_update
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +20,9 @@ def update_daily_income(sender, instance, created, **kwargs):
     if instance is created as processed or processed before this receiver
     IncomeIsGeneratedAsProcessed will be caught and logged(mailed to admin users)
     to be review by admin users.
-
+    if ACCOUNTING_DAILY_INCOME_ASYNC setting is enabled, daily income is updated
+    by a celery task after income is committed, so request transaction does not
+    wait for daily income lock.
 
     Args:
         sender (django.db.models.signals.post_save): post_save signal of database
@@ -23,6 +30,11 @@ def update_daily_income(sender, instance, created, **kwargs):
         created (bool): instance is created?
     """
     if created:
+        if settings.ACCOUNTING_DAILY_INCOME_ASYNC and not instance.is_processed():
+            transaction.on_commit(
+                functools.partial(dispatch_daily_income_update, instance.id)
+            )
+            return
         try:
             DailyIncome.objects.update_income(instance)
         except IncomeIsGeneratedAsProcessed:
@@ -1,6 +1,10 @@
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 
-from accounting.models import Courier, WeeklyIncome
+from accounting.models import Courier, DailyIncome, Income, WeeklyIncome
 
 
 class CourierSerializer(serializers.ModelSerializer):
@@ -9,9 +13,112 @@ class CourierSerializer(serializers.ModelSerializer):
         fields = ["id", "name"]
 
 
+class CourierBalanceSerializer(serializers.Serializer):
+    today = serializers.IntegerField(read_only=True)
+    week = serializers.IntegerField(read_only=True)
+
+
+class DailyIncomeTimelineSerializer(serializers.Serializer):
+    date = serializers.DateField(read_only=True)
+    amount = serializers.IntegerField(read_only=True)
+    status = serializers.ChoiceField(
+        choices=DailyIncome.Status.choices, allow_null=True, read_only=True
+    )
+
+
+class DailyIncomeTimelineQuerySerializer(serializers.Serializer):
+    to = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        max_days = settings.ACCOUNTING_DAILY_INCOME_TIMELINE_MAX_DAYS
+        to_date = attrs.get("to") or timezone.now().date()
+        from_date = attrs.get("from") or to_date - datetime.timedelta(
+            days=settings.ACCOUNTING_DAILY_INCOME_TIMELINE_DEFAULT_DAYS - 1
+        )
+        if from_date > to_date:
+            raise serializers.ValidationError("from must be before to")
+        if (to_date - from_date).days >= max_days:
+            raise serializers.ValidationError(
+                f"timeline can not be longer than {max_days} days"
+            )
+        return {"from_date": from_date, "to_date": to_date}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # from is a python keyword, so it can not be declared as class attribute
+        fields["from"] = serializers.DateField(required=False)
+        return fields
+
+
+class ReconciliationStatusSerializer(serializers.Serializer):
+    watermark = serializers.DateTimeField(allow_null=True, read_only=True)
+    lag = serializers.FloatField(allow_null=True, read_only=True)
+    mismatches = serializers.IntegerField(read_only=True)
+
+
 class WeeklyIncomeSerializer(serializers.ModelSerializer):
     courier = CourierSerializer(many=False, read_only=True)
 
     class Meta:
         model = WeeklyIncome
         fields = ["courier", "date", "amount"]
+
+
+WEEKLY_INCOME_VALUES = ["id", "courier_id", "courier__name", "date", "amount"]
+
+
+def serialize_weekly_income_values(rows):
+    """Serialize weekly incomes from values() rows
+
+    it is a read-only fast path of WeeklyIncomeSerializer with the same output,
+    model instances and serializer fields are not built for every row
+
+    Args:
+        rows (Iterable[Dict]): weekly incomes values of WEEKLY_INCOME_VALUES fields
+
+    Returns:
+        List[Dict]: serialized weekly incomes
+    """
+    return [
+        {
+            "courier": {"id": row["courier_id"], "name": row["courier__name"]},
+            "date": row["date"].isoformat(),
+            "amount": row["amount"],
+        }
+        for row in rows
+    ]
+
+
+class IncomeListSerializer(serializers.ListSerializer):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("allow_empty", False)
+        kwargs.setdefault("max_length", settings.ACCOUNTING_INCOME_BULK_MAX_SIZE)
+        super().__init__(*args, **kwargs)
+
+    def validate(self, attrs):
+        """Validate all couriers exist with one query instead of one query per income"""
+        courier_ids = {income["courier_id"] for income in attrs}
+        existing_ids = set(
+            Courier.objects.filter(id__in=courier_ids).values_list("id", flat=True)
+        )
+        missing_ids = sorted(courier_ids - existing_ids)
+        if missing_ids:
+            raise serializers.ValidationError(
+                f"Couriers do not exist: {', '.join(map(str, missing_ids))}"
+            )
+        return attrs
+
+    def create(self, validated_data):
+        return Income.objects.bulk_create_processed(
+            [Income(**attrs) for attrs in validated_data]
+        )
+
+
+class IncomeSerializer(serializers.ModelSerializer):
+    courier = serializers.IntegerField(source="courier_id")
+
+    class Meta:
+        model = Income
+        fields = ["id", "courier", "type", "amount", "status", "created_at"]
+        read_only_fields = ["id", "status", "created_at"]
+        list_serializer_class = IncomeListSerializer
@@ -1,25 +1,327 @@
+import datetime
 import logging
 
-from celery import shared_task
-from django.db import transaction
+import redis
+from celery import chord, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from celery_batches import Batches
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.db.models.functions import Mod
+from django.utils import timezone
+from kombu.exceptions import OperationalError
 
-from accounting.models import DailyIncome, Income, WeeklyIncome
-from miare.utils import get_five_minutes_ago, get_yesterday_date
+from accounting import accumulators, archives, counters, partitions
+from accounting.caches import bump_weekly_income_version
+from accounting.managers import is_striped
+from accounting.models import (
+    Checkpoint,
+    Courier,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    IncomeRollup,
+    RunningWeeklyIncome,
+    WeeklyIncome,
+    WeeklyIncomeProgress,
+)
+from config.routers import get_caught_up_db
+from miare.utils import (
+    get_five_minutes_ago,
+    get_month_start,
+    get_this_and_past_saturday,
+    get_week_start,
+    get_yesterday_date,
+)
 
 logger = logging.getLogger(__name__)
 
+RECONCILIATION_WATERMARK = "reconcile_incomes:watermark"
+RECONCILIATION_MISMATCHES = "reconcile_incomes:mismatches"
+RUNNING_WEEKLY_INCOME_BACKFILL = "running_weekly_income:backfill"
+
+
+def get_courier_id_ranges(size):
+    """Split courier ids into half-open ranges of size
+
+    ranges are aligned to multiples of size, so they are the same in every run
+
+    Returns:
+        List[Tuple[Int, Int]]: ranges of courier ids
+    """
+    bounds = Courier.objects.aggregate(Min("id"), Max("id"))
+    if bounds["id__min"] is None:
+        return []
+    start = bounds["id__min"] // size * size
+    return [
+        (courier_from, courier_from + size)
+        for courier_from in range(start, bounds["id__max"] + 1, size)
+    ]
+
 
 @shared_task
 def calculate_weekly_incomes():
     """Create weekly incomes
 
     This Task ran on every saturday morning and create all weekly incomes of courier
-    based on their last week daily incomes
+    based on their last week daily incomes, weekly report is aggregated and inserted
+    by the database, so its memory usage does not grow with number of couriers.
+    couriers are split into ranges of ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE ids and
+    each range is generated in its own transaction and recorded as completed,
+    so if task fails halfway or runs twice, only remaining ranges are generated.
+    If ACCOUNTING_RUNNING_WEEKLY_INCOME is enabled, weekly incomes are sealed
+    from running weekly incomes instead.
+    cached weekly income responses are invalidated after each range is committed.
+    if ACCOUNTING_DAILY_INCOME_STRIPES is more than one, daily income stripes of
+    each range are folded into daily incomes before generation.
+    """
+    if settings.ACCOUNTING_RUNNING_WEEKLY_INCOME:
+        seal_running_weekly_incomes()
+        return
+    Checkpoint.objects.reset(RUNNING_WEEKLY_INCOME_BACKFILL)
+    this_saturday, past_saturday = get_this_and_past_saturday()
+    completed_ranges = WeeklyIncomeProgress.objects.get_completed_ranges(past_saturday)
+    for courier_id_range in get_courier_id_ranges(
+        settings.ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE
+    ):
+        if courier_id_range[0] in completed_ranges:
+            continue
+        weekly_income_report = DailyIncome.objects.get_weekly_report(courier_id_range)
+        with transaction.atomic():
+            if is_striped():
+                DailyIncomeStripe.objects.fold(
+                    before=this_saturday,
+                    courier_id__gte=courier_id_range[0],
+                    courier_id__lt=courier_id_range[1],
+                )
+            WeeklyIncome.objects.insert_weekly_income(weekly_income_report)
+            DailyIncome.objects.update_last_week_daily_income_status(courier_id_range)
+            WeeklyIncomeProgress.objects.complete(past_saturday, courier_id_range)
+            transaction.on_commit(bump_weekly_income_version)
+
+
+def process_incomes_in_chunks(incomes, checkpoint_name):
+    """Process incomes in chunks of ACCOUNTING_FAILED_INCOME_CHUNK_SIZE
+
+    incomes are walked by id from the checkpoint position, each chunk is locked
+    with SKIP LOCKED and processed in its own transaction, then checkpoint is advanced,
+    so concurrent workers don't process the same income and a killed run resumes.
+    when the end is reached, checkpoint is reset to walk skipped incomes in the next run.
+
+    Args:
+        incomes (accounting.querysets.IncomeQuerySet): incomes to be processed
+        checkpoint_name (str): name of checkpoint to store progress
+
+    Returns:
+        int: number of processed incomes
+    """
+    processed = 0
+    last_id = Checkpoint.objects.get_position(checkpoint_name)
+    while True:
+        with transaction.atomic():
+            chunk = list(
+                incomes.claim_chunk(
+                    last_id, settings.ACCOUNTING_FAILED_INCOME_CHUNK_SIZE
+                )
+            )
+            processed += DailyIncome.objects.update_incomes(chunk)
+        if not chunk:
+            Checkpoint.objects.reset(checkpoint_name)
+            return processed
+        last_id = chunk[-1].id
+        Checkpoint.objects.advance(checkpoint_name, last_id)
+
+
+def seal_running_weekly_incomes():
+    """Create weekly incomes of past weeks from running weekly incomes
+
+    couriers are split into ranges like calculate_weekly_incomes, and in each range
+    running weekly incomes of past weeks are added to weekly incomes by one
+    INSERT ... SELECT statement, their daily incomes are set as PROCESSED and they
+    are deleted, in one transaction that is recorded as completed, so it's done in
+    O(active couriers) without summing daily incomes and a failed run is resumed.
+    days before the setting is enabled are added to running weekly incomes first,
+    by backfill_running_weekly_incomes.
+    """
+    backfill_running_weekly_incomes()
+    this_week_start = get_week_start(counters.get_today())
+    past_week_start = this_week_start - datetime.timedelta(days=7)
+    completed_ranges = WeeklyIncomeProgress.objects.get_completed_ranges(
+        past_week_start
+    )
+    for courier_id_range in get_courier_id_ranges(
+        settings.ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE
+    ):
+        if courier_id_range[0] in completed_ranges:
+            continue
+        courier_from, courier_to = courier_id_range
+        with transaction.atomic():
+            DailyIncomeStripe.objects.fold(
+                before=this_week_start,
+                courier_id__gte=courier_from,
+                courier_id__lt=courier_to,
+            )
+            WeeklyIncome.objects.add_weekly_report(
+                RunningWeeklyIncome.objects.get_weekly_report(
+                    this_week_start, courier_id_range
+                )
+            )
+            DailyIncome.objects.get_queryset().filter(
+                courier_id__gte=courier_from,
+                courier_id__lt=courier_to,
+                date__lt=this_week_start,
+                status=DailyIncome.Status.ACTIVE,
+            ).update(status=DailyIncome.Status.PROCESSED)
+            RunningWeeklyIncome.objects.get_range(courier_id_range).filter(
+                date__lt=this_week_start
+            ).delete()
+            WeeklyIncomeProgress.objects.complete(past_week_start, courier_id_range)
+            transaction.on_commit(bump_weekly_income_version)
+
+
+def backfill_running_weekly_incomes():
+    """Rebuild running weekly incomes from daily incomes once they are enabled
+
+    running weekly incomes are only maintained while ACCOUNTING_RUNNING_WEEKLY_INCOME
+    is enabled, so after it's enabled, running weekly incomes of each range of couriers
+    are rebuilt from their active daily incomes and checkpoint is advanced past it.
+    ranges before checkpoint are not rebuilt again, so it's done once and a failed
+    run is resumed. checkpoint is reset while the setting is disabled.
+
+    Returns:
+        int: number of rebuilt ranges
+    """
+    position = Checkpoint.objects.get_position(RUNNING_WEEKLY_INCOME_BACKFILL)
+    rebuilt = 0
+    for courier_id_range in get_courier_id_ranges(
+        settings.ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE
+    ):
+        if courier_id_range[1] <= position:
+            continue
+        RunningWeeklyIncome.objects.rebuild(courier_id_range)
+        Checkpoint.objects.advance(RUNNING_WEEKLY_INCOME_BACKFILL, courier_id_range[1])
+        rebuilt += 1
+    return rebuilt
+
+
+def get_failed_incomes():
+    """Return incomes before five minutes ago that are not processed yet"""
+    five_minutes_ago = get_five_minutes_ago()
+    return Income.objects.filter(
+        created_at__lte=five_minutes_ago, status=Income.Status.ACTIVE
+    )
+
+
+def dispatch_daily_income_update(income_id):
+    """Enqueue daily income update of an income
+
+    it's called after income is committed, if broker is not available
+    income remains active and it's processed by process_failed_income_update.
+    if ACCOUNTING_DAILY_INCOME_BATCHES is enabled, it's enqueued to batch task.
+    """
+    if settings.ACCOUNTING_DAILY_INCOME_BATCHES:
+        task = update_daily_incomes_batch
+    else:
+        task = update_daily_incomes
+    try:
+        task.delay([income_id])
+    except OperationalError:
+        logger.exception(f"Daily income update of income {income_id} is not enqueued")
+
+
+@shared_task
+def update_daily_incomes(income_ids):
+    """Update daily incomes of incomes asynchronously
+
+    pending incomes of couriers of income_ids are coalesced and applied in chunks,
+    so incomes that are enqueued but not processed yet are applied in the same batch,
+    and their own tasks find nothing to process. incomes locked by another worker
+    are skipped, it's processed by that worker.
+
+    Args:
+        income_ids (List[int]): ids of committed incomes
+
+    Returns:
+        int: number of processed incomes
+    """
+    courier_ids = list(
+        Income.objects.filter(id__in=income_ids, status=Income.Status.ACTIVE)
+        .values_list("courier_id", flat=True)
+        .distinct()
+    )
+    if not courier_ids:
+        return 0
+    incomes = Income.objects.get_queryset().filter(
+        courier_id__in=courier_ids, status=Income.Status.ACTIVE
+    )
+    processed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(
+                incomes.claim_chunk(
+                    last_id, settings.ACCOUNTING_FAILED_INCOME_CHUNK_SIZE
+                )
+            )
+            processed += DailyIncome.objects.update_incomes(chunk)
+        if not chunk:
+            return processed
+        last_id = chunk[-1].id
+
+
+@shared_task(
+    base=Batches,
+    flush_every=settings.ACCOUNTING_DAILY_INCOME_BATCH_SIZE,
+    flush_interval=settings.ACCOUNTING_DAILY_INCOME_BATCH_INTERVAL_MS / 1000,
+    acks_late=True,
+)
+def update_daily_incomes_batch(requests):
+    """Update daily incomes of a batch of messages
+
+    worker buffers messages and calls it every ACCOUNTING_DAILY_INCOME_BATCH_SIZE messages
+    or ACCOUNTING_DAILY_INCOME_BATCH_INTERVAL_MS milliseconds, incomes of all messages
+    are locked and applied to daily incomes in one transaction.
+    messages are acknowledged after it's returned, so after commit, and a redelivered
+    message is ignored because its incomes are processed.
+    worker prefetch (CELERY_WORKER_PREFETCH_MULTIPLIER times concurrency)
+    must be more than batch size, otherwise batches are flushed by interval.
+
+    Args:
+        requests (List[celery_batches.SimpleRequest]): requests with a list of
+            income ids as their argument
+
+    Returns:
+        int: number of processed incomes
     """
-    weekly_income_report = DailyIncome.objects.get_weekly_report()
+    income_ids = sorted(
+        {income_id for request in requests for income_id in request.args[0]}
+    )
     with transaction.atomic():
-        WeeklyIncome.objects.create_weekly_income(weekly_income_report)
-        DailyIncome.objects.update_last_week_daily_income_status()
+        incomes = list(
+            Income.objects.select_for_update()
+            .filter(id__in=income_ids, status=Income.Status.ACTIVE)
+            .order_by("id")
+        )
+        return DailyIncome.objects.update_incomes(incomes)
+
+
+@shared_task
+def flush_daily_income_deltas():
+    """Flush daily income deltas accumulated in redis
+
+    it runs every few seconds if ACCOUNTING_DAILY_INCOME_WRITE_BEHIND is enabled
+
+    Returns:
+        int: number of processed incomes, or None if redis is not available
+    """
+    if not settings.ACCOUNTING_DAILY_INCOME_WRITE_BEHIND:
+        return None
+    try:
+        return accumulators.flush()
+    except redis.RedisError:
+        logger.exception("Daily income deltas are not flushed")
+        return None
 
 
 @shared_task
@@ -27,28 +329,340 @@ def process_failed_income_update():
     """Process daily incomes with active status
 
     This task will fetch daily incomes before five minutes ago that are not processed by signal
-    or their process failed, It's a retry to update daily income and make income as processed
+    or their process failed, It's a retry to update daily income and make income as processed.
+    incomes are processed in chunks and progress is stored in a checkpoint,
+    so if task time limit is exceeded, next run resumes from there.
+    If ACCOUNTING_FAILED_INCOME_SHARDS is more than one, incomes are split by courier
+    into shards and one task is dispatched for each shard, in a chord.
+    In write behind mode, accumulated incomes are flushed first, so they are not taken
+    as failed, and if they are processed here, flush does not apply them again.
     """
-    five_minutes_ago = get_five_minutes_ago()
-    incomes = Income.objects.filter(
-        created_at__lte=five_minutes_ago, status=Income.Status.ACTIVE
+    flush_daily_income_deltas()
+    shards = settings.ACCOUNTING_FAILED_INCOME_SHARDS
+    if shards > 1:
+        chord(
+            process_failed_income_update_shard.s(shard, shards)
+            for shard in range(shards)
+        )(report_failed_income_update.s())
+        return None
+    try:
+        return process_incomes_in_chunks(
+            get_failed_incomes(), "process_failed_income_update"
+        )
+    except SoftTimeLimitExceeded:
+        logger.warning("Failed income update time limit exceeded, it will be resumed")
+
+
+@shared_task
+def process_failed_income_update_shard(shard, shards):
+    """Process daily incomes with active status of one courier shard
+
+    couriers are split into shards by courier_id modulo shards,
+    so each shard updates daily incomes of its own couriers
+    and does not contend with other shards.
+
+    Args:
+        shard (int): shard number, from 0 to shards - 1
+        shards (int): number of shards
+
+    Returns:
+        dict: shard number and number of processed incomes
+    """
+    incomes = (
+        get_failed_incomes()
+        .annotate(courier_shard=Mod("courier_id", shards))
+        .filter(courier_shard=shard)
     )
-    for income in incomes:
-        DailyIncome.objects.update_income(income)
+    processed = 0
+    try:
+        processed = process_incomes_in_chunks(
+            incomes, f"process_failed_income_update:{shard}/{shards}"
+        )
+    except SoftTimeLimitExceeded:
+        logger.warning(
+            f"Failed income update of shard {shard}/{shards} time limit exceeded, "
+            "it will be resumed"
+        )
+    return {"shard": shard, "processed": processed}
+
+
+@shared_task
+def report_failed_income_update(results):
+    """Report processed incomes of each shard
+
+    Args:
+        results (List[dict]): results of process_failed_income_update_shard tasks
+
+    Returns:
+        dict: number of processed incomes of each shard and their total
+    """
+    report = {
+        "shards": {result["shard"]: result["processed"] for result in results},
+        "total": sum(result["processed"] for result in results),
+    }
+    logger.info(f"Failed income update is finished: {report}")
+    return report
+
+
+@shared_task
+def build_income_rollups(months=1):
+    """Build monthly and yearly income rollups
+
+    This task runs every day and rebuilds monthly rollups of last months before
+    current month, so late changes of their daily incomes are included,
+    and yearly rollups of years that they are in, if the year is finished
+    and monthly rollups of all its months are built.
+
+    Args:
+        months (int): number of past months to rebuild, e.g. to build rollups of history
+    """
+    today = counters.get_today()
+    DailyIncomeStripe.objects.fold(before=today)
+    month = get_month_start(today)
+    years = set()
+    for _ in range(months):
+        month = get_month_start(month - datetime.timedelta(days=1))
+        IncomeRollup.objects.rebuild_month(month)
+        years.add(month.year)
+    for year in sorted(years):
+        if year < today.year:
+            IncomeRollup.objects.rebuild_year(year)
+
+
+@shared_task
+def fold_daily_income_stripes():
+    """Fold daily income stripes into daily incomes
+
+    stripes of past dates are folded, if ACCOUNTING_DAILY_INCOME_STRIPES is more than one,
+    otherwise all stripes are folded, e.g. stripes that are left after striping is disabled
+
+    Returns:
+        int: number of folded stripes
+    """
+    before = counters.get_today() if is_striped() else None
+    return DailyIncomeStripe.objects.fold(before=before)
 
 
 @shared_task
-def check_daily_balance():
+def check_daily_balance(using=None):
     """Check daily balance with income records
 
     This task check yesterday daily income and income balance to be equal
     in midnight, if they were not equal, something went wrong and must be reviewed
     and a log sent to admin email.
+    In write behind mode, accumulated incomes are flushed first.
+    Unbalanced couriers are found by DailyIncome.objects.get_discrepancies and logged,
+    and if ACCOUNTING_DAILY_BALANCE_REPAIR is enabled, their daily incomes are repaired.
+
+    If ACCOUNTING_INCREMENTAL_RECONCILIATION is enabled, incomes are reconciled
+    by reconcile_incomes task, so it only checks that its watermark passed midnight.
+
+    Args:
+        using (str, optional): database that balances are read from, e.g. replica,
+            ACCOUNTING_REPORTS_DATABASE by default. default database is read instead
+            if it has not replayed the flush yet, so a lagging replica is not reported
+
+    Returns:
+        int: number of unbalanced couriers
     """
-    yesterday_income = Income.objects.get_yesterday_incomes_amount()
-    yesterday_daily_income = DailyIncome.objects.get_yesterday_daily_incomes_amount()
+    if settings.ACCOUNTING_INCREMENTAL_RECONCILIATION:
+        check_reconciliation_watermark()
+        return 0
+    flush_daily_income_deltas()
+    using = get_caught_up_db(
+        using or settings.ACCOUNTING_REPORTS_DATABASE, timezone.now()
+    )
+    yesterday = get_yesterday_date()
+    yesterday_income = Income.objects.db_manager(using).get_yesterday_incomes_amount()
+    yesterday_daily_income = DailyIncome.objects.db_manager(
+        using
+    ).get_yesterday_daily_incomes_amount()
     if yesterday_daily_income != yesterday_income:
         logger.critical(
-            f"""Unbalanced income in {get_yesterday_date()}
+            f"""Unbalanced income in {yesterday}
             daily_income{yesterday_daily_income}, income:{yesterday_income}"""
         )
+    discrepancies = DailyIncome.objects.db_manager(using).get_discrepancies(yesterday)
+    if discrepancies:
+        log_discrepancies(yesterday, discrepancies)
+    return len(discrepancies)
+
+
+def log_discrepancies(date, discrepancies):
+    """log unbalanced couriers, and repair them if ACCOUNTING_DAILY_BALANCE_REPAIR is enabled
+
+    discrepancies may be read from another database, e.g. a replica that lags behind,
+    they are recomputed on default database by repair_discrepancies after locking
+    """
+    logger.critical(
+        f"{len(discrepancies)} couriers are unbalanced in {date}, "
+        f"(courier, income, daily income): {discrepancies[:100]}"
+    )
+    if settings.ACCOUNTING_DAILY_BALANCE_REPAIR:
+        repaired = DailyIncome.objects.repair_discrepancies(date, discrepancies)
+        logger.warning(f"{len(repaired)} unbalanced couriers in {date} are repaired")
+
+
+def get_reconciliation_status():
+    """Return watermark of reconciled incomes, its lag and mismatches of the last run"""
+    watermark = Checkpoint.objects.get_watermark(RECONCILIATION_WATERMARK)
+    lag = (timezone.now() - watermark).total_seconds() if watermark else None
+    return {
+        "watermark": watermark,
+        "lag": lag,
+        "mismatches": Checkpoint.objects.get_position(RECONCILIATION_MISMATCHES),
+    }
+
+
+def check_reconciliation_watermark():
+    """Check all UTC days before today are reconciled by reconcile_incomes"""
+    status = get_reconciliation_status()
+    midnight = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if status["watermark"] is None or status["watermark"] < midnight:
+        logger.critical(
+            f"Incomes are not reconciled until {midnight}, "
+            f"watermark: {status['watermark']}, lag: {status['lag']} seconds"
+        )
+
+
+@shared_task
+def reconcile_incomes(using=None):
+    """Reconcile daily incomes of couriers with new incomes
+
+    incomes are walked in windows of ACCOUNTING_RECONCILIATION_WINDOW seconds from
+    the watermark, until ACCOUNTING_RECONCILIATION_DELAY seconds ago, so incomes
+    are processed or retried before they are reconciled. in each window only
+    couriers that have an income in that window are checked, against all their
+    incomes of that date, then watermark is advanced.
+    windows are split at UTC midnight, as daily incomes are dated.
+
+    watermark checkpoint is locked during the run, so overlapping runs skip
+    instead of checking and repairing the same windows twice.
+    number of distinct unbalanced courier dates found by the run is stored
+    as a gauge, that is reported by get_reconciliation_status.
+
+    Args:
+        using (str, optional): database that incomes are read from, e.g. replica,
+            ACCOUNTING_REPORTS_DATABASE by default. default database is read instead
+            if it has not replayed the flush yet, so watermark does not pass
+            incomes that are not replicated
+
+    Returns:
+        int: number of unbalanced courier dates
+    """
+    if not settings.ACCOUNTING_INCREMENTAL_RECONCILIATION:
+        return 0
+    flush_daily_income_deltas()
+    using = get_caught_up_db(
+        using or settings.ACCOUNTING_REPORTS_DATABASE, timezone.now()
+    )
+    with transaction.atomic():
+        if not Checkpoint.objects.lock(RECONCILIATION_WATERMARK):
+            logger.info("Incomes are being reconciled by another worker")
+            return 0
+        end = timezone.now() - datetime.timedelta(
+            seconds=settings.ACCOUNTING_RECONCILIATION_DELAY
+        )
+        window = datetime.timedelta(seconds=settings.ACCOUNTING_RECONCILIATION_WINDOW)
+        watermark = Checkpoint.objects.get_watermark(RECONCILIATION_WATERMARK)
+        if watermark is None:
+            watermark = end.replace(hour=0, minute=0, second=0, microsecond=0)
+        if watermark >= end:
+            return 0
+        mismatches: set = set()
+        while watermark < end:
+            date = watermark.date()
+            next_midnight = datetime.datetime.combine(
+                date + datetime.timedelta(days=1),
+                datetime.time.min,
+                datetime.timezone.utc,
+            )
+            window_end = min(watermark + window, next_midnight, end)
+            courier_ids = (
+                Income.objects.using(using)
+                .filter(created_at__gte=watermark, created_at__lt=window_end)
+                .values("courier_id")
+            )
+            discrepancies = DailyIncome.objects.db_manager(using).get_discrepancies(
+                date, courier_ids
+            )
+            if discrepancies:
+                log_discrepancies(date, discrepancies)
+                mismatches.update(
+                    (courier_id, date) for courier_id, *_ in discrepancies
+                )
+            Checkpoint.objects.advance_watermark(RECONCILIATION_WATERMARK, window_end)
+            watermark = window_end
+        Checkpoint.objects.set_position(RECONCILIATION_MISMATCHES, len(mismatches))
+    return len(mismatches)
+
+
+@shared_task
+def reconcile_balance_counters():
+    """Reconcile courier balance counters with daily incomes
+
+    counters can drift if redis is not available when they are incremented,
+    so this week counters of couriers are overwritten by their daily incomes
+    """
+    if not settings.ACCOUNTING_BALANCE_COUNTERS:
+        return
+    reconciled = counters.reconcile()
+    logger.info(f"balance counters of {reconciled} couriers are reconciled")
+
+
+@shared_task
+def maintain_income_partitions():
+    """Create next months Income partitions and detach old ones
+
+    partitions of ACCOUNTING_INCOME_PARTITIONS_AHEAD months after current month
+    are created, so incomes always have a partition, and partitions older than
+    ACCOUNTING_INCOME_RETENTION_MONTHS are detached to ACCOUNTING_INCOME_ARCHIVE_SCHEMA,
+    unless they have active incomes or, if ACCOUNTING_INCOME_ARCHIVE_MONTHS is enabled,
+    they are not archived yet. it does nothing if Income table is not partitioned.
+
+    Returns:
+        Tuple[List[str], List[str]]: created and detached partitions
+    """
+    created, detached = partitions.maintain_partitions(
+        connection,
+        today=datetime.date.today(),
+        ahead=settings.ACCOUNTING_INCOME_PARTITIONS_AHEAD,
+        retention=settings.ACCOUNTING_INCOME_RETENTION_MONTHS,
+        schema=settings.ACCOUNTING_INCOME_ARCHIVE_SCHEMA,
+        archived_months=(
+            archives.get_archived_months()
+            if settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS
+            else None
+        ),
+    )
+    if detached:
+        logger.warning(f"Income partitions {detached} are detached")
+    return created, detached
+
+
+@shared_task(
+    soft_time_limit=settings.ACCOUNTING_INCOME_ARCHIVE_SOFT_TIME_LIMIT,
+    time_limit=settings.ACCOUNTING_INCOME_ARCHIVE_TIME_LIMIT,
+)
+def archive_incomes():
+    """Archive processed incomes of months older than ACCOUNTING_INCOME_ARCHIVE_MONTHS
+
+    incomes are written to archive files, verified with daily and weekly incomes
+    and deleted from Income table, see accounting.archives.
+    it does nothing if ACCOUNTING_INCOME_ARCHIVE_MONTHS is 0.
+    if time limit is exceeded, incomplete archive file is removed and next run
+    resumes from the first month that is not archived or its deletion is not finished.
+
+    Returns:
+        int: number of archived incomes, or None if time limit is exceeded
+    """
+    if not settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS:
+        return 0
+    before = get_month_start(datetime.date.today())
+    for _ in range(settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS):
+        before = get_month_start(before - datetime.timedelta(days=1))
+    try:
+        return archives.archive_incomes(before)
+    except SoftTimeLimitExceeded:
+        logger.warning("Income archive time limit exceeded, it will be resumed")
+        return None
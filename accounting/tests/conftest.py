@@ -0,0 +1,40 @@
+import pytest
+import redis
+from django.db.models.signals import post_save
+
+from accounting import accumulators, counters
+from accounting.models import Income
+from accounting.receivers import update_daily_income
+
+
+@pytest.fixture
+def disconnect_update_daily_income_receiver():
+    post_save.disconnect(update_daily_income, sender=Income)
+    yield None
+    post_save.connect(update_daily_income, sender=Income)
+
+
+@pytest.fixture
+def balance_counters(settings):
+    """enable balance counters on a clean redis database, skip if redis is not available"""
+    settings.ACCOUNTING_BALANCE_COUNTERS = True
+    client = counters.get_client(settings.ACCOUNTING_BALANCE_REDIS_URL)
+    try:
+        client.flushdb()
+    except redis.RedisError:
+        pytest.skip("redis is not available")
+    yield client
+    client.flushdb()
+
+
+@pytest.fixture
+def write_behind(settings):
+    """enable write behind daily income on a clean redis database, skip if redis is not available"""
+    settings.ACCOUNTING_DAILY_INCOME_WRITE_BEHIND = True
+    client = accumulators.get_redis()
+    try:
+        client.flushdb()
+    except redis.RedisError:
+        pytest.skip("redis is not available")
+    yield client
+    client.flushdb()
@@ -2,10 +2,36 @@ import datetime
 import random
 
 import pytest
+from django.db import connection
+from django.db.models import Q, Sum
 from model_bakery import baker
 
-from accounting.models import Courier, DailyIncome, Income
-from miare.utils import get_yesterday_date
+from accounting.exceptions import IncomeIsGeneratedAsProcessed
+from accounting.models import (
+    Checkpoint,
+    Courier,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    IncomeRollup,
+    RunningWeeklyIncome,
+)
+from accounting.partitions import (
+    create_partition,
+    get_month_bound,
+    get_partition_months,
+    get_partition_name,
+    maintain_partitions,
+)
+from accounting.tasks import build_income_rollups, maintain_income_partitions
+from miare.utils import (
+    get_five_minutes_ago,
+    get_month_start,
+    get_next_month_start,
+    get_week_start,
+    get_yesterday_date,
+    split_date_range,
+)
 
 
 @pytest.mark.django_db
@@ -78,6 +104,339 @@ class TestDailyIncome:
         income_sum = sum(map(lambda i: i.get_signed_amount(), incomes))
         assert DailyIncome.objects.get(courier=courier, date=date).amount == income_sum
 
+    def test_bulk_created_incomes_match_one_by_one_created_incomes(self):
+        couriers = baker.make(Courier, _quantity=2)
+        daily_incomes = {}
+        for courier in couriers:
+            incomes = baker.prepare(
+                Income, courier=courier, status=Income.Status.ACTIVE, _quantity=10
+            )
+            for income in incomes[:5]:
+                income.save()
+            Income.objects.bulk_create_processed(incomes[5:])
+            daily_incomes[courier.id] = sum(
+                map(lambda i: i.get_signed_amount(), incomes)
+            )
+
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        for courier in couriers:
+            assert (
+                DailyIncome.objects.get(
+                    courier=courier, date=datetime.date.today()
+                ).amount
+                == daily_incomes[courier.id]
+            )
+
+
+@pytest.mark.django_db
+class TestDailyIncomeUpdateIncomes:
+    def test_many_incomes_are_applied_in_a_handful_of_queries(
+        self, django_assert_max_num_queries, disconnect_update_daily_income_receiver
+    ):
+        couriers = baker.make(Courier, _quantity=5)
+        incomes = [
+            baker.make(
+                Income, courier=random.choice(couriers), status=Income.Status.ACTIVE
+            )
+            for _ in range(100)
+        ]
+        with django_assert_max_num_queries(6):
+            assert DailyIncome.objects.update_incomes(incomes) == len(incomes)
+
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        for courier in couriers:
+            income_sum = sum(
+                income.get_signed_amount()
+                for income in incomes
+                if income.courier_id == courier.id
+            )
+            daily_income = DailyIncome.objects.filter(courier=courier).first()
+            assert (daily_income.amount if daily_income else 0) == income_sum
+
+    def test_processed_incomes_are_ignored(
+        self, disconnect_update_daily_income_receiver
+    ):
+        courier = baker.make(Courier)
+        active_income = baker.make(Income, courier=courier, status=Income.Status.ACTIVE)
+        processed_income = baker.make(
+            Income, courier=courier, status=Income.Status.PROCESSED
+        )
+        assert (
+            DailyIncome.objects.update_incomes([active_income, processed_income]) == 1
+        )
+        assert (
+            DailyIncome.objects.get(courier=courier).amount
+            == active_income.get_signed_amount()
+        )
+
+
+@pytest.fixture
+def upsert_daily_income(settings):
+    settings.ACCOUNTING_DAILY_INCOME_UPSERT = True
+
+
+@pytest.mark.django_db
+class TestDailyIncomeUpsert:
+    def test_daily_is_sum_of_day_incomes(self, upsert_daily_income):
+        courier = baker.make(Courier)
+        incomes = baker.make(
+            Income, courier=courier, status=Income.Status.ACTIVE, _quantity=10
+        )
+        income_amount = sum(map(lambda i: i.get_signed_amount(), incomes))
+
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        assert (
+            DailyIncome.objects.get(courier=courier, date=datetime.date.today()).amount
+            == income_amount
+        )
+
+    def test_negative_daily_income(self, upsert_daily_income):
+        courier = baker.make(Courier)
+        incomes = baker.make(
+            Income,
+            courier=courier,
+            status=Income.Status.ACTIVE,
+            type=Income.Type.PUNISHMENT,
+            _quantity=10,
+        )
+        income_sum = sum(map(lambda i: i.get_signed_amount(), incomes))
+        assert (
+            DailyIncome.objects.get(courier=courier, date=datetime.date.today()).amount
+            == income_sum
+        )
+
+    def test_income_is_not_upserted_twice(self, upsert_daily_income):
+        income = baker.make(Income, status=Income.Status.ACTIVE)
+        stale_income = Income.objects.get(pk=income.pk)
+        stale_income.status = Income.Status.ACTIVE
+        with pytest.raises(IncomeIsGeneratedAsProcessed):
+            DailyIncome.objects.upsert_income(stale_income)
+        assert (
+            DailyIncome.objects.get(courier=income.courier).amount
+            == income.get_signed_amount()
+        )
+
+
+@pytest.fixture
+def running_weekly_income(settings):
+    settings.ACCOUNTING_RUNNING_WEEKLY_INCOME = True
+
+
+@pytest.mark.django_db
+class TestRunningWeeklyIncome:
+    def test_week_starts_on_saturday(self):
+        saturday = datetime.date(2022, 12, 3)
+        for days in range(7):
+            assert get_week_start(saturday + datetime.timedelta(days)) == saturday
+        assert get_week_start(saturday - datetime.timedelta(1)) == datetime.date(
+            2022, 11, 26
+        )
+
+    @pytest.mark.parametrize("upsert", [False, True])
+    def test_running_weekly_income_is_updated_with_daily_income(
+        self, settings, running_weekly_income, upsert
+    ):
+        settings.ACCOUNTING_DAILY_INCOME_UPSERT = upsert
+        courier = baker.make(Courier)
+        incomes = baker.make(
+            Income, courier=courier, status=Income.Status.ACTIVE, _quantity=5
+        )
+        incomes += Income.objects.bulk_create_processed(
+            baker.prepare(Income, courier=courier, _quantity=5)
+        )
+        assert RunningWeeklyIncome.objects.get_current_week_amount(courier.id) == sum(
+            map(lambda i: i.get_signed_amount(), incomes)
+        )
+
+    def test_running_weekly_income_is_not_updated_when_disabled(self):
+        courier = baker.make(Courier)
+        baker.make(Income, courier=courier, status=Income.Status.ACTIVE)
+        assert not RunningWeeklyIncome.objects.exists()
+        assert RunningWeeklyIncome.objects.get_current_week_amount(courier.id) == 0
+
+
+@pytest.mark.django_db
+class TestDailyIncomeStripe:
+    @pytest.fixture
+    def stripes(self, settings):
+        settings.ACCOUNTING_DAILY_INCOME_STRIPES = 4
+        return settings.ACCOUNTING_DAILY_INCOME_STRIPES
+
+    def test_incomes_are_added_to_stripes(self, stripes):
+        courier = baker.make(Courier)
+        incomes = baker.make(
+            Income, courier=courier, status=Income.Status.ACTIVE, _quantity=10
+        )
+        assert not DailyIncome.objects.exists()
+        assert DailyIncomeStripe.objects.count() == stripes
+        for stripe in DailyIncomeStripe.objects.all():
+            assert stripe.amount == sum(
+                income.get_signed_amount()
+                for income in incomes
+                if income.id % stripes == stripe.stripe
+            )
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+
+    def test_stripes_are_summed_on_read(self, stripes):
+        yesterday = get_yesterday_date()
+        courier = baker.make(Courier)
+        baker.make(
+            DailyIncome,
+            courier=courier,
+            date=yesterday,
+            amount=100,
+            status=DailyIncome.Status.ACTIVE,
+        )
+        for stripe in range(stripes):
+            baker.make(
+                DailyIncomeStripe,
+                courier=courier,
+                date=yesterday,
+                stripe=stripe,
+                amount=10,
+            )
+        assert DailyIncome.objects.get_yesterday_daily_incomes_amount() == 140
+        timeline = DailyIncome.objects.get_courier_timeline(
+            courier.id, yesterday, yesterday
+        )
+        assert timeline == [
+            {"date": yesterday, "amount": 140, "status": DailyIncome.Status.ACTIVE}
+        ]
+
+    def test_stripes_are_folded(self, stripes):
+        courier = baker.make(Courier)
+        today = datetime.date.today()
+        for date in [today - datetime.timedelta(1), today]:
+            for stripe in range(stripes):
+                baker.make(
+                    DailyIncomeStripe,
+                    courier=courier,
+                    date=date,
+                    stripe=stripe,
+                    amount=10,
+                )
+        assert DailyIncomeStripe.objects.fold(before=today) == stripes
+        assert DailyIncome.objects.get().amount == 10 * stripes
+        assert set(DailyIncomeStripe.objects.values_list("date", flat=True)) == {today}
+
+
+@pytest.fixture
+def daily_income_history():
+    couriers = baker.make(Courier, _quantity=2)
+    first_date = datetime.date(2023, 1, 1)
+    days = (datetime.date.today() - first_date).days
+    DailyIncome.objects.bulk_create(
+        [
+            DailyIncome(
+                courier=courier,
+                date=first_date + datetime.timedelta(day),
+                amount=random.randint(-100, 1000),
+                status=DailyIncome.Status.ACTIVE,
+            )
+            for courier in couriers
+            for day in range(days)
+        ]
+    )
+    months = (datetime.date.today().year - first_date.year) * 12
+    months += datetime.date.today().month - first_date.month
+    build_income_rollups(months=months)
+    return couriers
+
+
+@pytest.mark.django_db
+class TestIncomeRollup:
+    def test_split_date_range_into_fewest_buckets(self):
+        days, months, years = split_date_range(
+            datetime.date(2021, 11, 20),
+            datetime.date(2023, 3, 10),
+            closed_before=datetime.date(2023, 3, 1),
+        )
+        assert days == [
+            (datetime.date(2021, 11, 20), datetime.date(2021, 12, 1)),
+            (datetime.date(2023, 3, 1), datetime.date(2023, 3, 10)),
+        ]
+        assert months == [
+            datetime.date(2021, 12, 1),
+            datetime.date(2023, 1, 1),
+            datetime.date(2023, 2, 1),
+        ]
+        assert years == [datetime.date(2022, 1, 1)]
+
+    def test_total_is_summation_of_daily_incomes(
+        self, daily_income_history, django_assert_max_num_queries
+    ):
+        for courier in daily_income_history:
+            for start, end in [
+                (datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)),
+                (datetime.date(2023, 2, 14), datetime.date(2024, 5, 3)),
+                (datetime.date(2023, 6, 1), datetime.date.today()),
+                (datetime.date(2023, 6, 10), datetime.date(2023, 6, 10)),
+            ]:
+                expected = DailyIncome.objects.filter(
+                    courier=courier, date__gte=start, date__lte=end
+                ).aggregate(Sum("amount"))["amount__sum"]
+                with django_assert_max_num_queries(3):
+                    assert IncomeRollup.objects.total(courier, start, end) == expected
+
+    def test_months_without_rollups_are_read_from_daily_incomes(
+        self, daily_income_history
+    ):
+        courier = daily_income_history[0]
+        last_month = get_month_start(
+            get_month_start(datetime.date.today()) - datetime.timedelta(days=1)
+        )
+        IncomeRollup.objects.filter(
+            Q(period=IncomeRollup.Period.YEAR, date=datetime.date(2023, 1, 1))
+            | Q(period=IncomeRollup.Period.MONTH, date=last_month)
+        ).delete()
+        Checkpoint.objects.filter(
+            name__in=[
+                IncomeRollup.objects.get_checkpoint_name(
+                    IncomeRollup.Period.YEAR, datetime.date(2023, 1, 1)
+                ),
+                IncomeRollup.objects.get_checkpoint_name(
+                    IncomeRollup.Period.MONTH, last_month
+                ),
+            ]
+        ).delete()
+        start = datetime.date(2023, 1, 1)
+        expected = DailyIncome.objects.filter(
+            courier=courier, date__gte=start
+        ).aggregate(Sum("amount"))["amount__sum"]
+        assert IncomeRollup.objects.total(courier, start, datetime.date.today()) == (
+            expected
+        )
+
+    def test_yearly_rollups_are_built_for_finished_years(self, daily_income_history):
+        assert IncomeRollup.objects.filter(
+            period=IncomeRollup.Period.YEAR, date=datetime.date(2023, 1, 1)
+        ).count() == len(daily_income_history)
+        assert not IncomeRollup.objects.filter(
+            period=IncomeRollup.Period.YEAR, date__year=datetime.date.today().year
+        ).exists()
+
+    def test_yearly_rollups_are_not_built_from_some_months(self, daily_income_history):
+        courier = daily_income_history[0]
+        year = datetime.date(2023, 1, 1)
+        IncomeRollup.objects.rebuild_month(datetime.date(2023, 12, 1))
+        IncomeRollup.objects.filter(
+            period=IncomeRollup.Period.MONTH, date=datetime.date(2023, 6, 1)
+        ).delete()
+        Checkpoint.objects.filter(
+            name=IncomeRollup.objects.get_checkpoint_name(
+                IncomeRollup.Period.MONTH, datetime.date(2023, 6, 1)
+            )
+        ).delete()
+        assert IncomeRollup.objects.rebuild_year(2023) == 0
+        assert not IncomeRollup.objects.filter(
+            period=IncomeRollup.Period.YEAR, date=year
+        ).exists()
+        expected = DailyIncome.objects.filter(
+            courier=courier, date__year=2023
+        ).aggregate(Sum("amount"))["amount__sum"]
+        total = IncomeRollup.objects.total(courier, year, datetime.date(2023, 12, 31))
+        assert total == expected
+
 
 @pytest.mark.django_db
 class TestIncome:
@@ -92,3 +451,139 @@ class TestIncome:
         assert Income.objects.get_yesterday_incomes_amount() == sum(
             map(lambda income: income.get_signed_amount(), incomes)
         )
+
+    def test_yesterday_is_half_open_datetime_range(self):
+        incomes = baker.make(Income, status=Income.Status.ACTIVE, _quantity=3)
+        yesterday = get_yesterday_date()
+        today = yesterday + datetime.timedelta(days=1)
+        for income, created_at in zip(
+            incomes,
+            [
+                datetime.datetime.combine(yesterday, datetime.time.min),
+                datetime.datetime.combine(yesterday, datetime.time.max),
+                datetime.datetime.combine(today, datetime.time.min),
+            ],
+        ):
+            income.created_at = created_at
+            income.save()
+        assert set(
+            Income.objects.get_queryset().yesterday().values_list("id", flat=True)
+        ) == {incomes[0].id, incomes[1].id}
+
+
+@pytest.mark.django_db
+class TestIncomeIndexes:
+    def test_failed_incomes_use_active_created_at_index(self):
+        plan = Income.objects.filter(
+            status=Income.Status.ACTIVE, created_at__lte=get_five_minutes_ago()
+        ).explain()
+        assert "income_active_created_at_idx" in plan
+
+    def test_yesterday_incomes_use_created_at_index(self):
+        plan = Income.objects.get_queryset().yesterday().processed().explain()
+        assert "income_created_at_idx" in plan
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="planner statistics of millions of rows are only meaningful on PostgreSQL",
+    )
+    def test_indexes_are_scanned_on_millions_of_rows(self):
+        courier = baker.make(Courier)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO accounting_income
+                    (created_at, updated_at, status, type, amount, courier_id)
+                SELECT now() - i * interval '1 second', now(),
+                    CASE WHEN i % 1000 = 0 THEN 0 ELSE 1 END, 0, 1, %s
+                FROM generate_series(1, 2000000) AS i
+                """,
+                [courier.id],
+            )
+            cursor.execute("ANALYZE accounting_income")
+        failed_plan = Income.objects.filter(
+            status=Income.Status.ACTIVE, created_at__lte=get_five_minutes_ago()
+        ).explain()
+        yesterday_plan = Income.objects.get_queryset().yesterday().explain()
+        assert "income_active_created_at_idx" in failed_plan
+        assert "Seq Scan" not in failed_plan
+        assert "income_created_at_idx" in yesterday_plan
+        assert "Seq Scan" not in yesterday_plan
+
+
+@pytest.mark.django_db
+class TestIncomePartitions:
+    @pytest.mark.skipif(
+        connection.vendor == "postgresql", reason="Income is partitioned on PostgreSQL"
+    )
+    def test_maintenance_does_nothing_without_partitions(self):
+        assert maintain_income_partitions() == ([], [])
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="Income is only partitioned on PostgreSQL",
+    )
+    def test_date_bounded_queries_are_pruned(self):
+        yesterday = get_yesterday_date()
+        next_month = get_next_month_start(datetime.date.today())
+        plan = Income.objects.get_queryset().yesterday().processed().explain()
+        assert get_partition_name(get_month_start(yesterday)) in plan
+        assert get_partition_name(next_month) not in plan
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="Income is only partitioned on PostgreSQL",
+    )
+    def test_partitions_are_created_ahead_and_detached_after_retention(self):
+        today = datetime.date.today()
+        old_month = get_month_start(today - datetime.timedelta(days=100))
+        create_partition(connection, old_month)
+        months = get_partition_months(connection)
+        next_month = get_next_month_start(months[-1])
+        created, detached = maintain_partitions(
+            connection, today=today, ahead=len(months), retention=1, schema="archive"
+        )
+        assert get_partition_name(next_month) in created
+        assert get_partition_name(old_month) in detached
+        assert old_month not in get_partition_months(connection)
+        income = baker.make(Income, courier=baker.make(Courier), amount=1)
+        assert Income.objects.filter(id=income.id).exists()
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="Income is only partitioned on PostgreSQL",
+    )
+    def test_partitions_with_active_incomes_are_not_detached(self):
+        today = datetime.date.today()
+        old_month = get_month_start(today - datetime.timedelta(days=100))
+        create_partition(connection, old_month)
+        income = baker.make(
+            Income, courier=baker.make(Courier), status=Income.Status.ACTIVE
+        )
+        Income.objects.filter(id=income.id).update(
+            created_at=get_month_bound(old_month)
+        )
+        _, detached = maintain_partitions(
+            connection, today=today, ahead=0, retention=1, schema="archive"
+        )
+        assert get_partition_name(old_month) not in detached
+        assert old_month in get_partition_months(connection)
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="Income is only partitioned on PostgreSQL",
+    )
+    def test_partitions_that_are_not_archived_are_not_detached(self):
+        today = datetime.date.today()
+        old_month = get_month_start(today - datetime.timedelta(days=100))
+        create_partition(connection, old_month)
+        _, detached = maintain_partitions(
+            connection,
+            today=today,
+            ahead=0,
+            retention=1,
+            schema="archive",
+            archived_months=[],
+        )
+        assert get_partition_name(old_month) not in detached
+        assert old_month in get_partition_months(connection)
@@ -1,18 +1,46 @@
 import datetime
+from types import SimpleNamespace
 
 import pytest
+from celery.exceptions import SoftTimeLimitExceeded
+from django.db import connections
 from django.db.models import Sum
 from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from model_bakery import baker
 
-from accounting.models import DailyIncome, Income, WeeklyIncome
+from accounting import archives, counters
+from accounting.caches import get_weekly_income_version
+from accounting.exceptions import IncomeArchiveMismatch
+from accounting.models import (
+    Checkpoint,
+    Courier,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    RunningWeeklyIncome,
+    WeeklyIncome,
+    WeeklyIncomeProgress,
+)
 from accounting.receivers import update_daily_income
 from accounting.tasks import (
+    RECONCILIATION_WATERMARK,
+    archive_incomes,
+    backfill_running_weekly_incomes,
     calculate_weekly_incomes,
     check_daily_balance,
+    flush_daily_income_deltas,
+    get_reconciliation_status,
     process_failed_income_update,
+    process_failed_income_update_shard,
+    reconcile_balance_counters,
+    reconcile_incomes,
+    update_daily_incomes,
+    update_daily_incomes_batch,
 )
-from miare.utils import get_five_minutes_ago, get_yesterday_date
+from config import routers
+from miare.utils import get_five_minutes_ago, get_week_start, get_yesterday_date
 
 
 @pytest.mark.django_db
@@ -68,12 +96,176 @@ class TestWeeklyIncome:
             DailyIncome.objects.filter(status=DailyIncome.Status.PROCESSED).count() == 2
         )
 
+    def test_weekly_incomes_are_inserted_per_courier(
+        self, django_assert_max_num_queries
+    ):
+        couriers = baker.make(Courier, _quantity=3)
+        for courier in couriers:
+            for days in range(1, 4):
+                baker.make(
+                    DailyIncome,
+                    courier=courier,
+                    status=DailyIncome.Status.ACTIVE,
+                    date=datetime.date.today() - datetime.timedelta(days),
+                )
+        with django_assert_max_num_queries(8):
+            calculate_weekly_incomes()
+
+        past_saturday = datetime.date.today() - datetime.timedelta(7)
+        for courier in couriers:
+            weekly_income = WeeklyIncome.objects.get(courier=courier)
+            assert weekly_income.date == past_saturday
+            daily_incomes = DailyIncome.objects.filter(courier=courier)
+            assert (
+                weekly_income.amount
+                == daily_incomes.aggregate(Sum("amount"))["amount__sum"]
+            )
 
-@pytest.fixture
-def disconnect_update_daily_income_receiver():
-    post_save.disconnect(update_daily_income, sender=Income)
-    yield None
-    post_save.connect(update_daily_income, sender=Income)
+    def test_only_remaining_ranges_are_generated_on_rerun(self, settings):
+        settings.ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE = 2
+        couriers = baker.make(Courier, _quantity=5)
+        date = datetime.date.today() - datetime.timedelta(1)
+        for courier in couriers:
+            baker.make(
+                DailyIncome,
+                courier=courier,
+                status=DailyIncome.Status.ACTIVE,
+                date=date,
+            )
+        past_saturday = datetime.date.today() - datetime.timedelta(7)
+        first_range = (couriers[0].id // 2 * 2, couriers[0].id // 2 * 2 + 2)
+        WeeklyIncomeProgress.objects.complete(past_saturday, first_range)
+
+        calculate_weekly_incomes()
+        assert set(WeeklyIncome.objects.values_list("courier_id", flat=True)) == {
+            courier.id for courier in couriers if courier.id >= first_range[1]
+        }
+        assert WeeklyIncomeProgress.objects.filter(date=past_saturday).count() == 3
+
+    def test_running_weekly_incomes_are_sealed(self, settings):
+        settings.ACCOUNTING_RUNNING_WEEKLY_INCOME = True
+        past_saturday = get_week_start(datetime.date.today()) - datetime.timedelta(7)
+        couriers = baker.make(Courier, _quantity=3)
+        for courier in couriers:
+            for days in range(3):
+                date = past_saturday + datetime.timedelta(days)
+                baker.make(
+                    DailyIncome,
+                    courier=courier,
+                    status=DailyIncome.Status.ACTIVE,
+                    date=date,
+                    amount=100,
+                )
+                DailyIncome.objects.add_running_weekly_amounts(
+                    {(courier.id, date): 100}
+                )
+        calculate_weekly_incomes()
+
+        assert not RunningWeeklyIncome.objects.exists()
+        assert not DailyIncome.objects.filter(status=DailyIncome.Status.ACTIVE).exists()
+        for courier in couriers:
+            weekly_income = WeeklyIncome.objects.get(courier=courier)
+            assert weekly_income.date == past_saturday
+            assert weekly_income.amount == 300
+
+    def test_daily_incomes_before_running_weekly_incomes_are_sealed(self, settings):
+        past_saturday = get_week_start(datetime.date.today()) - datetime.timedelta(7)
+        courier = baker.make(Courier)
+        # days before running weekly incomes are enabled, and an older leftover day
+        for days in [-7, 0, 1]:
+            baker.make(
+                DailyIncome,
+                courier=courier,
+                status=DailyIncome.Status.ACTIVE,
+                date=past_saturday + datetime.timedelta(days),
+                amount=100,
+            )
+        baker.make(
+            WeeklyIncome,
+            courier=courier,
+            date=past_saturday - datetime.timedelta(7),
+            amount=50,
+        )
+        settings.ACCOUNTING_RUNNING_WEEKLY_INCOME = True
+        date = past_saturday + datetime.timedelta(2)
+        baker.make(
+            DailyIncome,
+            courier=courier,
+            status=DailyIncome.Status.ACTIVE,
+            date=date,
+            amount=100,
+        )
+        DailyIncome.objects.add_running_weekly_amounts({(courier.id, date): 100})
+        calculate_weekly_incomes()
+
+        assert not DailyIncome.objects.filter(status=DailyIncome.Status.ACTIVE).exists()
+        assert dict(
+            WeeklyIncome.objects.filter(courier=courier).values_list("date", "amount")
+        ) == {past_saturday - datetime.timedelta(7): 150, past_saturday: 300}
+
+    def test_running_weekly_incomes_are_sealed_without_daily_incomes(self, settings):
+        settings.ACCOUNTING_RUNNING_WEEKLY_INCOME = True
+        past_saturday = get_week_start(datetime.date.today()) - datetime.timedelta(7)
+        daily_income = baker.make(
+            DailyIncome,
+            status=DailyIncome.Status.ACTIVE,
+            date=past_saturday,
+            amount=100,
+        )
+        assert backfill_running_weekly_incomes() == 1
+        # backfilled ranges are not rebuilt, so amounts are read from running rows
+        assert backfill_running_weekly_incomes() == 0
+        RunningWeeklyIncome.objects.update(amount=120)
+        calculate_weekly_incomes()
+        assert WeeklyIncome.objects.get(courier=daily_income.courier).amount == 120
+        assert WeeklyIncomeProgress.objects.filter(date=past_saturday).exists()
+        # completed ranges are not sealed again
+        DailyIncome.objects.add_running_weekly_amounts(
+            {(daily_income.courier_id, past_saturday): 10}
+        )
+        calculate_weekly_incomes()
+        assert WeeklyIncome.objects.get(courier=daily_income.courier).amount == 120
+
+    def test_weekly_income_generation_is_idempotent(self):
+        daily_income = baker.make(
+            DailyIncome,
+            status=DailyIncome.Status.ACTIVE,
+            date=datetime.date.today() - datetime.timedelta(1),
+        )
+        calculate_weekly_incomes()
+        WeeklyIncomeProgress.objects.all().delete()
+        DailyIncome.objects.get_queryset().update(status=DailyIncome.Status.ACTIVE)
+        calculate_weekly_incomes()
+        assert WeeklyIncome.objects.get().amount == daily_income.amount
+
+    def test_daily_income_stripes_are_included(self, settings):
+        settings.ACCOUNTING_DAILY_INCOME_STRIPES = 4
+        courier = baker.make(Courier)
+        yesterday = datetime.date.today() - datetime.timedelta(1)
+        for stripe in range(settings.ACCOUNTING_DAILY_INCOME_STRIPES):
+            baker.make(
+                DailyIncomeStripe,
+                courier=courier,
+                date=yesterday,
+                stripe=stripe,
+                amount=10,
+            )
+        calculate_weekly_incomes()
+        assert WeeklyIncome.objects.get(courier=courier).amount == 40
+        assert not DailyIncomeStripe.objects.exists()
+
+    def test_weekly_income_version_is_bumped_after_commit(
+        self, django_capture_on_commit_callbacks
+    ):
+        baker.make(
+            DailyIncome,
+            status=DailyIncome.Status.ACTIVE,
+            date=datetime.date.today() - datetime.timedelta(1),
+        )
+        version = get_weekly_income_version()
+        with django_capture_on_commit_callbacks(execute=True):
+            calculate_weekly_incomes()
+        assert get_weekly_income_version() > version
 
 
 @pytest.mark.django_db
@@ -90,6 +282,73 @@ class TestActiveDailyIncome:
         assert DailyIncome.objects.count() > 0
         assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
 
+    def test_incomes_are_processed_in_chunks(
+        self, settings, disconnect_update_daily_income_receiver
+    ):
+        settings.ACCOUNTING_FAILED_INCOME_CHUNK_SIZE = 3
+        incomes = baker.make(Income, status=Income.Status.ACTIVE, _quantity=10)
+        for income in incomes:
+            income.created_at = get_five_minutes_ago()
+            income.save()
+        assert process_failed_income_update() == len(incomes)
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        assert DailyIncome.objects.aggregate(Sum("amount"))["amount__sum"] == sum(
+            map(lambda income: income.get_signed_amount(), incomes)
+        )
+        assert Checkpoint.objects.get_position("process_failed_income_update") == 0
+
+    def test_process_is_resumed_from_checkpoint(
+        self, disconnect_update_daily_income_receiver
+    ):
+        incomes = baker.make(Income, status=Income.Status.ACTIVE, _quantity=10)
+        for income in incomes:
+            income.created_at = get_five_minutes_ago()
+            income.save()
+        Checkpoint.objects.advance("process_failed_income_update", incomes[4].id)
+        assert process_failed_income_update() == 5
+        assert set(
+            Income.objects.filter(status=Income.Status.ACTIVE).values_list(
+                "id", flat=True
+            )
+        ) == {income.id for income in incomes[:5]}
+        assert process_failed_income_update() == 5
+
+
+@pytest.fixture
+def failed_incomes(disconnect_update_daily_income_receiver):
+    couriers = baker.make(Courier, _quantity=6)
+    incomes = []
+    for courier in couriers:
+        for income in baker.make(
+            Income, courier=courier, status=Income.Status.ACTIVE, _quantity=3
+        ):
+            income.created_at = get_five_minutes_ago()
+            income.save()
+            incomes.append(income)
+    return incomes
+
+
+@pytest.mark.django_db
+class TestShardedActiveDailyIncome:
+    def test_shard_processes_only_its_couriers(self, failed_incomes):
+        result = process_failed_income_update_shard(1, 2)
+        odd_courier_incomes = [i for i in failed_incomes if i.courier_id % 2 == 1]
+        assert result == {"shard": 1, "processed": len(odd_courier_incomes)}
+        assert set(
+            Income.objects.filter(status=Income.Status.PROCESSED).values_list(
+                "id", flat=True
+            )
+        ) == {income.id for income in odd_courier_incomes}
+
+    def test_coordinator_dispatches_all_shards(self, settings, failed_incomes):
+        settings.CELERY_TASK_ALWAYS_EAGER = True
+        settings.ACCOUNTING_FAILED_INCOME_SHARDS = 3
+        process_failed_income_update()
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        assert DailyIncome.objects.aggregate(Sum("amount"))["amount__sum"] == sum(
+            map(lambda income: income.get_signed_amount(), failed_incomes)
+        )
+
 
 @pytest.mark.django_db
 class TestSystemBalance:
@@ -127,3 +386,380 @@ class TestSystemBalance:
             income.date = yesterday
             income.save()
         check_daily_balance()
+
+    @pytest.fixture
+    def unbalanced_couriers(self, disconnect_update_daily_income_receiver):
+        yesterday = get_yesterday_date()
+        couriers = baker.make(Courier, _quantity=4)
+        created_at = timezone.make_aware(
+            datetime.datetime.combine(yesterday, datetime.time(12)),
+            datetime.timezone.utc,
+        )
+        for courier in couriers:
+            baker.make(
+                Income,
+                courier=courier,
+                type=Income.Type.TRIP,
+                amount=100,
+                status=Income.Status.PROCESSED,
+            )
+        Income.objects.update(created_at=created_at)
+        # balanced courier
+        baker.make(DailyIncome, courier=couriers[0], date=yesterday, amount=100)
+        # courier with less daily income
+        baker.make(DailyIncome, courier=couriers[1], date=yesterday, amount=30)
+        # courier with a stripe, that is balanced with the daily income
+        baker.make(DailyIncome, courier=couriers[2], date=yesterday, amount=70)
+        baker.make(
+            DailyIncomeStripe, courier=couriers[2], date=yesterday, stripe=0, amount=30
+        )
+        # couriers[3] has no daily income, another courier has no income
+        other = baker.make(DailyIncome, date=yesterday, amount=50)
+        return couriers, other
+
+    def test_discrepancies(self, unbalanced_couriers):
+        couriers, other = unbalanced_couriers
+        discrepancies = DailyIncome.objects.get_discrepancies(get_yesterday_date())
+        assert discrepancies == sorted(
+            [
+                (couriers[1].id, 100, 30),
+                (couriers[3].id, 100, 0),
+                (other.courier_id, 0, 50),
+            ]
+        )
+
+    def test_discrepancies_are_repaired(self, settings, unbalanced_couriers):
+        settings.ACCOUNTING_DAILY_BALANCE_REPAIR = True
+        assert check_daily_balance() == 3
+        assert DailyIncome.objects.get_discrepancies(get_yesterday_date()) == []
+        assert check_daily_balance() == 0
+
+    @pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+    def test_discrepancies_are_read_from_replica(self, settings, unbalanced_couriers):
+        settings.ACCOUNTING_DAILY_BALANCE_REPAIR = True
+        with CaptureQueriesContext(connections["replica"]) as context:
+            assert check_daily_balance(using="replica") == 3
+        assert len(context) > 0
+        # discrepancies are recomputed on default database before repair
+        assert DailyIncome.objects.get_discrepancies(get_yesterday_date()) == []
+
+    @pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+    def test_lagging_replica_is_not_read(self, monkeypatch, unbalanced_couriers):
+        monkeypatch.setattr(
+            routers,
+            "get_replay_timestamp",
+            lambda using: timezone.now() - datetime.timedelta(hours=1),
+        )
+        with CaptureQueriesContext(connections["replica"]) as context:
+            assert check_daily_balance(using="replica") == 3
+        assert len(context) == 0
+
+    def test_stale_discrepancies_are_not_repaired_twice(self, unbalanced_couriers):
+        yesterday = get_yesterday_date()
+        discrepancies = DailyIncome.objects.get_discrepancies(yesterday)
+        assert (
+            len(DailyIncome.objects.repair_discrepancies(yesterday, discrepancies)) == 3
+        )
+        assert DailyIncome.objects.repair_discrepancies(yesterday, discrepancies) == []
+        couriers, other = unbalanced_couriers
+        assert (
+            DailyIncome.objects.get(courier=couriers[1], date=yesterday).amount == 100
+        )
+        assert (
+            DailyIncome.objects.get(courier=couriers[3], date=yesterday).amount == 100
+        )
+        assert DailyIncome.objects.get(id=other.id).amount == 0
+
+
+@pytest.mark.django_db
+class TestBalanceCounters:
+    def test_counters_are_reconciled(self, balance_counters):
+        daily_income = baker.make(
+            DailyIncome, date=counters.get_today(), status=DailyIncome.Status.ACTIVE
+        )
+        key = counters.get_balance_key(
+            daily_income.courier_id, get_week_start(daily_income.date)
+        )
+        balance_counters.hset(key, mapping={counters.WEEK_FIELD: 1})
+        reconcile_balance_counters()
+        assert counters.get_balance(daily_income.courier_id) == {
+            "today": daily_income.amount,
+            "week": daily_income.amount,
+        }
+
+
+@pytest.mark.django_db
+class TestWriteBehindDailyIncome:
+    def make_incomes(self, courier, quantity):
+        return baker.make(
+            Income,
+            courier=courier,
+            type=Income.Type.TRIP,
+            status=Income.Status.ACTIVE,
+            _quantity=quantity,
+        )
+
+    def test_incomes_are_flushed(
+        self, write_behind, django_capture_on_commit_callbacks
+    ):
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = self.make_incomes(courier, 5)
+        assert not DailyIncome.objects.exists()
+        assert flush_daily_income_deltas() == len(incomes)
+        assert DailyIncome.objects.get().amount == sum(i.amount for i in incomes)
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        assert flush_daily_income_deltas() == 0
+
+    def test_processed_incomes_are_not_flushed_again(
+        self, write_behind, django_capture_on_commit_callbacks
+    ):
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = self.make_incomes(courier, 4)
+        # two of them are processed by process_failed_income_update
+        DailyIncome.objects.update_incomes(
+            Income.objects.filter(id__in=[incomes[0].id, incomes[1].id])
+        )
+        assert flush_daily_income_deltas() == 2
+        assert DailyIncome.objects.get().amount == sum(i.amount for i in incomes)
+
+    def test_deltas_of_missing_incomes_are_not_flushed(
+        self, write_behind, django_capture_on_commit_callbacks
+    ):
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = self.make_incomes(courier, 3)
+        Income.objects.filter(id=incomes[0].id).delete()
+        assert flush_daily_income_deltas() == 2
+        assert DailyIncome.objects.get().amount == sum(i.amount for i in incomes[1:])
+
+    def test_redis_is_not_available(self, settings, django_capture_on_commit_callbacks):
+        settings.ACCOUNTING_DAILY_INCOME_WRITE_BEHIND = True
+        settings.ACCOUNTING_DAILY_INCOME_REDIS_URL = "redis://127.0.0.1:1/0"
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = self.make_incomes(courier, 3)
+        assert not DailyIncome.objects.exists()
+        Income.objects.update(created_at=get_five_minutes_ago())
+        assert process_failed_income_update() == len(incomes)
+        assert DailyIncome.objects.get().amount == sum(i.amount for i in incomes)
+
+
+@pytest.mark.django_db
+class TestAsyncDailyIncome:
+    @pytest.fixture
+    def enqueued(self, settings, monkeypatch):
+        settings.ACCOUNTING_DAILY_INCOME_ASYNC = True
+        enqueued: list[list[int]] = []
+        monkeypatch.setattr(update_daily_incomes, "delay", enqueued.append)
+        return enqueued
+
+    def test_income_is_enqueued_after_commit(
+        self, enqueued, django_capture_on_commit_callbacks
+    ):
+        with django_capture_on_commit_callbacks(execute=False) as callbacks:
+            income = baker.make(Income, status=Income.Status.ACTIVE)
+        assert enqueued == []
+        assert not DailyIncome.objects.exists()
+        for callback in callbacks:
+            callback()
+        assert enqueued == [[income.id]]
+
+    def test_pending_incomes_of_courier_are_coalesced(
+        self, enqueued, django_capture_on_commit_callbacks
+    ):
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = baker.make(
+                Income, courier=courier, status=Income.Status.ACTIVE, _quantity=5
+            )
+        assert len(enqueued) == len(incomes)
+        assert update_daily_incomes(enqueued[0]) == len(incomes)
+        for income_ids in enqueued[1:]:
+            assert update_daily_incomes(income_ids) == 0
+        assert DailyIncome.objects.get().amount == sum(
+            income.get_signed_amount() for income in incomes
+        )
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+
+    def test_batch_is_applied_once(
+        self, settings, monkeypatch, django_capture_on_commit_callbacks
+    ):
+        settings.ACCOUNTING_DAILY_INCOME_ASYNC = True
+        settings.ACCOUNTING_DAILY_INCOME_BATCHES = True
+        enqueued: list[list[int]] = []
+        monkeypatch.setattr(update_daily_incomes_batch, "delay", enqueued.append)
+        courier = baker.make(Courier)
+        with django_capture_on_commit_callbacks(execute=True):
+            incomes = baker.make(
+                Income, courier=courier, status=Income.Status.ACTIVE, _quantity=5
+            )
+        requests = [SimpleNamespace(args=(income_ids,)) for income_ids in enqueued]
+        assert update_daily_incomes_batch(requests) == len(incomes)
+        # redelivered messages are ignored
+        assert update_daily_incomes_batch(requests) == 0
+        assert DailyIncome.objects.get().amount == sum(
+            income.get_signed_amount() for income in incomes
+        )
+
+
+@pytest.mark.django_db
+class TestIncrementalReconciliation:
+    @pytest.fixture
+    def incremental(self, settings, disconnect_update_daily_income_receiver):
+        settings.ACCOUNTING_INCREMENTAL_RECONCILIATION = True
+        settings.ACCOUNTING_RECONCILIATION_WINDOW = 60 * 60
+        settings.ACCOUNTING_RECONCILIATION_DELAY = 0
+
+    def make_processed_income(self, courier, created_at):
+        income = baker.make(
+            Income,
+            courier=courier,
+            type=Income.Type.TRIP,
+            amount=100,
+            status=Income.Status.PROCESSED,
+        )
+        Income.objects.filter(id=income.id).update(created_at=created_at)
+        return income
+
+    def test_new_incomes_are_reconciled(self, incremental):
+        now = timezone.now()
+        created_at = now - datetime.timedelta(minutes=1)
+        balanced, unbalanced = baker.make(Courier, _quantity=2)
+        for courier in [balanced, unbalanced]:
+            self.make_processed_income(courier, created_at)
+        baker.make(DailyIncome, courier=balanced, date=created_at.date(), amount=100)
+        Checkpoint.objects.advance_watermark(
+            RECONCILIATION_WATERMARK, now - datetime.timedelta(hours=3)
+        )
+        assert reconcile_incomes() == 1
+        status = get_reconciliation_status()
+        assert status["mismatches"] == 1
+        assert status["watermark"] >= now
+        # only new incomes are reconciled
+        assert reconcile_incomes() == 0
+
+    def test_mismatches_are_counted_once_per_courier_date(self, incremental):
+        now = timezone.now()
+        courier = baker.make(Courier)
+        for minutes in [90, 30]:
+            self.make_processed_income(
+                courier, now - datetime.timedelta(minutes=minutes)
+            )
+        Checkpoint.objects.advance_watermark(
+            RECONCILIATION_WATERMARK, now - datetime.timedelta(hours=2)
+        )
+        # unbalanced courier is found in both windows of the run
+        assert reconcile_incomes() == 1
+        assert get_reconciliation_status()["mismatches"] == 1
+        self.make_processed_income(courier, timezone.now())
+        assert reconcile_incomes() == 1
+        assert get_reconciliation_status()["mismatches"] == 1
+
+    def test_couriers_without_new_incomes_are_not_checked(self, incremental):
+        now = timezone.now()
+        courier = baker.make(Courier)
+        self.make_processed_income(courier, now - datetime.timedelta(hours=2))
+        Checkpoint.objects.advance_watermark(
+            RECONCILIATION_WATERMARK, now - datetime.timedelta(hours=1)
+        )
+        assert reconcile_incomes() == 0
+
+    def test_watermark_is_checked_at_night(self, incremental, caplog):
+        check_daily_balance()
+        assert "are not reconciled" in caplog.text
+        caplog.clear()
+        reconcile_incomes()
+        check_daily_balance()
+        assert "are not reconciled" not in caplog.text
+
+
+@pytest.mark.django_db
+class TestIncomeArchive:
+    date = datetime.date(2020, 3, 10)
+    week_start = datetime.date(2020, 3, 7)
+
+    @pytest.fixture
+    def archive(self, settings, tmp_path, disconnect_update_daily_income_receiver):
+        settings.ACCOUNTING_INCOME_ARCHIVE_MONTHS = 1
+        settings.ACCOUNTING_INCOME_ARCHIVE_DIR = str(tmp_path)
+        settings.ACCOUNTING_INCOME_ARCHIVE_CHUNK_SIZE = 2
+        settings.ACCOUNTING_INCOME_ARCHIVE_DELETE_BATCH_SIZE = 2
+        return tmp_path
+
+    @pytest.fixture
+    def couriers(self, archive):
+        """two couriers with incomes in an old month, that are balanced"""
+        couriers = baker.make(Courier, _quantity=2)
+        created_at = timezone.make_aware(
+            datetime.datetime.combine(self.date, datetime.time(12)),
+            datetime.timezone.utc,
+        )
+        for courier in couriers:
+            for income_type, amount in [
+                (Income.Type.TRIP, 100),
+                (Income.Type.REWARD, 50),
+                (Income.Type.PUNISHMENT, 30),
+            ]:
+                baker.make(
+                    Income,
+                    courier=courier,
+                    type=income_type,
+                    amount=amount,
+                    status=Income.Status.PROCESSED,
+                )
+            baker.make(DailyIncome, courier=courier, date=self.date, amount=120)
+            baker.make(WeeklyIncome, courier=courier, date=self.week_start, amount=120)
+        Income.objects.update(created_at=created_at)
+        return couriers
+
+    @pytest.mark.parametrize("compression", ["zstd", ""])
+    def test_old_incomes_are_archived(self, settings, couriers, compression):
+        settings.ACCOUNTING_INCOME_ARCHIVE_COMPRESSION = compression
+        recent = baker.make(Income, status=Income.Status.PROCESSED)
+        assert archive_incomes() == 6
+        assert list(Income.objects.values_list("id", flat=True)) == [recent.id]
+        assert archives.get_archived_months() == [datetime.date(2020, 3, 1)]
+        assert archives.get_courier_totals() == {
+            courier.id: 120 for courier in couriers
+        }
+        assert archives.get_courier_total(couriers[0].id, self.date, self.date) == 120
+        assert archives.get_courier_total(couriers[0].id, end=self.week_start) == 0
+        # archived months are not archived again
+        assert archive_incomes() == 0
+
+    def test_unbalanced_archive_is_not_deleted(self, couriers):
+        DailyIncome.objects.filter(courier=couriers[0]).update(amount=100)
+        with pytest.raises(IncomeArchiveMismatch, match="daily incomes"):
+            archive_incomes()
+        assert Income.objects.count() == 6
+        WeeklyIncome.objects.filter(courier=couriers[1]).update(amount=100)
+        DailyIncome.objects.filter(courier=couriers[0]).update(amount=120)
+        with pytest.raises(IncomeArchiveMismatch, match="weekly incomes"):
+            archive_incomes()
+        assert Income.objects.count() == 6
+
+    def test_interrupted_deletion_is_resumed(self, couriers):
+        month = datetime.date(2020, 3, 1)
+        archives.write_archive(month, archives.get_archive_path(month))
+        Income.objects.filter(courier=couriers[0]).delete()
+        assert archive_incomes() == 3
+        assert not Income.objects.exists()
+        assert len(archives.get_courier_totals()) == 2
+
+    def test_interrupted_writing_is_removed(self, archive, couriers, monkeypatch):
+        def get_record_batch(rows):
+            raise SoftTimeLimitExceeded()
+
+        monkeypatch.setattr(archives, "get_record_batch", get_record_batch)
+        assert archive_incomes() is None
+        assert list(archive.iterdir()) == []
+        assert Income.objects.count() == 6
+        monkeypatch.undo()
+        assert archive_incomes() == 6
+
+    def test_month_with_unprocessed_incomes_is_not_archived(self, couriers):
+        Income.objects.filter(courier=couriers[0]).update(status=Income.Status.ACTIVE)
+        assert archive_incomes() == 0
+        assert archives.get_archived_months() == []
@@ -1,12 +1,47 @@
 import datetime
+import json
 import random
 
 import pytest
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from model_bakery import baker
 from rest_framework import status
 
-from accounting.models import WeeklyIncome
+from accounting import counters
+from accounting.caches import bump_weekly_income_version
+from accounting.models import (
+    Courier,
+    DailyIncome,
+    DailyIncomeStripe,
+    Income,
+    WeeklyIncome,
+)
+from accounting.serializers import (
+    WEEKLY_INCOME_VALUES,
+    WeeklyIncomeSerializer,
+    serialize_weekly_income_values,
+)
+from config import routers
+from config.middleware import STICKY_COOKIE
+from config.routers import (
+    REPLICA,
+    get_read_db,
+    prefer_primary,
+    prefer_replica,
+    routing_state,
+)
+from miare.utils import get_week_start
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
 
 
 @pytest.fixture
@@ -82,3 +117,481 @@ class TestWeeklyIncomeViewSet:
         url += f"?from_date={from_date}&to_date={to_date}"
         response = admin_client.get(url)
         assert len(response.json()) == expected_count
+
+    def test_count_can_be_skipped(self, admin_client, url, weekly_incomes):
+        response = admin_client.get(url + "?count=false")
+        data = response.json()
+        assert "count" not in data
+        assert data["next"] is None
+        assert data["results"] == self.weekly_incomes_to_expected_results(
+            weekly_incomes
+        )
+
+    def test_count_skipped_next_page(self, admin_client, url, settings):
+        baker.make(WeeklyIncome, _quantity=101)
+        response = admin_client.get(url + "?count=false")
+        data = response.json()
+        assert len(data["results"]) == 100
+        assert data["next"].endswith("page=2")
+        data = admin_client.get(data["next"]).json()
+        assert len(data["results"]) == 1
+        assert data["next"] is None
+
+    @pytest.mark.parametrize("ordering", ["date", "-date"])
+    def test_cursor_pagination(self, admin_client, url, ordering):
+        couriers = baker.make(Courier, _quantity=70)
+        dates = [datetime.date(2022, 1, 1), datetime.date(2022, 1, 8)]
+        baker.make(
+            WeeklyIncome,
+            courier=iter(couriers * len(dates)),
+            date=iter([date for date in dates for _ in couriers]),
+            _quantity=len(couriers) * len(dates),
+        )
+        results = []
+        next_url = url + f"?pagination=cursor&ordering={ordering}"
+        while next_url:
+            data = admin_client.get(next_url).json()
+            results += data["results"]
+            next_url = data["next"]
+        expected = WeeklyIncome.objects.order_by(
+            ordering, ordering.replace("date", "id")
+        )
+        assert len(results) == expected.count()
+        assert len({(r["courier"]["id"], r["date"]) for r in results}) == len(results)
+        assert [result["date"] for result in results] == [
+            str(income.date) for income in expected
+        ]
+
+    def test_response_is_cached(
+        self, admin_client, url, weekly_incomes, django_assert_num_queries
+    ):
+        expected_json = admin_client.get(url).json()
+        WeeklyIncome.objects.all().delete()
+        # only the session and user queries of authentication
+        with django_assert_num_queries(2):
+            response = admin_client.get(url)
+        assert response.json() == expected_json
+
+    def test_cache_is_invalidated_by_version(self, admin_client, url, weekly_incomes):
+        admin_client.get(url)
+        WeeklyIncome.objects.all().delete()
+        bump_weekly_income_version()
+        assert admin_client.get(url).json()["results"] == []
+
+    def test_cache_is_invalidated_by_admin(
+        self, admin_client, url, weekly_incomes, django_capture_on_commit_callbacks
+    ):
+        weekly_income = weekly_incomes[0]
+        admin_client.get(url)
+        change_url = reverse(
+            "admin:accounting_weeklyincome_change", args=[weekly_income.id]
+        )
+        with django_capture_on_commit_callbacks(execute=True):
+            response = admin_client.post(
+                change_url,
+                {
+                    "courier": weekly_income.courier_id,
+                    "date": weekly_income.date,
+                    "amount": 7,
+                },
+            )
+        assert response.status_code == status.HTTP_302_FOUND
+        results = admin_client.get(url).json()["results"]
+        assert 7 in [result["amount"] for result in results]
+
+    def test_not_modified(self, admin_client, url, weekly_incomes):
+        response = admin_client.get(url)
+        etag = response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+        response = admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        bump_weekly_income_version()
+        response = admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_values_serialization_is_same_as_serializer(self, weekly_incomes):
+        queryset = WeeklyIncome.objects.order_by("id")
+        expected = WeeklyIncomeSerializer(queryset, many=True).data
+        values = serialize_weekly_income_values(queryset.values(*WEEKLY_INCOME_VALUES))
+        assert values == expected
+
+    def test_invalid_cursor(self, admin_client, url):
+        response = admin_client.get(url + "?pagination=cursor&cursor=invalid")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestIncomeViewSet:
+    @pytest.fixture
+    def url(self):
+        return reverse("api:incomes-bulk")
+
+    def test_only_staff_users_allowed(self, client, url):
+        response = client.post(url, [], content_type="application/json")
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_bulk_create_incomes(self, admin_client, url):
+        couriers = baker.make(Courier, _quantity=3)
+        data = [
+            {
+                "courier": random.choice(couriers).id,
+                "type": random.choice(Income.Type.values),
+                "amount": random.randint(1, 1000),
+            }
+            for _ in range(50)
+        ]
+        response = admin_client.post(url, data, content_type="application/json")
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.json()) == len(data)
+        assert not Income.objects.filter(status=Income.Status.ACTIVE).exists()
+        for courier in couriers:
+            income_sum = sum(
+                income.get_signed_amount()
+                for income in Income.objects.filter(courier=courier)
+            )
+            daily_income = DailyIncome.objects.filter(courier=courier).first()
+            assert (daily_income.amount if daily_income else 0) == income_sum
+
+    def test_unknown_courier_is_rejected(self, admin_client, url):
+        courier = baker.make(Courier)
+        data = [
+            {"courier": courier.id, "type": Income.Type.TRIP, "amount": 10},
+            {"courier": courier.id + 1, "type": Income.Type.TRIP, "amount": 10},
+        ]
+        response = admin_client.post(url, data, content_type="application/json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Income.objects.exists()
+
+    def test_empty_batch_is_rejected(self, admin_client, url):
+        response = admin_client.post(url, [], content_type="application/json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestIncomeExportViewSet:
+    @pytest.fixture
+    def weekly_url(self):
+        return reverse("api:income-exports-weekly")
+
+    @pytest.fixture
+    def daily_url(self):
+        return reverse("api:income-exports-daily")
+
+    def get_content(self, response):
+        assert response.streaming
+        return b"".join(response.streaming_content).decode()
+
+    def test_only_staff_users_allowed(self, client, weekly_url):
+        response = client.get(weekly_url)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_export_weekly_incomes_csv(self, admin_client, weekly_url, settings):
+        settings.ACCOUNTING_EXPORT_CHUNK_SIZE = 2
+        weekly_incomes = baker.make(WeeklyIncome, _quantity=5)
+        response = admin_client.get(weekly_url)
+        assert response["Content-Type"] == "text/csv"
+        lines = self.get_content(response).splitlines()
+        assert lines[0] == "courier_id,courier_name,date,amount"
+        weekly_incomes.sort(key=lambda income: (income.date, income.id))
+        assert lines[1:] == [
+            f"{income.courier.id},{income.courier.name},{income.date},{income.amount}"
+            for income in weekly_incomes
+        ]
+
+    def test_export_daily_incomes_ndjson(self, admin_client, daily_url):
+        daily_income = baker.make(DailyIncome, status=DailyIncome.Status.ACTIVE)
+        response = admin_client.get(daily_url + "?export_format=ndjson")
+        assert response["Content-Type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in self.get_content(response).splitlines()]
+        assert rows == [
+            {
+                "courier_id": daily_income.courier.id,
+                "courier_name": daily_income.courier.name,
+                "date": str(daily_income.date),
+                "amount": daily_income.amount,
+                "status": DailyIncome.Status.ACTIVE,
+            }
+        ]
+
+    def test_export_daily_incomes_with_stripes(self, admin_client, daily_url, settings):
+        settings.ACCOUNTING_DAILY_INCOME_STRIPES = 4
+        courier = baker.make(Courier)
+        dates = [datetime.date(2022, 1, day) for day in range(1, 4)]
+        for date in dates[:2]:
+            baker.make(
+                DailyIncome,
+                courier=courier,
+                date=date,
+                amount=100,
+                status=DailyIncome.Status.ACTIVE,
+            )
+        for date in dates[1:]:
+            for stripe in range(2):
+                baker.make(
+                    DailyIncomeStripe,
+                    courier=courier,
+                    date=date,
+                    stripe=stripe,
+                    amount=10,
+                )
+        response = admin_client.get(daily_url + "?export_format=ndjson")
+        rows = [json.loads(line) for line in self.get_content(response).splitlines()]
+        assert [(row["date"], row["amount"]) for row in rows] == [
+            ("2022-01-01", 100),
+            ("2022-01-02", 120),
+            ("2022-01-03", 20),
+        ]
+
+    def test_export_is_filtered_by_date(self, admin_client, weekly_url):
+        for date in [datetime.date(2022, 1, 1), datetime.date(2022, 1, 8)]:
+            baker.make(WeeklyIncome, date=date)
+        response = admin_client.get(weekly_url + "?from_date=2022-01-05")
+        lines = self.get_content(response).splitlines()
+        assert len(lines) == 2
+        assert "2022-01-08" in lines[1]
+
+    def test_invalid_export_format(self, admin_client, weekly_url):
+        response = admin_client.get(weekly_url + "?export_format=xml")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestCourierViewSet:
+    @pytest.fixture
+    def courier(self):
+        return baker.make(Courier)
+
+    @pytest.fixture
+    def url(self, courier):
+        return reverse("api:couriers-balance", kwargs={"pk": courier.id})
+
+    @pytest.fixture
+    def daily_incomes(self, courier):
+        today = counters.get_today()
+        week_start = get_week_start(today)
+        dates = {today, week_start, week_start - datetime.timedelta(1)}
+        return [
+            baker.make(
+                DailyIncome,
+                courier=courier,
+                date=date,
+                amount=100,
+                status=DailyIncome.Status.ACTIVE,
+            )
+            for date in dates
+        ]
+
+    def expected_balance(self, daily_incomes):
+        today = counters.get_today()
+        week_start = get_week_start(today)
+        return {
+            "today": sum(i.amount for i in daily_incomes if i.date == today),
+            "week": sum(i.amount for i in daily_incomes if i.date >= week_start),
+        }
+
+    def test_only_staff_users_allowed(self, client, url):
+        response = client.get(url)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_balance_from_database(self, admin_client, url, daily_incomes):
+        response = admin_client.get(url)
+        assert response.json() == self.expected_balance(daily_incomes)
+
+    def test_balance_falls_back_to_database(
+        self, admin_client, url, daily_incomes, settings
+    ):
+        settings.ACCOUNTING_BALANCE_COUNTERS = True
+        settings.ACCOUNTING_BALANCE_REDIS_URL = "redis://127.0.0.1:1/0"
+        response = admin_client.get(url)
+        assert response.json() == self.expected_balance(daily_incomes)
+
+    def test_balance_from_counters(
+        self,
+        admin_client,
+        url,
+        courier,
+        daily_incomes,
+        balance_counters,
+        django_capture_on_commit_callbacks,
+    ):
+        assert admin_client.get(url).json() == self.expected_balance(daily_incomes)
+        with django_capture_on_commit_callbacks(execute=True):
+            income = baker.make(
+                Income,
+                courier=courier,
+                type=Income.Type.TRIP,
+                amount=50,
+                status=Income.Status.ACTIVE,
+            )
+        expected = self.expected_balance(daily_incomes)
+        expected["today"] += income.get_signed_amount()
+        expected["week"] += income.get_signed_amount()
+        DailyIncome.objects.get_queryset().delete()
+        assert admin_client.get(url).json() == expected
+
+    def test_balance_of_unknown_courier_not_found(self, admin_client):
+        url = reverse("api:couriers-balance", kwargs={"pk": 0})
+        response = admin_client.get(url)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_balance_of_unknown_courier_not_counted(
+        self, admin_client, balance_counters
+    ):
+        url = reverse("api:couriers-balance", kwargs={"pk": 0})
+        response = admin_client.get(url)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert balance_counters.dbsize() == 0
+
+
+@pytest.mark.django_db
+class TestCourierDailyIncomesViewSet:
+    @pytest.fixture
+    def courier(self):
+        return baker.make(Courier)
+
+    @pytest.fixture
+    def url(self, courier):
+        return reverse("api:couriers-daily-incomes", kwargs={"pk": courier.id})
+
+    def test_only_staff_users_allowed(self, client, url):
+        response = client.get(url)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_missing_dates_are_filled(self, admin_client, url, courier):
+        dates = [datetime.date(2022, 1, 2), datetime.date(2022, 1, 4)]
+        for date in dates:
+            baker.make(
+                DailyIncome,
+                courier=courier,
+                date=date,
+                amount=100,
+                status=DailyIncome.Status.PROCESSED,
+            )
+        baker.make(DailyIncome, date=datetime.date(2022, 1, 3), amount=50)
+        response = admin_client.get(url + "?from=2022-01-01&to=2022-01-05")
+        assert response.json() == [
+            {"date": "2022-01-01", "amount": 0, "status": None},
+            {"date": "2022-01-02", "amount": 100, "status": 1},
+            {"date": "2022-01-03", "amount": 0, "status": None},
+            {"date": "2022-01-04", "amount": 100, "status": 1},
+            {"date": "2022-01-05", "amount": 0, "status": None},
+        ]
+
+    def test_default_range(self, admin_client, url, settings):
+        response = admin_client.get(url)
+        data = response.json()
+        assert len(data) == settings.ACCOUNTING_DAILY_INCOME_TIMELINE_DEFAULT_DAYS
+        assert data[-1]["date"] == str(timezone.now().date())
+
+    @pytest.mark.parametrize(
+        "query", ["?from=2022-01-05&to=2022-01-01", "?from=2020-01-01&to=2022-01-01"]
+    )
+    def test_invalid_range(self, admin_client, url, query):
+        response = admin_client.get(url + query)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_unknown_courier(self, admin_client):
+        url = reverse("api:couriers-daily-incomes", kwargs={"pk": 0})
+        response = admin_client.get(url)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestReconciliationViewSet:
+    @pytest.fixture
+    def url(self):
+        return reverse("api:reconciliation-list")
+
+    def test_only_staff_users_allowed(self, client, url):
+        response = client.get(url)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_reconciliation_status(self, admin_client, url):
+        assert admin_client.get(url).json() == {
+            "watermark": None,
+            "lag": None,
+            "mismatches": 0,
+        }
+
+
+class TestReplicaRouter:
+    def test_reads_out_of_requests_are_sent_to_default(self):
+        assert get_read_db() == "default"
+
+    def test_reads_of_requests_are_sent_to_replica(self):
+        with routing_state() as state:
+            assert get_read_db() == REPLICA
+            state.written = True
+            assert get_read_db() == "default"
+        with routing_state(sticky=True):
+            assert get_read_db() == "default"
+
+    @pytest.mark.django_db
+    def test_reads_in_transaction_are_sent_to_default(self):
+        with routing_state():
+            assert get_read_db() == "default"
+            with prefer_replica():
+                assert get_read_db() == REPLICA
+
+    def test_primary_is_preferred(self):
+        with routing_state(), prefer_primary():
+            assert get_read_db() == "default"
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+class TestReplicaRouting:
+    def get_replica_queries(self, client, url, table=""):
+        with CaptureQueriesContext(connections[REPLICA]) as context:
+            response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        return len([query for query in context if table in query["sql"]])
+
+    @pytest.fixture
+    def timeline_url(self):
+        courier = baker.make(Courier)
+        return reverse("api:couriers-daily-incomes", kwargs={"pk": courier.id})
+
+    def test_read_only_views_read_from_replica(self, admin_client, timeline_url):
+        assert self.get_replica_queries(admin_client, timeline_url) > 0
+
+    def test_cached_responses_read_from_caught_up_replica(
+        self, admin_client, url, weekly_incomes
+    ):
+        table = WeeklyIncome._meta.db_table
+        assert self.get_replica_queries(admin_client, url, table) > 0
+
+    def test_cached_responses_read_from_default_if_replica_lags(
+        self, monkeypatch, admin_client, url, weekly_incomes
+    ):
+        monkeypatch.setattr(
+            routers,
+            "get_replay_timestamp",
+            lambda using: timezone.now() - datetime.timedelta(hours=1),
+        )
+        table = WeeklyIncome._meta.db_table
+        assert self.get_replica_queries(admin_client, url, table) == 0
+
+    def test_atomic_views_read_from_default(self, admin_client):
+        url = reverse("api:reconciliation-list")
+        assert self.get_replica_queries(admin_client, url) == 0
+
+    def test_admin_changelist_reads_from_replica(self, admin_client, weekly_incomes):
+        url = reverse("admin:accounting_weeklyincome_changelist")
+        assert self.get_replica_queries(admin_client, url) > 0
+
+    @pytest.mark.parametrize("stickiness", [0, 10])
+    def test_clients_read_their_writes_from_default(
+        self, settings, admin_client, timeline_url, stickiness
+    ):
+        settings.DATABASE_REPLICA_STICKINESS = stickiness
+        courier = baker.make(Courier)
+        response = admin_client.post(
+            reverse("api:incomes-bulk"),
+            [{"courier": courier.id, "type": Income.Type.TRIP, "amount": 10}],
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert (STICKY_COOKIE in response.cookies) == bool(stickiness)
+        replica_queries = self.get_replica_queries(admin_client, timeline_url)
+        assert (replica_queries == 0) == bool(stickiness)
@@ -1,14 +1,51 @@
+import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from django_filters import rest_framework as filters
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
-from rest_framework import mixins, permissions, viewsets
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
 
-from accounting.filters import WeeklyIncomeFilters
-from accounting.models import WeeklyIncome
-from accounting.serializers import WeeklyIncomeSerializer
+from accounting import counters
+from accounting.caches import (
+    get_cached_weekly_income_response,
+    get_weekly_income_version,
+    set_cached_weekly_income_response,
+)
+from accounting.exports import CSV, EXPORT_FORMATS, stream_export, stream_rows
+from accounting.filters import DailyIncomeFilters, WeeklyIncomeFilters
+from accounting.managers import is_striped
+from accounting.models import Courier, DailyIncome, Income, WeeklyIncome
+from accounting.paginations import (
+    DateKeysetPagination,
+    OptionalCountPageNumberPagination,
+)
+from accounting.serializers import (
+    WEEKLY_INCOME_VALUES,
+    CourierBalanceSerializer,
+    DailyIncomeTimelineQuerySerializer,
+    DailyIncomeTimelineSerializer,
+    IncomeSerializer,
+    ReconciliationStatusSerializer,
+    WeeklyIncomeSerializer,
+    serialize_weekly_income_values,
+)
+from accounting.tasks import get_reconciliation_status
+from config.routers import is_replica_caught_up, prefer_primary
 
 
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
 class WeeklyIncomeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = WeeklyIncome.objects.all()
     serializer_class = WeeklyIncomeSerializer
@@ -16,10 +53,23 @@ class WeeklyIncomeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     ordering_fields = ["date"]
     filterset_class = WeeklyIncomeFilters
+    pagination_class = OptionalCountPageNumberPagination
+    pagination_query_param = "pagination"
+    _paginator: BasePagination
 
     def get_queryset(self):
         return super().get_queryset().select_related("courier")
 
+    @property
+    def paginator(self):
+        """use keyset pagination when pagination=cursor is requested"""
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get(self.pagination_query_param) == "cursor":
+                self._paginator = DateKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     @extend_schema(
         description="Get courier weekly incomes",
         examples=[
@@ -83,7 +133,279 @@ class WeeklyIncomeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                     OpenApiExample("descending ordering by date", "-date"),
                 ],
             ),
+            OpenApiParameter(
+                "pagination",
+                type=OpenApiTypes.STR,
+                enum=["page", "cursor"],
+                description="""cursor pagination is ordered by date and id and
+                its pages are fetched in constant time independent of depth, results
+                are paged forward by following the next link""",
+            ),
+            OpenApiParameter(
+                "cursor",
+                type=OpenApiTypes.STR,
+                description="cursor of the page, only with cursor pagination",
+            ),
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        """list weekly incomes from cache
+
+        weekly incomes only change when they are generated, so responses are cached
+        by weekly income version and request url, version is also sent as ETag and
+        Last-Modified, and requests with an up to date version get 304 without body
+        responses are read from replica only if it has replayed the commit of
+        the version, otherwise from default database, so weekly incomes of
+        a lagging replica are not cached by the new version
+        """
+        version = get_weekly_income_version()
+        etag = quote_etag(f"weekly-incomes-{version}")
+        response = get_conditional_response(request, etag=etag, last_modified=version)
+        if response is None:
+            url = self.get_cache_url(request)
+            data = get_cached_weekly_income_response(version, url)
+            if data is None:
+                # version is truncated to seconds, changes are committed before it + 1
+                since = datetime.datetime.fromtimestamp(
+                    version + 1, datetime.timezone.utc
+                )
+                if is_replica_caught_up(since):
+                    data = self.get_list_data()
+                else:
+                    with prefer_primary():
+                        data = self.get_list_data()
+                set_cached_weekly_income_response(version, url, data)
+            response = Response(data)
+        response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(version)
+        return response
+
+    def get_list_data(self):
+        """serialize weekly incomes from values() instead of WeeklyIncomeSerializer"""
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *WEEKLY_INCOME_VALUES
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return serialize_weekly_income_values(queryset)
+        data = serialize_weekly_income_values(page)
+        return self.get_paginated_response(data).data
+
+    def get_cache_url(self, request):
+        query = sorted(request.query_params.lists())
+        return f"{request.build_absolute_uri(request.path)}?{urlencode(query, True)}"
+
+
+class IncomeViewSet(viewsets.GenericViewSet):
+    queryset = Income.objects.all()
+    serializer_class = IncomeSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="Create a batch of courier incomes and update their daily incomes",
+        request=IncomeSerializer(many=True),
+        responses={status.HTTP_201_CREATED: IncomeSerializer(many=True)},
+        examples=[
+            OpenApiExample(
+                "create a trip and a punishment income",
+                value=[
+                    {"courier": 3, "type": 0, "amount": 120000},
+                    {"courier": 4, "type": 2, "amount": 15000},
+                ],
+                request_only=True,
+            )
         ],
     )
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class CourierViewSet(viewsets.GenericViewSet):
+    queryset = Courier.objects.all()
+    serializer_class = CourierBalanceSerializer
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = None
+    lookup_value_regex = "[0-9]+"
+
+    @extend_schema(
+        description="Get today and this week income of courier",
+        responses=CourierBalanceSerializer,
+    )
+    @action(detail=True, methods=["get"])
+    def balance(self, request, pk=None):
+        """courier is not fetched, so balance is read from redis counters without database
+
+        courier is checked only when its week is loaded from database
+        """
+        balance = counters.get_balance(int(pk))
+        if balance is None:
+            raise NotFound()
+        return Response(balance)
+
+    @extend_schema(
+        description="""Get daily incomes of courier from a date to another date,
+        inclusive, dates without income have zero amount and null status.
+        by default last 30 days are returned""",
+        parameters=[DailyIncomeTimelineQuerySerializer],
+        responses=DailyIncomeTimelineSerializer(many=True),
+    )
+    @action(detail=True, methods=["get"], url_path="daily-incomes")
+    def daily_incomes(self, request, pk=None):
+        courier = self.get_object()
+        query_serializer = DailyIncomeTimelineQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        timeline = DailyIncome.objects.get_courier_timeline(
+            courier.id, **query_serializer.validated_data
+        )
+        return Response(DailyIncomeTimelineSerializer(timeline, many=True).data)
+
+
+class ReconciliationViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="""Get watermark of reconciled incomes, its lag in seconds
+        and number of unbalanced courier dates found by the last reconciliation run""",
+        responses=ReconciliationStatusSerializer,
+    )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return Response(
+            ReconciliationStatusSerializer(get_reconciliation_status()).data
+        )
+
+
+EXPORT_PARAMETERS = [
+    OpenApiParameter(
+        "from_date",
+        type=OpenApiTypes.DATE,
+        description="""filter results after this date""",
+    ),
+    OpenApiParameter(
+        "to_date",
+        type=OpenApiTypes.DATE,
+        description="""filter results before this date""",
+    ),
+    OpenApiParameter(
+        "export_format",
+        type=OpenApiTypes.STR,
+        enum=list(EXPORT_FORMATS),
+        default=CSV,
+        description="format of exported rows",
+    ),
+]
+
+
+def get_export_key(row):
+    """return date and courier id of an exported row, that rows are ordered by"""
+    courier_id, _, date, *_ = row
+    return date, courier_id
+
+
+EXPORT_RESPONSES = {
+    (status.HTTP_200_OK, media_type): OpenApiTypes.STR
+    for media_type in EXPORT_FORMATS.values()
+}
+
+
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class IncomeExportViewSet(viewsets.ViewSet):
+    """Export incomes as a stream of csv or ndjson rows
+
+    requests are not atomic, because rows are read after view is returned,
+    while response is streamed, and server-side cursors can not be used
+    after request transaction is committed
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+    export_fields = ["courier_id", "courier__name", "date", "amount"]
+    export_header = ["courier_id", "courier_name", "date", "amount"]
+
+    def get_export_format(self, request):
+        export_format = request.query_params.get("export_format", CSV)
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"export_format": ["Invalid export format."]})
+        return export_format
+
+    def filter_queryset(self, filterset_class, queryset):
+        filterset = filterset_class(self.request.query_params, queryset=queryset)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return filterset.qs
+
+    @extend_schema(
+        description="Stream all weekly incomes ordered by date",
+        parameters=[*EXPORT_PARAMETERS],
+        responses=EXPORT_RESPONSES,
+    )
+    @action(detail=False, methods=["get"])
+    def weekly(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(
+            WeeklyIncomeFilters, WeeklyIncome.objects.order_by("date", "id")
+        )
+        return stream_export(
+            queryset,
+            self.export_fields,
+            self.export_header,
+            self.get_export_format(request),
+            "weekly-incomes",
+        )
+
+    @extend_schema(
+        description="""Stream all daily incomes ordered by date, with amounts
+        of daily income stripes that are not folded yet""",
+        parameters=[*EXPORT_PARAMETERS],
+        responses=EXPORT_RESPONSES,
+    )
+    @action(detail=False, methods=["get"])
+    def daily(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(
+            DailyIncomeFilters, DailyIncome.objects.order_by("date", "courier_id")
+        )
+        if not is_striped():
+            return stream_export(
+                queryset,
+                self.export_fields + ["status"],
+                self.export_header + ["status"],
+                self.get_export_format(request),
+                "daily-incomes",
+            )
+        rows = queryset.values_list(*self.export_fields, "status").iterator(
+            chunk_size=settings.ACCOUNTING_EXPORT_CHUNK_SIZE
+        )
+        return stream_rows(
+            self.add_stripe_amounts(rows),
+            self.export_header + ["status"],
+            self.get_export_format(request),
+            "daily-incomes",
+        )
+
+    def add_stripe_amounts(self, rows):
+        """Add amounts of daily income stripes that are not folded yet to daily rows
+
+        stripes are only kept for dates that are not folded, e.g. today, so their sums
+        are read at once and merged into daily rows ordered by date and courier,
+        dates that courier has only stripes are exported as ACTIVE daily incomes.
+        """
+        stripes = self.filter_queryset(
+            DailyIncomeFilters, DailyIncome.objects.get_stripe_manager().all()
+        )
+        stripe_rows = list(
+            stripes.values("courier_id", "courier__name", "date")
+            .annotate(amount=Sum("amount"))
+            .order_by("date", "courier_id")
+            .values_list("courier_id", "courier__name", "date", "amount")
+        )
+        stripe_rows.reverse()
+        for courier_id, courier_name, date, amount, daily_status in rows:
+            while stripe_rows and get_export_key(stripe_rows[-1]) < (date, courier_id):
+                yield (*stripe_rows.pop(), DailyIncome.Status.ACTIVE)
+            if stripe_rows and get_export_key(stripe_rows[-1]) == (date, courier_id):
+                amount += stripe_rows.pop()[3]
+            yield courier_id, courier_name, date, amount, daily_status
+        while stripe_rows:
+            yield (*stripe_rows.pop(), DailyIncome.Status.ACTIVE)
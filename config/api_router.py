@@ -1,7 +1,13 @@
 from django.conf import settings
 from rest_framework.routers import DefaultRouter, SimpleRouter
 
-from accounting.views import WeeklyIncomeViewSet
+from accounting.views import (
+    CourierViewSet,
+    IncomeExportViewSet,
+    IncomeViewSet,
+    ReconciliationViewSet,
+    WeeklyIncomeViewSet,
+)
 from miare.users.api.views import UserViewSet
 
 if settings.DEBUG:
@@ -10,6 +16,10 @@ else:
     router = SimpleRouter()
 
 router.register("users", UserViewSet)
+router.register("couriers", CourierViewSet, basename="couriers")
+router.register("incomes", IncomeViewSet, basename="incomes")
+router.register("income-exports", IncomeExportViewSet, basename="income-exports")
+router.register("reconciliation", ReconciliationViewSet, basename="reconciliation")
 router.register("weekly-incomes", WeeklyIncomeViewSet, basename="weekly-incomes")
 
 
@@ -0,0 +1,28 @@
+from django.conf import settings
+
+from config.routers import routing_state
+
+STICKY_COOKIE = "use_primary_database"
+
+
+class ReplicaStickinessMiddleware:
+    """Route database reads of each request by config.routers.ReplicaRouter
+
+    a client that writes to default database gets a cookie that sends its reads
+    to default database for DATABASE_REPLICA_STICKINESS seconds, so it reads its
+    own writes while replica catches up, it's disabled if the setting is 0.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stickiness = settings.DATABASE_REPLICA_STICKINESS
+        sticky = bool(stickiness) and STICKY_COOKIE in request.COOKIES
+        with routing_state(sticky=sticky) as state:
+            response = self.get_response(request)
+        if stickiness and state.written:
+            response.set_cookie(
+                STICKY_COOKIE, "1", max_age=stickiness, httponly=True, samesite="Lax"
+            )
+        return response
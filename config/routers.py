@@ -0,0 +1,164 @@
+"""Database router that sends reads to a replica database
+
+if a REPLICA database is configured, reads of requests are sent to it and writes
+are always sent to default database. reads are sent to default database if:
+- they are in a transaction of default database, e.g. a view with ATOMIC_REQUESTS,
+  unless replica is preferred by prefer_replica, e.g. admin changelists
+- the request has written to default database
+- the client is stuck to default database by ReplicaStickinessMiddleware
+- they are not in a request, e.g. celery tasks, which must choose replica explicitly
+  by using() or db_manager()
+- primary is preferred by prefer_primary, e.g. reads that are cached, which must not
+  be stale, unless replica has caught up by is_replica_caught_up
+tasks that read from replica can check it has caught up by get_caught_up_db.
+"""
+import contextlib
+import contextvars
+import dataclasses
+import datetime
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = "replica"
+
+
+@dataclasses.dataclass
+class RoutingState:
+    """Routing state of a request
+
+    Attributes:
+        sticky (bool): client has written recently, so it reads from default database
+        written (bool): request has written to default database
+    """
+
+    sticky: bool = False
+    written: bool = False
+
+
+_state: contextvars.ContextVar[RoutingState | None] = contextvars.ContextVar(
+    "database_routing_state", default=None
+)
+_prefer_replica = contextvars.ContextVar("database_prefer_replica", default=False)
+_prefer_primary = contextvars.ContextVar("database_prefer_primary", default=False)
+
+
+def has_replica():
+    return REPLICA in settings.DATABASES
+
+
+def get_replay_timestamp(using):
+    """Return commit time of the last transaction that database has replayed
+
+    Returns:
+        datetime | None: None if database is not a PostgreSQL standby,
+            so it does not lag behind default database
+    """
+    connection = connections[using]
+    if using == DEFAULT_DB_ALIAS or connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_is_in_recovery(), pg_last_xact_replay_timestamp()")
+        in_recovery, timestamp = cursor.fetchone()
+    if not in_recovery:
+        return None
+    return timestamp or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def get_caught_up_db(using, since):
+    """Return using if it has replayed transactions of default database until since,
+    otherwise default database
+
+    replay timestamp only moves by new transactions, so an idle standby that is
+    up to date may be reported as lagging, then default database is read instead.
+
+    Args:
+        using (str): database alias, e.g. replica
+        since (datetime): time that reads must see writes of default database until
+    """
+    timestamp = get_replay_timestamp(using)
+    if timestamp is not None and timestamp < since:
+        return DEFAULT_DB_ALIAS
+    return using
+
+
+def is_replica_caught_up(since):
+    """Check replica is configured and has replayed transactions until since"""
+    return has_replica() and get_caught_up_db(REPLICA, since) == REPLICA
+
+
+@contextlib.contextmanager
+def routing_state(sticky=False):
+    """Route reads in the block by a new routing state, e.g. during a request
+
+    Yields:
+        RoutingState: state of the block
+    """
+    state = RoutingState(sticky=sticky)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextlib.contextmanager
+def prefer_replica():
+    """Send reads in the block to replica, even in a transaction of default database
+
+    it's for read only views that are wrapped in a transaction by ATOMIC_REQUESTS
+    """
+    token = _prefer_replica.set(True)
+    try:
+        yield
+    finally:
+        _prefer_replica.reset(token)
+
+
+@contextlib.contextmanager
+def prefer_primary():
+    """Send reads in the block to default database, even in a read only view
+
+    it's for reads that are cached after they are read, so a lagging replica
+    is not cached and served after replica catches up
+    """
+    token = _prefer_primary.set(True)
+    try:
+        yield
+    finally:
+        _prefer_primary.reset(token)
+
+
+def get_read_db():
+    """Return database that reads are sent to"""
+    state = _state.get()
+    if not has_replica() or state is None or state.sticky or state.written:
+        return DEFAULT_DB_ALIAS
+    if _prefer_primary.get():
+        return DEFAULT_DB_ALIAS
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block and not _prefer_replica.get():
+        return DEFAULT_DB_ALIAS
+    return REPLICA
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return get_read_db()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, REPLICA}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """replica is migrated by replication of default database"""
+        if db == REPLICA:
+            return False
+        return None
@@ -41,6 +41,14 @@ LOCALE_PATHS = [str(ROOT_DIR / "locale")]
 # https://docs.djangoproject.com/en/dev/ref/settings/#databases
 DATABASES = {"default": env.db("DATABASE_URL", default="sqlite:./db.sqlite")}
 DATABASES["default"]["ATOMIC_REQUESTS"] = True
+# reads of requests are sent to replica database by ReplicaRouter, if it's configured
+if env("REPLICA_DATABASE_URL", default=""):
+    DATABASES["replica"] = env.db("REPLICA_DATABASE_URL")
+# https://docs.djangoproject.com/en/dev/ref/settings/#database-routers
+DATABASE_ROUTERS = ["config.routers.ReplicaRouter"]
+# seconds that a client reads from default database after it writes,
+# so it reads its own writes while replica catches up, 0 disables it
+DATABASE_REPLICA_STICKINESS = env.int("DATABASE_REPLICA_STICKINESS", default=0)
 # https://docs.djangoproject.com/en/stable/ref/settings/#std:setting-DEFAULT_AUTO_FIELD
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -130,6 +138,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "config.middleware.ReplicaStickinessMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -307,6 +316,21 @@ EACH_DAY_AT_ONE_CLOCK_CHECK_YESTERDAY_DAILY_BALANCE = {
     "hour": 1,
     "minute": 0,
 }
+EACH_DAY_AT_TWO_CLOCK_BUILD_INCOME_ROLLUPS = {
+    "day_of_week": "*",
+    "hour": 2,
+    "minute": 0,
+}
+EACH_DAY_AT_THREE_CLOCK_MAINTAIN_INCOME_PARTITIONS = {
+    "day_of_week": "*",
+    "hour": 3,
+    "minute": 0,
+}
+EACH_DAY_AT_FOUR_CLOCK_ARCHIVE_INCOMES = {
+    "day_of_week": "*",
+    "hour": 4,
+    "minute": 0,
+}
 CELERY_BEAT_SCHEDULE = {
     "calculate_weekly_incomes": {
         "task": "accounting.tasks.calculate_weekly_incomes",
@@ -320,6 +344,34 @@ CELERY_BEAT_SCHEDULE = {
         "task": "accounting.tasks.process_failed_income_update",
         "schedule": 10 * 60,  # every 10 minutes
     },
+    "build_income_rollups": {
+        "task": "accounting.tasks.build_income_rollups",
+        "schedule": crontab(**EACH_DAY_AT_TWO_CLOCK_BUILD_INCOME_ROLLUPS),
+    },
+    "flush_daily_income_deltas": {
+        "task": "accounting.tasks.flush_daily_income_deltas",
+        "schedule": 10,  # every 10 seconds
+    },
+    "fold_daily_income_stripes": {
+        "task": "accounting.tasks.fold_daily_income_stripes",
+        "schedule": 60 * 60,  # every hour
+    },
+    "reconcile_incomes": {
+        "task": "accounting.tasks.reconcile_incomes",
+        "schedule": 10 * 60,  # every 10 minutes
+    },
+    "reconcile_balance_counters": {
+        "task": "accounting.tasks.reconcile_balance_counters",
+        "schedule": 5 * 60,  # every 5 minutes
+    },
+    "maintain_income_partitions": {
+        "task": "accounting.tasks.maintain_income_partitions",
+        "schedule": crontab(**EACH_DAY_AT_THREE_CLOCK_MAINTAIN_INCOME_PARTITIONS),
+    },
+    "archive_incomes": {
+        "task": "accounting.tasks.archive_incomes",
+        "schedule": crontab(**EACH_DAY_AT_FOUR_CLOCK_ARCHIVE_INCOMES),
+    },
 }
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#worker-send-task-events
 CELERY_WORKER_SEND_TASK_EVENTS = True
@@ -375,3 +427,136 @@ SPECTACULAR_DEFAULTS = {
 }
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Accounting
+# maximum number of incomes accepted by bulk income creation endpoint
+ACCOUNTING_INCOME_BULK_MAX_SIZE = env.int(
+    "ACCOUNTING_INCOME_BULK_MAX_SIZE", default=10_000
+)
+# update daily income by a single INSERT ... ON CONFLICT DO UPDATE statement
+# instead of select_for_update, if database supports it
+ACCOUNTING_DAILY_INCOME_UPSERT = env.bool(
+    "ACCOUNTING_DAILY_INCOME_UPSERT", default=False
+)
+# number of incomes processed in one transaction by process_failed_income_update
+ACCOUNTING_FAILED_INCOME_CHUNK_SIZE = env.int(
+    "ACCOUNTING_FAILED_INCOME_CHUNK_SIZE", default=1_000
+)
+# number of courier shards that process_failed_income_update is split into,
+# each shard is processed by a separate task
+ACCOUNTING_FAILED_INCOME_SHARDS = env.int("ACCOUNTING_FAILED_INCOME_SHARDS", default=1)
+# number of courier ids that calculate_weekly_incomes generates in one transaction
+ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE = env.int(
+    "ACCOUNTING_WEEKLY_INCOME_RANGE_SIZE", default=1_000
+)
+# accumulate current week income of couriers in running weekly incomes,
+# with daily incomes, and generate weekly incomes from them, after it's enabled
+# backfill_running_weekly_incomes command adds days before it to them
+ACCOUNTING_RUNNING_WEEKLY_INCOME = env.bool(
+    "ACCOUNTING_RUNNING_WEEKLY_INCOME", default=False
+)
+# seconds that weekly income responses are cached, cache is invalidated
+# whenever weekly incomes are generated
+ACCOUNTING_WEEKLY_INCOME_CACHE_TIMEOUT = env.int(
+    "ACCOUNTING_WEEKLY_INCOME_CACHE_TIMEOUT", default=7 * 24 * 60 * 60
+)
+# number of rows fetched from database and sent in one chunk by income exports
+ACCOUNTING_EXPORT_CHUNK_SIZE = env.int("ACCOUNTING_EXPORT_CHUNK_SIZE", default=2_000)
+# serve courier balance from redis counters, incremented with daily incomes
+ACCOUNTING_BALANCE_COUNTERS = env.bool("ACCOUNTING_BALANCE_COUNTERS", default=False)
+ACCOUNTING_BALANCE_REDIS_URL = env(
+    "ACCOUNTING_BALANCE_REDIS_URL", default="redis://127.0.0.1:6379/1"
+)
+# default and maximum number of days of courier daily income timeline
+ACCOUNTING_DAILY_INCOME_TIMELINE_DEFAULT_DAYS = env.int(
+    "ACCOUNTING_DAILY_INCOME_TIMELINE_DEFAULT_DAYS", default=30
+)
+ACCOUNTING_DAILY_INCOME_TIMELINE_MAX_DAYS = env.int(
+    "ACCOUNTING_DAILY_INCOME_TIMELINE_MAX_DAYS", default=366
+)
+# accumulate incomes in redis and flush them to daily incomes periodically,
+# instead of updating daily income of each income
+ACCOUNTING_DAILY_INCOME_WRITE_BEHIND = env.bool(
+    "ACCOUNTING_DAILY_INCOME_WRITE_BEHIND", default=False
+)
+ACCOUNTING_DAILY_INCOME_REDIS_URL = env(
+    "ACCOUNTING_DAILY_INCOME_REDIS_URL", default="redis://127.0.0.1:6379/2"
+)
+# number of stripes that daily income of a courier is split into, to reduce contention
+# of concurrent incomes of a courier, stripes are folded into daily incomes periodically
+ACCOUNTING_DAILY_INCOME_STRIPES = env.int("ACCOUNTING_DAILY_INCOME_STRIPES", default=1)
+# update daily income of new incomes by a celery task after they are committed,
+# instead of in the same transaction
+ACCOUNTING_DAILY_INCOME_ASYNC = env.bool("ACCOUNTING_DAILY_INCOME_ASYNC", default=False)
+# enqueue async daily income updates to a batch task, that is flushed every
+# ACCOUNTING_DAILY_INCOME_BATCH_SIZE messages or ACCOUNTING_DAILY_INCOME_BATCH_INTERVAL_MS
+ACCOUNTING_DAILY_INCOME_BATCHES = env.bool(
+    "ACCOUNTING_DAILY_INCOME_BATCHES", default=False
+)
+ACCOUNTING_DAILY_INCOME_BATCH_SIZE = env.int(
+    "ACCOUNTING_DAILY_INCOME_BATCH_SIZE", default=500
+)
+ACCOUNTING_DAILY_INCOME_BATCH_INTERVAL_MS = env.int(
+    "ACCOUNTING_DAILY_INCOME_BATCH_INTERVAL_MS", default=200
+)
+# repair daily incomes of unbalanced couriers found by check_daily_balance
+ACCOUNTING_DAILY_BALANCE_REPAIR = env.bool(
+    "ACCOUNTING_DAILY_BALANCE_REPAIR", default=False
+)
+# reconcile daily incomes with new incomes continuously by reconcile_incomes task,
+# in windows of ACCOUNTING_RECONCILIATION_WINDOW seconds, until
+# ACCOUNTING_RECONCILIATION_DELAY seconds ago, instead of checking yesterday at night
+ACCOUNTING_INCREMENTAL_RECONCILIATION = env.bool(
+    "ACCOUNTING_INCREMENTAL_RECONCILIATION", default=False
+)
+ACCOUNTING_RECONCILIATION_WINDOW = env.int(
+    "ACCOUNTING_RECONCILIATION_WINDOW", default=60 * 60
+)
+ACCOUNTING_RECONCILIATION_DELAY = env.int(
+    "ACCOUNTING_RECONCILIATION_DELAY", default=20 * 60
+)
+# number of months after current month that Income partitions are created for,
+# by maintain_income_partitions task on PostgreSQL
+ACCOUNTING_INCOME_PARTITIONS_AHEAD = env.int(
+    "ACCOUNTING_INCOME_PARTITIONS_AHEAD", default=3
+)
+# number of months before current month that Income partitions are kept attached,
+# older partitions are detached to ACCOUNTING_INCOME_ARCHIVE_SCHEMA, 0 keeps all of them,
+# partitions with active incomes or not archived months, if archiving is enabled, are kept
+ACCOUNTING_INCOME_RETENTION_MONTHS = env.int(
+    "ACCOUNTING_INCOME_RETENTION_MONTHS", default=24
+)
+ACCOUNTING_INCOME_ARCHIVE_SCHEMA = env(
+    "ACCOUNTING_INCOME_ARCHIVE_SCHEMA", default="archive"
+)
+# processed incomes of months older than ACCOUNTING_INCOME_ARCHIVE_MONTHS are moved to
+# Arrow IPC files in ACCOUNTING_INCOME_ARCHIVE_DIR by archive_incomes task, 0 disables it
+ACCOUNTING_INCOME_ARCHIVE_MONTHS = env.int(
+    "ACCOUNTING_INCOME_ARCHIVE_MONTHS", default=0
+)
+ACCOUNTING_INCOME_ARCHIVE_DIR = env(
+    "ACCOUNTING_INCOME_ARCHIVE_DIR", default=str(ROOT_DIR / "archives")
+)
+# compression of archive files, lz4 or zstd, empty for uncompressed files
+# that are read without copying them to memory
+ACCOUNTING_INCOME_ARCHIVE_COMPRESSION = env(
+    "ACCOUNTING_INCOME_ARCHIVE_COMPRESSION", default="zstd"
+)
+# number of incomes that are fetched and written to archive at once
+ACCOUNTING_INCOME_ARCHIVE_CHUNK_SIZE = env.int(
+    "ACCOUNTING_INCOME_ARCHIVE_CHUNK_SIZE", default=50_000
+)
+# number of archived incomes that are deleted in one transaction
+ACCOUNTING_INCOME_ARCHIVE_DELETE_BATCH_SIZE = env.int(
+    "ACCOUNTING_INCOME_ARCHIVE_DELETE_BATCH_SIZE", default=5_000
+)
+# time limits of archive_incomes task in seconds, writing a month of incomes takes
+# longer than CELERY_TASK_SOFT_TIME_LIMIT, the task is resumed on the next run
+ACCOUNTING_INCOME_ARCHIVE_SOFT_TIME_LIMIT = env.int(
+    "ACCOUNTING_INCOME_ARCHIVE_SOFT_TIME_LIMIT", default=50 * 60
+)
+ACCOUNTING_INCOME_ARCHIVE_TIME_LIMIT = env.int(
+    "ACCOUNTING_INCOME_ARCHIVE_TIME_LIMIT", default=55 * 60
+)
+# database that reporting tasks, check_daily_balance and reconcile_incomes,
+# read from, e.g. replica
+ACCOUNTING_REPORTS_DATABASE = env("ACCOUNTING_REPORTS_DATABASE", default="default")
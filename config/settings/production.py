@@ -19,6 +19,10 @@ ALLOWED_HOSTS = env.list("DJANGO_ALLOWED_HOSTS", default=["mia.re"])
 # DATABASES
 # ------------------------------------------------------------------------------
 DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=60)  # noqa F405
+if "replica" in DATABASES:  # noqa F405
+    DATABASES["replica"]["CONN_MAX_AGE"] = env.int(  # noqa F405
+        "CONN_MAX_AGE", default=60
+    )
 
 # CACHES
 # ------------------------------------------------------------------------------
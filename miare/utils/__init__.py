@@ -1,7 +1,21 @@
 from miare.utils.date_time import (
+    get_datetime_range,
     get_five_minutes_ago,
+    get_month_start,
+    get_next_month_start,
     get_this_and_past_saturday,
+    get_week_start,
     get_yesterday_date,
+    split_date_range,
 )
 
-__all__ = [get_yesterday_date, get_this_and_past_saturday, get_five_minutes_ago]
+__all__ = [
+    get_yesterday_date,
+    get_this_and_past_saturday,
+    get_five_minutes_ago,
+    get_datetime_range,
+    get_week_start,
+    get_month_start,
+    get_next_month_start,
+    split_date_range,
+]
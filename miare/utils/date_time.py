@@ -1,5 +1,7 @@
 import datetime
 
+from django.utils import timezone
+
 SATURDAY = 5
 
 
@@ -13,5 +15,61 @@ def get_this_and_past_saturday():
     return this_saturday, past_saturday
 
 
+def get_week_start(date):
+    """Return saturday that week of date is started on"""
+    return date - datetime.timedelta(days=(date.weekday() - SATURDAY) % 7)
+
+
 def get_five_minutes_ago():
     return datetime.datetime.now() - datetime.timedelta(minutes=5)
+
+
+def get_datetime_range(date):
+    """Return half-open datetime range [start, end) of date in current timezone"""
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    end = timezone.make_aware(
+        datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min)
+    )
+    return start, end
+
+
+def get_month_start(date):
+    return date.replace(day=1)
+
+
+def get_next_month_start(date):
+    return (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def split_date_range(start, stop, closed_before):
+    """Split half-open date range [start, stop) into the fewest whole years, months and days
+
+    only years and months that end before closed_before are whole,
+    the rest of range is split into days
+
+    Returns:
+        Tuple[List[Tuple[Date, Date]], List[Date], List[Date]]:
+            half-open ranges of days, start of months and start of years
+    """
+    days: list[tuple[datetime.date, datetime.date]] = []
+    months: list[datetime.date] = []
+    years: list[datetime.date] = []
+    closed_stop = min(stop, closed_before)
+    cursor = start
+    while cursor < stop:
+        next_year = datetime.date(cursor.year + 1, 1, 1)
+        next_month = get_next_month_start(cursor)
+        if cursor == datetime.date(cursor.year, 1, 1) and next_year <= closed_stop:
+            years.append(cursor)
+            cursor = next_year
+        elif cursor.day == 1 and next_month <= closed_stop:
+            months.append(cursor)
+            cursor = next_month
+        else:
+            days_stop = min(next_month, stop) if cursor < closed_stop else stop
+            if days and days[-1][1] == cursor:
+                days[-1] = (days[-1][0], days_stop)
+            else:
+                days.append((cursor, days_stop))
+            cursor = days_stop
+    return days, months, years